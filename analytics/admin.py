@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, Store, PriceRecord, ShoppingList
+from .models import Category, Product, Store, PriceRecord, ShoppingList, ImportJob, DailyPriceStat, ProductForecast, ForecastRun, PriceInterval, CurrentPrice, PriceWatch, PriceAlert
 
 
 @admin.register(Category)
@@ -25,7 +25,55 @@ class PriceRecordAdmin(admin.ModelAdmin):
     list_filter = ('store', 'date_recorded')
     search_fields = ('product__name', 'store__name')
 
+@admin.register(PriceInterval)
+class PriceIntervalAdmin(admin.ModelAdmin):
+    list_display = ('product', 'store', 'price', 'valid_from', 'valid_to')
+    list_filter = ('store', 'valid_to')
+    search_fields = ('product__name', 'store__name')
+
 @admin.register(ShoppingList)
 class ShoppingListAdmin(admin.ModelAdmin):
     list_display = ('user', 'created_at')
     search_fields = ('user__username',)
+
+@admin.register(PriceWatch)
+class PriceWatchAdmin(admin.ModelAdmin):
+    list_display = ('user', 'product', 'store', 'threshold', 'is_active', 'created_at')
+    list_filter = ('is_active', 'store')
+    search_fields = ('user__username', 'product__name')
+    raw_id_fields = ('product',)
+
+@admin.register(PriceAlert)
+class PriceAlertAdmin(admin.ModelAdmin):
+    list_display = ('watch', 'store', 'price', 'date_recorded', 'created_at', 'sent_at')
+    list_filter = ('sent_at', 'store')
+    search_fields = ('watch__user__username', 'watch__product__name')
+    raw_id_fields = ('watch',)
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'file', 'status', 'rows_processed', 'records_written', 'rows_rejected', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('started_at', 'finished_at')
+
+@admin.register(DailyPriceStat)
+class DailyPriceStatAdmin(admin.ModelAdmin):
+    list_display = ('day', 'store', 'category', 'record_count', 'price_sum', 'price_min', 'price_max')
+    list_filter = ('store', 'category')
+    date_hierarchy = 'day'
+
+@admin.register(CurrentPrice)
+class CurrentPriceAdmin(admin.ModelAdmin):
+    list_display = ('product', 'store', 'price', 'date_recorded')
+    list_filter = ('store',)
+    search_fields = ('product__name', 'store__name')
+
+@admin.register(ProductForecast)
+class ProductForecastAdmin(admin.ModelAdmin):
+    list_display = ('product', 'model_status', 'predicted_price', 'trend', 'r2_score', 'computed_at')
+    list_filter = ('model_status',)
+    search_fields = ('product__name',)
+
+@admin.register(ForecastRun)
+class ForecastRunAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'cutoff', 'finished_at', 'products', 'full')
@@ -0,0 +1,59 @@
+"""
+Price-drop alerts.
+
+A PriceWatch asks to be told when a product costs less than its threshold, in
+one store or in any store. After the current prices of an import batch are
+refreshed (see analytics.rollups), match_price_alerts joins them with the active
+watches of the touched products and inserts a PriceAlert per match into the
+outbox, with one INSERT ... SELECT per chunk of products.
+
+A watch is notified again for a store only when the price there falls below the
+lowest price it was already notified of, so re-imports and unchanged prices do
+not repeat alerts.
+"""
+from django.db import connection, transaction
+from django.db.models import DateTimeField, Exists, F, OuterRef, Q, Value
+from django.utils import timezone
+
+from .intervals import _in_lookup_size
+from .models import CurrentPrice, PriceAlert
+
+
+def _matches(product_ids):
+    """Current prices under the threshold of an active watch, annotated with watch_id."""
+    notified = PriceAlert.objects.filter(watch=OuterRef('watch_id'), store=OuterRef('store'), price__lte=OuterRef('price'))
+    return (
+        CurrentPrice.objects.filter(
+            Q(product__watches__store__isnull=True) | Q(product__watches__store=F('store')),
+            product_id__in=product_ids,
+            product__watches__is_active=True,
+            price__lt=F('product__watches__threshold'),
+        )
+        .annotate(watch_id=F('product__watches__id'))
+        .filter(~Exists(notified))
+    )
+
+
+def match_price_alerts(product_ids):
+    """Writes the alerts triggered by the current prices of the given products. Returns the number written."""
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return 0
+    # INSERT ... SELECT: the matches go from the join straight into the outbox. Model fields
+    # come before annotations (in annotate() order): Django before 5.2 selects them in that
+    # order whatever the values_list() order, so the INSERT columns must follow it
+    columns = ['store_id', 'price', 'date_recorded', 'watch_id', 'created_at']
+    target = ', '.join(connection.ops.quote_name(column) for column in columns)
+    insert = f'INSERT INTO {connection.ops.quote_name(PriceAlert._meta.db_table)} ({target}) '
+    now = Value(timezone.now(), output_field=DateTimeField())
+
+    # Two more parameters besides the ids: the EXISTS constant and created_at
+    size = _in_lookup_size() - 2
+    written = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(product_ids), size):
+            matches = _matches(product_ids[i:i + size]).annotate(created_at=now).values_list(*columns)
+            sql, params = matches.query.sql_with_params()
+            cursor.execute(insert + sql, params)
+            written += cursor.rowcount
+    return written
@@ -13,4 +13,5 @@ class AnalyticsConfig(AppConfig):
 
     def ready(self):
         import analytics.crud
+        import analytics.signals
         post_migrate.connect(seed_data, sender=self)
@@ -0,0 +1,22 @@
+"""
+Query budgets of the views.
+
+Every view declares with @query_budget the most SQL queries one request may run.
+The budget is a constant: it has to hold for any number of stores, products and
+days, so a query per store, product or day in a view or its template (an N+1)
+breaks it as soon as the data grows. analytics.tests renders each view against
+two dataset sizes and fails when a count exceeds the budget or grows with the data.
+"""
+
+
+def query_budget(max_queries):
+    """Declares the most SQL queries one request of the decorated view may run."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def get_query_budget(view):
+    """Budget declared by a view, None if it has none."""
+    return getattr(view, 'query_budget', None)
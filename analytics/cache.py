@@ -0,0 +1,58 @@
+"""
+Cache for computed analytics payloads.
+
+Cache keys embed a global price data version. Every committed PriceRecord write
+replaces the version (see rollups.mark_dirty), so payloads computed from older
+data are never read again and simply expire.
+"""
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import cache
+
+DATA_VERSION_KEY = 'analytics:price-data-version'
+PAYLOAD_TIMEOUT = 24 * 60 * 60
+
+# Set inside bypass_payload_cache(), e.g. while a request is profiled
+_bypass = ContextVar('analytics_payload_cache_bypass', default=False)
+
+
+def get_data_version():
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        # A fresh random version: nothing cached under an evicted one can match it
+        cache.add(DATA_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(DATA_VERSION_KEY)
+    return version
+
+
+def bump_data_version():
+    cache.set(DATA_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def payload_key(name, *params):
+    parts = [str(param) if param not in (None, '') else '-' for param in params]
+    return ':'.join(['analytics', name, get_data_version()] + parts)
+
+
+def get_cached_payload(name, params, compute, timeout=PAYLOAD_TIMEOUT):
+    """Returns compute() for the given params, cached until the price data changes."""
+    if _bypass.get():
+        return compute()
+    key = payload_key(name, *params)
+    payload = cache.get(key)
+    if payload is None:
+        payload = compute()
+        cache.set(key, payload, timeout)
+    return payload
+
+
+@contextmanager
+def bypass_payload_cache():
+    """Payloads are computed inside the block, neither read from nor written to the cache."""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
@@ -0,0 +1,270 @@
+"""
+In-process price cube for the analytics reads (settings.PRICE_CUBE).
+
+The dashboard, home trend, category index and store baskets are all slices of
+the same product x store x day prices. The cube keeps them reduced to what those
+reads need, as dense NumPy arrays with index maps from ids and dates:
+
+* sums (in cents) and counts of prices per category x store x day,
+* the latest price and day of every (product, store) pair, for the baskets.
+
+Both are already maintained in the database by analytics.rollups, as the
+DailyPriceStat rollup and CurrentPrice, so the cube is built from those two
+tables and never reads the price history. Reads are array slices and sums
+instead of SQL and pandas.
+
+A cube belongs to a price data version (see analytics.cache). Requests never
+build one: when the version changed, current_price_cube() starts a background
+build and returns None until it is done, and the reads use the rollup meanwhile.
+Commands build it on their own thread with get_price_cube(); warm_dashboard_cache
+does it after every import. With settings.PRICE_CUBE_DIR the arrays are written
+once per version as .npy files and memory-mapped by every worker, so the
+processes share the same pages.
+"""
+import logging
+import os
+import shutil
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+
+from .cache import get_data_version
+from .models import CurrentPrice, DailyPriceStat
+
+logger = logging.getLogger(__name__)
+
+LOAD_CHUNK_SIZE = 5000
+CUBE_ARRAYS = [
+    'category_ids', 'store_ids', 'start', 'cents', 'counts',
+    'pair_categories', 'pair_stores', 'latest_cents', 'latest_days',
+]
+
+# Cube of the current worker, replaced when the data version changes
+_lock = threading.Lock()
+_cube = None
+# Data version being built by the background thread, if any
+_building_lock = threading.Lock()
+_building = None
+
+
+def price_cube_enabled():
+    return getattr(settings, 'PRICE_CUBE', False)
+
+
+class PriceCube:
+    """
+    cents[c, s, d] and counts[c, s, d] are the sum of prices in cents and the number of
+    prices of category_ids[c] in store_ids[s] on start_date + d days. Pair i is a
+    (product, store) with its latest price latest_cents[i] on day latest_days[i].
+    """
+
+    def __init__(self, arrays, version=None):
+        for name in CUBE_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.version = version
+        self.start_date = date.fromordinal(int(self.start))
+        self.n_days = self.cents.shape[2]
+        self._store_index = {store_id: i for i, store_id in enumerate(self.store_ids.tolist())}
+        self._category_index = {category_id: i for i, category_id in enumerate(self.category_ids.tolist())}
+        # Marginal over the categories, for reads without a category filter
+        self._store_cents = self.cents.sum(axis=0)
+        self._store_counts = self.counts.sum(axis=0, dtype=np.int64)
+        self.total_records = int(self._store_counts.sum())
+
+    @property
+    def end_date(self):
+        return self.start_date + timedelta(days=self.n_days - 1)
+
+    def _offset(self, day):
+        return (day - self.start_date).days
+
+    def _cells(self, store_id=None, category_id=None):
+        """(category, store) index selections for the filters, empty if an id has no prices."""
+        categories = stores = slice(None)
+        if category_id:
+            category = self._category_index.get(int(category_id))
+            categories = [] if category is None else [category]
+        if store_id:
+            store = self._store_index.get(int(store_id))
+            stores = [] if store is None else [store]
+        return categories, stores
+
+    def _window(self, start_date, end_date, store_id=None, category_id=None):
+        """
+        Store ids with (store, day) arrays of cents and counts of the filtered cells,
+        reindexed to the calendar days [start_date, end_date].
+        """
+        categories, stores = self._cells(store_id, category_id)
+        if categories == slice(None):
+            cents, counts = self._store_cents, self._store_counts
+        elif categories:
+            cents, counts = self.cents[categories[0]], self.counts[categories[0]]
+        else:
+            cents, counts = np.zeros_like(self._store_cents), np.zeros_like(self._store_counts)
+        cents, counts = cents[stores], counts[stores]
+
+        n = max((end_date - start_date).days + 1, 0)
+        window_cents = np.zeros((len(cents), n), dtype=np.int64)
+        window_counts = np.zeros((len(counts), n), dtype=np.int64)
+        first = max(self._offset(start_date), 0)
+        last = min(self._offset(end_date), self.n_days - 1)
+        if first <= last:
+            target = slice(first - self._offset(start_date), last - self._offset(start_date) + 1)
+            window_cents[:, target] = cents[:, first:last + 1]
+            window_counts[:, target] = counts[:, first:last + 1]
+        return self.store_ids[stores], window_cents, window_counts
+
+    def daily_totals(self, start_date, end_date, store_id=None, category_id=None):
+        """Sum (in rubles) and number of prices per calendar day in [start_date, end_date]."""
+        _, cents, counts = self._window(start_date, end_date, store_id, category_id)
+        return cents.sum(axis=0) / 100, counts.sum(axis=0)
+
+    def store_daily_totals(self, start_date, end_date, store_id=None, category_id=None):
+        """Like daily_totals, per store: (store_ids, sums, counts) with one row per store."""
+        store_ids, cents, counts = self._window(start_date, end_date, store_id, category_id)
+        return store_ids, cents / 100, counts
+
+    def store_baskets(self, start_date, category_id=None):
+        """Latest price of every product per store, for products priced since start_date."""
+        current = self.latest_days >= self._offset(start_date)
+        if category_id:
+            category = self._category_index.get(int(category_id))
+            if category is None:
+                return []
+            current &= self.pair_categories == category
+        stores = self.pair_stores[current]
+        totals = np.bincount(stores, weights=self.latest_cents[current], minlength=len(self.store_ids))
+        counts = np.bincount(stores, minlength=len(self.store_ids))
+        return [
+            {'store_id': store_id, 'total': Decimal(int(total)).scaleb(-2), 'count': count}
+            for store_id, total, count in zip(self.store_ids.tolist(), totals.tolist(), counts.tolist())
+            if count
+        ]
+
+
+def _columns(rows, count):
+    """Columns of a list of row tuples as NumPy arrays, empty arrays for no rows."""
+    if not rows:
+        return [np.empty(0) for _ in range(count)]
+    return [np.array(column) for column in zip(*rows)]
+
+
+def build_arrays():
+    """Reduces the DailyPriceStat rollup and CurrentPrice to the CUBE_ARRAYS."""
+    stats = DailyPriceStat.objects.values_list('category_id', 'store_id', 'day', 'price_sum', 'record_count')
+    stat_categories, stat_stores, stat_days, stat_sums, stat_counts = _columns([
+        (category_id, store_id, day.toordinal(), float(price_sum), record_count)
+        for category_id, store_id, day, price_sum, record_count in stats.iterator(chunk_size=LOAD_CHUNK_SIZE)
+    ], 5)
+    current = CurrentPrice.objects.values_list('product__category_id', 'store_id', 'date_recorded', 'price')
+    pair_categories, pair_stores, pair_days, pair_prices = _columns([
+        (category_id, store_id, day.toordinal(), float(price))
+        for category_id, store_id, day, price in current.iterator(chunk_size=LOAD_CHUNK_SIZE)
+    ], 4)
+
+    category_ids = np.unique(np.concatenate([stat_categories, pair_categories]).astype(np.int64))
+    store_ids = np.unique(np.concatenate([stat_stores, pair_stores]).astype(np.int64))
+    days = np.concatenate([stat_days, pair_days]).astype(np.int64)
+    start = int(days.min()) if len(days) else date.today().toordinal()
+    shape = (len(category_ids), len(store_ids), int(days.max()) - start + 1 if len(days) else 0)
+
+    # Whole cents keep the sums exact, like the Decimal sums of the rollup
+    cents = np.zeros(shape, dtype=np.int64)
+    counts = np.zeros(shape, dtype=np.int32)
+    cells = (
+        np.searchsorted(category_ids, stat_categories),
+        np.searchsorted(store_ids, stat_stores),
+        stat_days.astype(np.int64) - start,
+    )
+    cents[cells] = np.rint(stat_sums * 100)
+    counts[cells] = stat_counts
+
+    return {
+        'category_ids': category_ids,
+        'store_ids': store_ids,
+        'start': np.array(start),
+        'cents': cents,
+        'counts': counts,
+        'pair_categories': np.searchsorted(category_ids, pair_categories),
+        'pair_stores': np.searchsorted(store_ids, pair_stores),
+        'latest_cents': np.rint(pair_prices * 100).astype(np.int64),
+        'latest_days': (pair_days.astype(np.int64) - start).astype(np.int32),
+    }
+
+
+def _load_shared(directory, version):
+    """Memory-maps the cube of this data version, writing it first if no worker has yet."""
+    path = os.path.join(directory, f'cube-{version}')
+    if not os.path.isdir(path):
+        os.makedirs(directory, exist_ok=True)
+        arrays = build_arrays()
+        # Written next to the final path and renamed, so readers never see a partial cube
+        partial = f'{path}.{os.getpid()}.tmp'
+        os.makedirs(partial, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(partial, f'{name}.npy'), array)
+        try:
+            os.rename(partial, path)
+        except OSError:
+            # Another worker was first
+            shutil.rmtree(partial, ignore_errors=True)
+        _remove_old_versions(directory, version)
+    return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in CUBE_ARRAYS}
+
+
+def _remove_old_versions(directory, version):
+    # Workers that still map an old file keep its pages until they reload
+    for name in os.listdir(directory):
+        if name.startswith('cube-') and name != f'cube-{version}' and not name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def get_price_cube():
+    """The cube of the current price data version, loaded once per worker and built on this thread if needed."""
+    global _cube
+    version = get_data_version()
+    cube = _cube
+    if cube is not None and cube.version == version:
+        return cube
+    with _lock:
+        if _cube is None or _cube.version != version:
+            directory = getattr(settings, 'PRICE_CUBE_DIR', None)
+            arrays = _load_shared(str(directory), version) if directory else build_arrays()
+            _cube = PriceCube(arrays, version=version)
+        return _cube
+
+
+def _build_in_background():
+    global _building
+    try:
+        get_price_cube()
+    except Exception:
+        logger.exception('Building the price cube failed')
+    finally:
+        # The thread had its own database connection
+        connections.close_all()
+        with _building_lock:
+            _building = None
+
+
+def current_price_cube():
+    """
+    The cube for a request, None when PRICE_CUBE is off or while the cube of the
+    current data version is being built in the background: read the rollup then.
+    """
+    global _building
+    if not price_cube_enabled():
+        return None
+    cube = _cube
+    version = get_data_version()
+    if cube is not None and cube.version == version:
+        return cube
+    with _building_lock:
+        if _building is None:
+            _building = version
+            threading.Thread(target=_build_in_background, name='price-cube-build', daemon=True).start()
+    return None
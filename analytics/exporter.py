@@ -0,0 +1,212 @@
+"""
+Streaming export of price history as CSV or Parquet.
+
+Rows are read as values_list tuples through a chunked iterator and written to
+the response as they are produced, so memory use does not depend on table size.
+"""
+import csv
+import io
+import itertools
+import zlib
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from .intervals import interval_storage, filter_intervals, iter_export_rows
+from .models import PriceRecord
+
+EXPORT_COLUMNS = ['Product', 'Category', 'Store', 'Price', 'Date']
+EXPORT_FIELDS = ('product__name', 'product__category__name', 'store__name', 'price', 'date_recorded')
+ITERATOR_CHUNK_SIZE = 5000
+ROWS_PER_WRITE = 1000
+PARQUET_ROW_GROUP_SIZE = 100000
+PARQUET_SCHEMA = pa.schema([
+    ('Product', pa.string()),
+    ('Category', pa.string()),
+    ('Store', pa.string()),
+    ('Price', pa.decimal128(10, 2)),  # PriceRecord.price
+    ('Date', pa.date32()),
+])
+
+
+class ExportFilterError(ValueError):
+    pass
+
+
+def _parse_date_param(value, name):
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ExportFilterError(f'{name}: expected YYYY-MM-DD, got {value!r}')
+    return parsed
+
+
+def _parse_id_list(values, name):
+    try:
+        return [int(value) for value in values if value]
+    except ValueError:
+        raise ExportFilterError(f'{name}: expected numeric ids')
+
+
+class IntervalRecords:
+    """Filtered interval storage, exported as one row per day like PriceRecords."""
+
+    def __init__(self, intervals, date_from=None, date_to=None):
+        self.intervals = intervals
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def rows(self):
+        return iter_export_rows(self.intervals, self.date_from, self.date_to, chunk_size=ITERATOR_CHUNK_SIZE)
+
+
+def filter_price_records(params):
+    """
+    Builds the export queryset from query params:
+    date_from / date_to (YYYY-MM-DD), store and category (ids, may repeat),
+    since (ISO datetime watermark: only records written or updated at or after it).
+    In interval storage an IntervalRecords selection is returned instead.
+    """
+    date_from = _parse_date_param(params['date_from'], 'date_from') if params.get('date_from') else None
+    date_to = _parse_date_param(params['date_to'], 'date_to') if params.get('date_to') else None
+    store_ids = _parse_id_list(params.getlist('store'), 'store')
+    category_ids = _parse_id_list(params.getlist('category'), 'category')
+
+    since = None
+    if params.get('since'):
+        try:
+            since = parse_datetime(params['since'])
+        except ValueError:
+            since = None
+        if since is None:
+            # A bare date is accepted as midnight of that day
+            since_date = _parse_date_param(params['since'], 'since')
+            since = datetime.combine(since_date, datetime.min.time())
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.get_default_timezone())
+
+    if interval_storage():
+        intervals = filter_intervals(date_from, date_to, store_ids=store_ids, category_ids=category_ids, since=since)
+        return IntervalRecords(intervals, date_from, date_to)
+
+    records = PriceRecord.objects.all()
+    if date_from:
+        records = records.filter(date_recorded__gte=date_from)
+    if date_to:
+        records = records.filter(date_recorded__lte=date_to)
+    if store_ids:
+        records = records.filter(store_id__in=store_ids)
+    if category_ids:
+        records = records.filter(product__category_id__in=category_ids)
+    if since:
+        records = records.filter(updated_at__gte=since)
+    return records
+
+
+def iter_csv(records):
+    """Yields the CSV export of a PriceRecord queryset in chunks of ROWS_PER_WRITE rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    if isinstance(records, IntervalRecords):
+        rows = records.rows()
+    else:
+        rows = records.values_list(*EXPORT_FIELDS).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= ROWS_PER_WRITE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def iter_gzip(chunks, encoding='utf-8'):
+    """Compresses a stream of text chunks into a single gzip member."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode(encoding))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to a streaming response."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _rows_to_table(rows):
+    # Raw DB values are converted column-wise by Arrow, e.g. ISO date strings to date32
+    columns = list(zip(*rows))
+    prices = pa.array(columns[3])
+    if not pa.types.is_decimal(prices.type):
+        # SQLite returns REAL or, for whole prices, INTEGER; Arrow rounds floats to the cent
+        prices = prices.cast(pa.float64())
+    arrays = [
+        pa.array(columns[0], pa.string()),
+        pa.array(columns[1], pa.string()),
+        pa.array(columns[2], pa.string()),
+        prices.cast(PARQUET_SCHEMA.field('Price').type),
+        pa.array(columns[4]).cast(pa.date32()),
+    ]
+    return pa.Table.from_arrays(arrays, schema=PARQUET_SCHEMA)
+
+
+def _iter_parquet_rows(rows, row_group_size):
+    sink = _StreamSink()
+    with pq.ParquetWriter(sink, PARQUET_SCHEMA) as writer:
+        while True:
+            batch = list(itertools.islice(rows, row_group_size))
+            if not batch:
+                break
+            writer.write_table(_rows_to_table(batch), row_group_size=row_group_size)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_parquet(records, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """Yields a Parquet file with one row group per row_group_size records."""
+    if isinstance(records, IntervalRecords):
+        yield from _iter_parquet_rows(records.rows(), row_group_size)
+        return
+    sql, params = records.values_list(*EXPORT_FIELDS).query.sql_with_params()
+    sink = _StreamSink()
+    with connections[records.db].cursor() as cursor, pq.ParquetWriter(sink, PARQUET_SCHEMA) as writer:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(row_group_size)
+            if not rows:
+                break
+            writer.write_table(_rows_to_table(rows), row_group_size=row_group_size)
+            yield sink.drain()
+    yield sink.drain()
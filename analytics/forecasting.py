@@ -0,0 +1,234 @@
+"""
+Batch linear price forecasts.
+
+Every product gets an ordinary least squares fit of price against date over the
+last FORECAST_WINDOW_DAYS days. Instead of fitting one model per product, the
+records are summed into product x day matrices (count, sum of prices, sum of
+squared prices) and slope, intercept and R^2 of all products are computed at
+once from the closed-form solution. Several records of one product on the same
+day (different stores) stay separate observations, exactly as in a per-record fit.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .importer import _in_lookup_size
+from .intervals import interval_storage, daily_price_frame
+from .models import ForecastRun, PriceRecord, PriceInterval, Product, ProductForecast
+
+FORECAST_WINDOW_DAYS = 90
+FORECAST_DAYS_AHEAD = 30
+MIN_OBSERVATIONS = 5
+SHARDS_PER_WORKER = 4
+WRITE_BATCH_SIZE = 1000
+# Writes still in flight when a run starts commit later with an earlier timestamp,
+# so the cutoff of a run lags behind its start
+CUTOFF_LAG = timedelta(minutes=5)
+
+
+def load_observations(start_date, end_date, product_ids=None):
+    """Returns (product_ids, day offsets from start_date, prices) arrays of the records in the window."""
+    if interval_storage():
+        daily = daily_price_frame(start_date, end_date, product_ids=product_ids)
+        days = (daily['date_recorded'].to_numpy() - np.datetime64(start_date, 'D')).astype('timedelta64[D]')
+        return (
+            daily['product_id'].to_numpy(dtype=np.int64),
+            days.astype(np.int64),
+            daily['price'].to_numpy(dtype=np.float64),
+        )
+    records = PriceRecord.objects.filter(date_recorded__gte=start_date, date_recorded__lte=end_date)
+    if product_ids is not None:
+        if len(product_ids) <= _in_lookup_size():
+            records = records.filter(product_id__in=product_ids)
+        else:
+            # Too many ids to bind: read their id range and drop the others below
+            records = records.filter(product_id__gte=min(product_ids), product_id__lte=max(product_ids))
+    rows = list(records.values_list('product_id', 'date_recorded', 'price').iterator(chunk_size=5000))
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+    products, days, prices = zip(*rows)
+    start_ordinal = start_date.toordinal()
+    products = np.array(products, dtype=np.int64)
+    days = np.array([day.toordinal() - start_ordinal for day in days], dtype=np.int64)
+    prices = np.array(prices, dtype=np.float64)
+    if product_ids is not None:
+        wanted = np.isin(products, np.fromiter(product_ids, dtype=np.int64))
+        products, days, prices = products[wanted], days[wanted], prices[wanted]
+    return products, days, prices
+
+
+def fit_trends(products, days, prices, n_days):
+    """
+    Grouped OLS of price on day offset.
+    Returns (product_ids, observations, slope, intercept, r2) arrays, one entry per product.
+    """
+    product_ids, first, rows = np.unique(products, return_index=True, return_inverse=True)
+    # Prices are shifted by each product's first price to keep the sums of squares small
+    offset = prices[first]
+    prices = prices - offset[rows]
+    cells = rows * n_days + days
+    shape = (len(product_ids), n_days)
+    size = shape[0] * shape[1]
+
+    # product x day matrices of sufficient statistics
+    count = np.bincount(cells, minlength=size).reshape(shape).astype(np.float64)
+    price_sum = np.bincount(cells, weights=prices, minlength=size).reshape(shape)
+    price_sq_sum = np.bincount(cells, weights=prices * prices, minlength=size).reshape(shape)
+
+    x = np.arange(n_days, dtype=np.float64)
+    n = count.sum(axis=1)
+    sx = count @ x
+    sxx = count @ (x * x)
+    sy = price_sum.sum(axis=1)
+    sxy = price_sum @ x
+    syy = price_sq_sum.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_x = sxx - sx * sx / n
+        cov_xy = sxy - sx * sy / n
+        var_y = syy - sy * sy / n
+        # All observations on one day: no trend, the fit is the mean price
+        slope = np.where(var_x > 0, cov_xy / var_x, 0.0)
+        intercept = (sy - slope * sx) / n + offset
+
+        residual = np.maximum(var_y - slope * cov_xy, 0.0)
+        # Constant prices are fitted perfectly
+        r2 = np.where(var_y > 0, 1.0 - residual / var_y, 1.0)
+
+    return product_ids, n.astype(np.int64), slope, intercept, r2
+
+
+def forecast_prices(product_ids=None, days_ahead=FORECAST_DAYS_AHEAD, end_date=None):
+    """
+    Forecasts for all products with records in the window, or for the given products.
+    Returns a dict of product_id -> forecast in the get_price_forecast format.
+    """
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=FORECAST_WINDOW_DAYS)
+    n_days = FORECAST_WINDOW_DAYS + 1
+
+    forecasts = {}
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        forecasts = {product_id: {'model_status': 'insufficient_data'} for product_id in product_ids}
+
+    products, days, prices = load_observations(start_date, end_date, product_ids)
+    if not len(products):
+        return forecasts
+
+    fitted_ids, observations, slope, intercept, r2 = fit_trends(products, days, prices, n_days)
+    today = n_days - 1
+    predicted_today = intercept + slope * today
+    predicted_future = intercept + slope * (today + days_ahead)
+    trend_daily = (predicted_future - predicted_today) / days_ahead
+
+    for i, product_id in enumerate(fitted_ids.tolist()):
+        if observations[i] < MIN_OBSERVATIONS:
+            forecasts[product_id] = {'model_status': 'insufficient_data'}
+            continue
+        forecasts[product_id] = {
+            'model_status': 'success',
+            'r2_score': round(float(r2[i]), 2),
+            'predicted_price': round(float(predicted_future[i]), 2),
+            'trend': round(float(trend_daily[i]), 2), # Daily change in Rubles
+            'dates': [],
+            'prices': [],
+        }
+    return forecasts
+
+
+def stale_product_ids():
+    """
+    Products whose stored forecast may be out of date: products with prices written,
+    deleted or moved since the cutoff of the last run, and products without a forecast.
+    """
+    last_run = ForecastRun.objects.order_by('-started_at').first()
+    if last_run is None:
+        return sorted(Product.objects.values_list('id', flat=True))
+    prices = PriceInterval.objects if interval_storage() else PriceRecord.objects
+    written = prices.filter(updated_at__gte=last_run.cutoff).values_list('product_id', flat=True).distinct()
+    changed = ProductForecast.objects.filter(prices_changed_at__gte=last_run.cutoff).values_list('product_id', flat=True)
+    missing = Product.objects.filter(forecast__isnull=True).values_list('id', flat=True)
+    return sorted(set(written) | set(changed) | set(missing))
+
+
+def _forecast_shard(args):
+    product_ids, days_ahead, end_date = args
+    return forecast_prices(product_ids, days_ahead=days_ahead, end_date=end_date)
+
+
+def _fork_context():
+    # Workers inherit the configured Django process; without fork (Windows) shards run in-process
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def _save_forecasts(forecasts, days_ahead, computed_at):
+    rows = []
+    for product_id, forecast in forecasts.items():
+        rows.append(ProductForecast(
+            product_id=product_id,
+            model_status=forecast['model_status'],
+            r2_score=forecast.get('r2_score'),
+            predicted_price=forecast.get('predicted_price'),
+            trend=forecast.get('trend'),
+            days_ahead=days_ahead,
+            computed_at=computed_at,
+        ))
+    ProductForecast.objects.bulk_create(
+        rows,
+        batch_size=WRITE_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['model_status', 'r2_score', 'predicted_price', 'trend', 'days_ahead', 'computed_at'],
+    )
+
+
+def refresh_forecasts(full=False, workers=None, days_ahead=FORECAST_DAYS_AHEAD):
+    """
+    Recomputes stored forecasts of stale products (of all products with full=True).
+    Products are split into contiguous id ranges that are fitted in a process pool.
+    Returns the number of products recomputed. The run is recorded as a ForecastRun,
+    whose cutoff, taken before any price is read, starts the next incremental run.
+    """
+    computed_at = timezone.now()
+    cutoff = computed_at - CUTOFF_LAG
+    end_date = date.today()
+    product_ids = sorted(Product.objects.values_list('id', flat=True)) if full else stale_product_ids()
+    if not product_ids:
+        ForecastRun.objects.create(started_at=computed_at, cutoff=cutoff, finished_at=timezone.now(), full=full)
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    shards = [
+        (shard.tolist(), days_ahead, end_date)
+        for shard in np.array_split(np.array(product_ids, dtype=np.int64), workers * SHARDS_PER_WORKER)
+        if len(shard)
+    ]
+
+    forecasts = {}
+    context = _fork_context()
+    if workers > 1 and len(shards) > 1 and context is not None:
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            for result in pool.map(_forecast_shard, shards):
+                forecasts.update(result)
+    else:
+        for shard in shards:
+            forecasts.update(_forecast_shard(shard))
+
+    # Written together, so an interrupted run leaves the previous run as the cutoff
+    with transaction.atomic():
+        _save_forecasts(forecasts, days_ahead, computed_at)
+        ForecastRun.objects.create(
+            started_at=computed_at, cutoff=cutoff, finished_at=timezone.now(), products=len(forecasts), full=full,
+        )
+    return len(forecasts)
@@ -0,0 +1,431 @@
+"""
+Bulk import engine for price feeds (CSV or Parquet).
+
+Categories, products and stores referenced by a feed are resolved with a
+handful of set-based queries into in-memory name -> id maps, and PriceRecords
+are written with bulk_create in batched transactions.
+"""
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import pandas as pd
+import pyarrow.parquet as pq
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import Category, Product, Store, PriceRecord, ImportJob
+from .rollups import batched_refresh, mark_dirty
+from .intervals import interval_storage, write_price_intervals
+
+# Expected columns: Product, Category, Store, Price, Date
+REQUIRED_COLUMNS = ['Product', 'Category', 'Store', 'Price', 'Date']
+DATE_FORMAT = '%Y-%m-%d'
+SUPPORTED_EXTENSIONS = ('.csv', '.parquet')
+BATCH_SIZE = 5000
+# Rows parsed and committed at a time by background import jobs
+CHUNK_SIZE = 50000
+# A running job whose worker has not committed a chunk for this long is claimed again
+LEASE_SECONDS = 300
+DEFAULT_STORE_URL = 'http://example.com'
+PRICE_RECORD_KEY = ['product_id', 'store_id', 'date_recorded']
+PRICE_RECORD_KEY_FIELDS = ['product', 'store', 'date_recorded']
+MAX_PRICE = 10 ** 8  # PriceRecord.price is max_digits=10, decimal_places=2
+REJECTED_SAMPLE_SIZE = 20
+
+
+def _chunked(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _in_lookup_size():
+    # SQLite caps the number of bound parameters per statement
+    return connection.features.max_query_params or 10000
+
+
+def category_slug(name):
+    # Case and whitespace variants of a name share a slug, and so a category
+    return slugify(name, allow_unicode=True)[:50] or 'category'
+
+
+@dataclass
+class ImportStats:
+    rows_total: int = 0
+    records_written: int = 0
+    rows_skipped: int = 0
+    rows_rejected: int = 0
+    rejected_sample: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_sec(self):
+        if not self.elapsed:
+            return 0.0
+        return self.rows_total / self.elapsed
+
+    def reject(self, mask, lines, reason):
+        """Counts rejected rows and keeps a small sample of (line, reason) for reporting."""
+        count = int(mask.sum())
+        if not count:
+            return
+        self.rows_rejected += count
+        room = REJECTED_SAMPLE_SIZE - len(self.rejected_sample)
+        if room > 0:
+            self.rejected_sample.extend((int(line), reason) for line in lines[mask][:room])
+
+    def as_dict(self):
+        return {
+            'rows_total': self.rows_total,
+            'records_written': self.records_written,
+            'rows_skipped': self.rows_skipped,
+            'rows_rejected': self.rows_rejected,
+            'rejected_sample': self.rejected_sample,
+            'elapsed': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1),
+        }
+
+
+class BulkImporter:
+    """
+    Imports price feed DataFrames with set-based lookups and batched writes.
+    Name -> id maps are kept between calls, so a feed may be fed in chunks.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, stats=None):
+        self.batch_size = batch_size
+        self.stats = stats or ImportStats()
+        self._category_ids = {}
+        self._store_ids = {}
+        self._product_ids = {}
+
+    def import_dataframe(self, df):
+        started = time.perf_counter()
+        try:
+            df = self._clean(df)
+            if not df.empty:
+                self._resolve_references(df)
+                self._write_records(df)
+        finally:
+            self.stats.elapsed += time.perf_counter() - started
+        return self.stats
+
+    def _clean(self, df):
+        missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        self.stats.rows_total += len(df)
+        # Line numbers as seen in the source file (header is line 1)
+        lines = df.index.to_numpy() + 2
+
+        clean = pd.DataFrame(index=df.index)
+        for col in ('Product', 'Category', 'Store'):
+            clean[col] = df[col].astype('string').str.strip()
+        clean['price'] = pd.to_numeric(df['Price'], errors='coerce').round(2)
+        if pd.api.types.is_datetime64_any_dtype(df['Date']):
+            # Typed date columns (Parquet) need no string parsing
+            clean['date_recorded'] = df['Date']
+        else:
+            clean['date_recorded'] = pd.to_datetime(df['Date'], format=DATE_FORMAT, errors='coerce')
+
+        bad_names = clean[['Product', 'Category', 'Store']].fillna('').eq('').any(axis=1)
+        bad_price = ~bad_names & (clean['price'].isna() | (clean['price'] < 0) | (clean['price'] >= MAX_PRICE))
+        bad_date = ~bad_names & ~bad_price & clean['date_recorded'].isna()
+        self.stats.reject(bad_names.to_numpy(), lines, 'empty product, category or store')
+        self.stats.reject(bad_price.to_numpy(), lines, 'invalid price')
+        self.stats.reject(bad_date.to_numpy(), lines, 'invalid date')
+
+        clean = clean[~(bad_names | bad_price | bad_date)]
+        clean['date_recorded'] = clean['date_recorded'].dt.date
+        return clean
+
+    def _resolve_references(self, df):
+        with transaction.atomic():
+            self._resolve_categories(df['Category'].unique())
+            self._resolve_stores(df['Store'].unique())
+            df['category_id'] = df['Category'].map(self._category_ids)
+            keys = df[['Product', 'category_id']].drop_duplicates()
+            self._resolve_products(list(keys.itertuples(index=False, name=None)))
+
+        df['store_id'] = df['Store'].map(self._store_ids)
+        product_ids = pd.Series(self._product_ids, dtype='int64')
+        df['product_id'] = product_ids.reindex(
+            pd.MultiIndex.from_arrays([df['Product'], df['category_id']])
+        ).to_numpy()
+
+    def _resolve_categories(self, names):
+        missing = [name for name in names if name not in self._category_ids]
+        self._fetch_by_name(Category, missing, self._category_ids)
+        # Names without an exact match are looked up by slug, which is unique
+        slugs = {name: category_slug(name) for name in missing if name not in self._category_ids}
+        slug_ids = {}
+        self._fetch_by_slug(set(slugs.values()), slug_ids)
+        new = {}
+        for name, slug in slugs.items():
+            if slug not in slug_ids:
+                new.setdefault(slug, name)
+        if new:
+            # Conflicts are categories created meanwhile by another import
+            Category.objects.bulk_create(
+                [Category(name=name, slug=slug) for slug, name in new.items()],
+                batch_size=self.batch_size,
+                ignore_conflicts=True,
+            )
+            self._fetch_by_slug(list(new), slug_ids)
+        for name, slug in slugs.items():
+            self._category_ids[name] = slug_ids[slug]
+
+    def _resolve_stores(self, names):
+        missing = [name for name in names if name not in self._store_ids]
+        self._fetch_by_name(Store, missing, self._store_ids)
+        new = [name for name in missing if name not in self._store_ids]
+        if new:
+            Store.objects.bulk_create(
+                [Store(name=name, url=DEFAULT_STORE_URL) for name in new],
+                batch_size=self.batch_size,
+            )
+            self._fetch_by_name(Store, new, self._store_ids)
+
+    def _resolve_products(self, keys):
+        missing = [key for key in keys if key not in self._product_ids]
+        self._fetch_products(missing)
+        new = [key for key in missing if key not in self._product_ids]
+        if new:
+            Product.objects.bulk_create(
+                [Product(name=name, category_id=category_id) for name, category_id in new],
+                batch_size=self.batch_size,
+            )
+            self._fetch_products(new)
+
+    def _fetch_by_name(self, model, names, id_map):
+        for chunk in _chunked(names, _in_lookup_size()):
+            # Keep the first (lowest id) row for duplicated names, like get_or_create would find
+            for pk, name in model.objects.filter(name__in=chunk).order_by('-id').values_list('id', 'name'):
+                id_map[name] = pk
+
+    def _fetch_by_slug(self, slugs, id_map):
+        for chunk in _chunked(slugs, _in_lookup_size()):
+            id_map.update((slug, pk) for pk, slug in Category.objects.filter(slug__in=chunk).values_list('id', 'slug'))
+
+    def _fetch_products(self, keys):
+        wanted = set(keys)
+        names = {name for name, _ in keys}
+        for chunk in _chunked(names, _in_lookup_size()):
+            rows = Product.objects.filter(name__in=chunk).order_by('-id').values_list('id', 'name', 'category_id')
+            for pk, name, category_id in rows:
+                if (name, category_id) in wanted:
+                    self._product_ids[(name, category_id)] = pk
+
+    def _write_records(self, df):
+        # A later row for the same product, store and day supersedes earlier ones
+        unique = df.drop_duplicates(subset=PRICE_RECORD_KEY, keep='last')
+        self.stats.rows_skipped += len(df) - len(unique)
+
+        columns = PRICE_RECORD_KEY + ['price']
+        for start in range(0, len(unique), self.batch_size):
+            batch = unique.iloc[start:start + self.batch_size]
+            records = [
+                PriceRecord(product_id=product_id, store_id=store_id, date_recorded=day, price=price)
+                for product_id, store_id, day, price in batch[columns].itertuples(index=False, name=None)
+            ]
+            self.stats.records_written += upsert_price_records(records, batch_size=self.batch_size)
+
+
+def upsert_price_records(records, batch_size=BATCH_SIZE, update_existing=True):
+    """
+    Writes PriceRecords in one transaction with INSERT ... ON CONFLICT on
+    (product, store, date_recorded). Existing rows get the new price, or are
+    left untouched when update_existing is False. Returns the number of rows sent.
+    This is the write path for bulk loads: it also refreshes the daily rollup and current prices,
+    in the same transaction (or at the end of an enclosing rollups.batched_refresh() block).
+    """
+    if not records:
+        return 0
+    # Written prices are upserted into CurrentPrice. Kept existing prices may differ from
+    # the sent ones, so without update_existing the current prices are recomputed instead
+    if update_existing:
+        recompute, prices = (), [(record.product_id, record.store_id, record.date_recorded, record.price) for record in records]
+    else:
+        recompute, prices = {record.product_id for record in records}, ()
+    if interval_storage():
+        with transaction.atomic():
+            keys = write_price_intervals(records, batch_size=batch_size, update_existing=update_existing)
+            mark_dirty(keys, recompute, prices)
+        return len(records)
+    with transaction.atomic():
+        if update_existing:
+            PriceRecord.objects.bulk_create(
+                records,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=PRICE_RECORD_KEY_FIELDS,
+                update_fields=['price', 'updated_at'],
+            )
+        else:
+            PriceRecord.objects.bulk_create(records, batch_size=batch_size, ignore_conflicts=True)
+        # bulk_create sends no signals, so derived tables are refreshed here
+        mark_dirty({(record.date_recorded, record.store_id) for record in records}, recompute, prices)
+    return len(records)
+
+
+def import_prices(df, batch_size=BATCH_SIZE):
+    """
+    Imports a price feed DataFrame (Product, Category, Store, Price, Date columns).
+    Returns ImportStats with written, skipped and rejected row counts and throughput.
+    """
+    return BulkImporter(batch_size=batch_size).import_dataframe(df)
+
+
+def file_format(name):
+    return 'parquet' if name.lower().endswith('.parquet') else 'csv'
+
+
+def count_rows(fileobj, fmt='csv'):
+    """
+    Counts data rows of a feed file without loading it into memory. CSV rows are
+    parsed, so quoted fields spanning several lines count once, like in iter_feed_chunks.
+    """
+    if fmt == 'parquet':
+        return pq.ParquetFile(fileobj).metadata.num_rows
+
+    try:
+        chunks = pd.read_csv(fileobj, chunksize=CHUNK_SIZE, usecols=[0], dtype='string')
+        return sum(len(chunk) for chunk in chunks)
+    except pd.errors.EmptyDataError:
+        return 0
+
+
+def _iter_parquet_frames(fileobj, chunk_size, offset):
+    parquet = pq.ParquetFile(fileobj)
+    # Missing columns are reported by BulkImporter like for CSV
+    columns = [col for col in REQUIRED_COLUMNS if col in parquet.schema_arrow.names]
+    for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+        if offset >= batch.num_rows:
+            offset -= batch.num_rows
+            continue
+        if offset:
+            batch = batch.slice(offset)
+            offset = 0
+        yield batch.to_pandas(date_as_object=False)
+
+
+def iter_feed_chunks(fileobj, fmt='csv', chunk_size=CHUNK_SIZE, offset=0):
+    """
+    Yields DataFrames of at most chunk_size rows, skipping the first offset data rows.
+    Chunks are indexed by their row position in the file.
+    """
+    if fmt == 'parquet':
+        frames = _iter_parquet_frames(fileobj, chunk_size, offset)
+    else:
+        # Keep the header row, skip the data rows before offset
+        frames = pd.read_csv(fileobj, chunksize=chunk_size, skiprows=range(1, offset + 1))
+
+    position = offset
+    for frame in frames:
+        frame.index = pd.RangeIndex(position, position + len(frame))
+        position += len(frame)
+        yield frame
+
+
+def _job_stats(job):
+    return ImportStats(
+        rows_total=job.rows_processed,
+        records_written=job.records_written,
+        rows_skipped=job.rows_skipped,
+        rows_rejected=job.rows_rejected,
+        rejected_sample=[tuple(item) for item in job.rejected_sample],
+        elapsed=job.elapsed,
+    )
+
+
+def _save_job_stats(job, stats):
+    job.rows_processed = stats.rows_total
+    job.records_written = stats.records_written
+    job.rows_skipped = stats.rows_skipped
+    job.rows_rejected = stats.rows_rejected
+    job.rejected_sample = stats.rejected_sample
+    job.elapsed = stats.elapsed
+    job.save(update_fields=[
+        'rows_processed', 'records_written', 'rows_skipped',
+        'rows_rejected', 'rejected_sample', 'elapsed',
+    ])
+
+
+class LeaseLost(Exception):
+    """The lease of an import job expired and another worker claimed it."""
+
+
+def claim_import_job(lease_seconds=LEASE_SECONDS):
+    """
+    Claims the oldest queued job, or a running job whose lease expired, for this
+    worker. Returns None when there is nothing to do.
+    """
+    now = timezone.now()
+    claimable = Q(status=ImportJob.Status.PENDING) | Q(status=ImportJob.Status.RUNNING, lease_expires_at__lt=now)
+    for job in ImportJob.objects.filter(claimable).order_by('created_at')[:10]:
+        lease_expires_at = now + timedelta(seconds=lease_seconds)
+        # Conditional update so that two workers never pick up the same job
+        claimed = ImportJob.objects.filter(claimable, pk=job.pk).update(
+            status=ImportJob.Status.RUNNING, lease_expires_at=lease_expires_at,
+        )
+        if claimed:
+            job.status = ImportJob.Status.RUNNING
+            job.lease_expires_at = lease_expires_at
+            return job
+    return None
+
+
+def _renew_lease(job, lease_seconds):
+    lease_expires_at = timezone.now() + timedelta(seconds=lease_seconds)
+    renewed = ImportJob.objects.filter(
+        pk=job.pk, status=ImportJob.Status.RUNNING, lease_expires_at=job.lease_expires_at,
+    ).update(lease_expires_at=lease_expires_at)
+    if not renewed:
+        raise LeaseLost(f'Import job #{job.pk} was claimed by another worker')
+    job.lease_expires_at = lease_expires_at
+
+
+def run_import_job(job, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, lease_seconds=LEASE_SECONDS):
+    """
+    Processes an ImportJob in fixed-size chunks. Every chunk is committed together
+    with its derived tables, the job progress and a renewed lease, so a job interrupted by a crash is
+    claimed again once its lease expires and resumes after the last committed chunk.
+    """
+    job.status = ImportJob.Status.RUNNING
+    job.started_at = job.started_at or timezone.now()
+    job.error = ''
+    fmt = file_format(job.file.name)
+    if job.total_rows is None:
+        with job.file.open('rb') as fh:
+            job.total_rows = count_rows(fh, fmt)
+    job.save(update_fields=['status', 'started_at', 'error', 'total_rows'])
+
+    importer = BulkImporter(batch_size=batch_size, stats=_job_stats(job))
+    try:
+        with job.file.open('rb') as fh:
+            # Rows committed by a previous run of this job are skipped
+            for chunk in iter_feed_chunks(fh, fmt, chunk_size, offset=job.rows_processed):
+                with transaction.atomic():
+                    _renew_lease(job, lease_seconds)
+                    # The derived tables of the chunk are refreshed once, before it commits
+                    with batched_refresh():
+                        importer.import_dataframe(chunk)
+                    _save_job_stats(job, importer.stats)
+    except LeaseLost:
+        # The job belongs to the worker that claimed it again
+        raise
+    except Exception as e:
+        job.status = ImportJob.Status.FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        raise
+
+    job.status = ImportJob.Status.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    return importer.stats
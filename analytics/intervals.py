@@ -0,0 +1,279 @@
+"""
+Interval storage of prices (settings.PRICE_STORAGE = 'intervals').
+
+Most prices stay the same for days, so instead of one PriceRecord per product,
+store and day a PriceInterval holds a price for a run of consecutive days. An
+import that sees the same price on the day after an interval ends extends that
+interval instead of adding a row. Readers get daily series back through
+expand_intervals / daily_price_frame, which repeat each interval over its days
+with NumPy.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Product, Store, PriceRecord, PriceInterval
+
+STORAGE_DAILY = 'daily'
+STORAGE_INTERVALS = 'intervals'
+BATCH_SIZE = 5000
+ONE_DAY = timedelta(days=1)
+CENT = Decimal('0.01')
+INTERVAL_COLUMNS = ['product_id', 'store_id', 'price', 'valid_from', 'valid_to']
+
+
+def interval_storage():
+    return getattr(settings, 'PRICE_STORAGE', STORAGE_DAILY) == STORAGE_INTERVALS
+
+
+def _in_lookup_size():
+    # SQLite caps the number of bound parameters per statement
+    return connection.features.max_query_params or 10000
+
+
+def delete_all_rows(model):
+    """
+    Empties the table of a model with one plain DELETE: no delete signals, and no
+    collector loading every row first. Refreshing derived tables is up to the caller.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def _to_price(value):
+    return Decimal(str(value)).quantize(CENT)
+
+
+def _load_intervals(keys, start, end):
+    """Intervals of the given (product_id, store_id) keys that overlap or touch [start, end]."""
+    by_key = {}
+    product_ids = sorted({product_id for product_id, _ in keys})
+    size = _in_lookup_size()
+    for i in range(0, len(product_ids), size):
+        intervals = PriceInterval.objects.filter(
+            product_id__in=product_ids[i:i + size],
+            valid_to__gte=start - ONE_DAY,
+            valid_from__lte=end + ONE_DAY,
+        ).order_by('valid_from')
+        for interval in intervals:
+            key = (interval.product_id, interval.store_id)
+            if key in keys:
+                by_key.setdefault(key, []).append(interval)
+    return by_key
+
+
+def _runs(days):
+    """Compresses a {day: price} dict into (valid_from, valid_to, price) runs."""
+    runs = []
+    for day in sorted(days):
+        price = days[day]
+        if runs and runs[-1][1] + ONE_DAY == day and runs[-1][2] == price:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day, price])
+    return runs
+
+
+def write_price_intervals(records, batch_size=BATCH_SIZE, update_existing=True):
+    """
+    Merges daily price observations (PriceRecord instances, not saved) into intervals.
+    Observations after the last interval of a product and store extend it or open a new one;
+    observations inside existing intervals rewrite the affected runs. Existing prices are kept
+    when update_existing is False. Returns the set of touched (day, store_id) rollup cells.
+    """
+    observations = {}
+    for record in records:
+        day = record.date_recorded
+        if hasattr(day, 'date'):
+            day = day.date()
+        observations.setdefault((record.product_id, record.store_id), {})[day] = _to_price(record.price)
+    if not observations:
+        return set()
+
+    all_days = [day for days in observations.values() for day in days]
+    now = timezone.now()
+    to_create, to_delete = [], []
+    to_update = {}
+
+    with transaction.atomic():
+        existing = _load_intervals(set(observations), min(all_days), max(all_days))
+        for (product_id, store_id), days in observations.items():
+            intervals = existing.get((product_id, store_id), [])
+            first_day = min(days)
+
+            if not intervals or first_day > intervals[-1].valid_to:
+                # Appending after the last interval: extend it while the price is unchanged
+                current = intervals[-1] if intervals else None
+                for day in sorted(days):
+                    price = days[day]
+                    if current is not None and current.valid_to + ONE_DAY == day and current.price == price:
+                        current.valid_to = day
+                        if current.pk:
+                            to_update[current.pk] = current
+                    else:
+                        current = PriceInterval(
+                            product_id=product_id, store_id=store_id, price=price, valid_from=day, valid_to=day,
+                        )
+                        to_create.append(current)
+                continue
+
+            # Corrections inside known history: rebuild the runs around the new days
+            merged = {}
+            for interval in intervals:
+                day = interval.valid_from
+                while day <= interval.valid_to:
+                    merged[day] = interval.price
+                    day += ONE_DAY
+            for day, price in days.items():
+                if update_existing or day not in merged:
+                    merged[day] = price
+            to_delete.extend(interval.pk for interval in intervals)
+            to_create.extend(
+                PriceInterval(product_id=product_id, store_id=store_id, price=price, valid_from=start, valid_to=end)
+                for start, end, price in _runs(merged)
+            )
+
+        size = _in_lookup_size()
+        for i in range(0, len(to_delete), size):
+            PriceInterval.objects.filter(pk__in=to_delete[i:i + size]).delete()
+        for interval in to_update.values():
+            interval.updated_at = now
+        PriceInterval.objects.bulk_update(list(to_update.values()), ['valid_to', 'updated_at'], batch_size=batch_size)
+        PriceInterval.objects.bulk_create(to_create, batch_size=batch_size)
+
+    return {(day, store_id) for (_, store_id), days in observations.items() for day in days}
+
+
+def filter_intervals(start_date=None, end_date=None, product_ids=None, store_ids=None, category_ids=None,
+                     since=None, product_id_range=None):
+    """PriceInterval queryset overlapping [start_date, end_date], with the usual price filters."""
+    intervals = PriceInterval.objects.all()
+    if product_id_range:
+        intervals = intervals.filter(product_id__gte=product_id_range[0], product_id__lte=product_id_range[1])
+    if start_date:
+        intervals = intervals.filter(valid_to__gte=start_date)
+    if end_date:
+        intervals = intervals.filter(valid_from__lte=end_date)
+    if product_ids is not None:
+        intervals = intervals.filter(product_id__in=product_ids)
+    if store_ids:
+        intervals = intervals.filter(store_id__in=store_ids)
+    if category_ids:
+        intervals = intervals.filter(product__category_id__in=category_ids)
+    if since:
+        intervals = intervals.filter(updated_at__gte=since)
+    return intervals
+
+
+def expand_intervals(frame, start_date=None, end_date=None):
+    """
+    Expands a DataFrame of intervals (INTERVAL_COLUMNS) to one row per day:
+    product_id, store_id, date_recorded (datetime64), price (float), clipped to the given dates.
+    """
+    valid_from = pd.to_datetime(frame['valid_from']).to_numpy(dtype='datetime64[D]')
+    valid_to = pd.to_datetime(frame['valid_to']).to_numpy(dtype='datetime64[D]')
+    if start_date:
+        valid_from = np.maximum(valid_from, np.datetime64(start_date, 'D'))
+    if end_date:
+        valid_to = np.minimum(valid_to, np.datetime64(end_date, 'D'))
+    lengths = np.maximum((valid_to - valid_from).astype(np.int64) + 1, 0)
+
+    rows = np.repeat(np.arange(len(frame)), lengths)
+    # Day offset of every output row inside its interval
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    offsets = np.arange(len(rows)) - starts
+    return pd.DataFrame({
+        'product_id': frame['product_id'].to_numpy()[rows],
+        'store_id': frame['store_id'].to_numpy()[rows],
+        'date_recorded': valid_from[rows] + offsets.astype('timedelta64[D]'),
+        'price': frame['price'].astype(float).to_numpy()[rows],
+    })
+
+
+def daily_price_frame(start_date=None, end_date=None, product_ids=None, **filters):
+    """Daily prices from interval storage as a DataFrame, see expand_intervals."""
+    wanted = None
+    if product_ids is not None and len(product_ids) > _in_lookup_size():
+        # Too many ids to bind: read their id range and drop the others below
+        wanted = product_ids
+        product_ids = None
+        filters.update(product_id_range=(min(wanted), max(wanted)))
+    intervals = filter_intervals(start_date, end_date, product_ids=product_ids, **filters)
+    frame = pd.DataFrame.from_records(intervals.values_list(*INTERVAL_COLUMNS), columns=INTERVAL_COLUMNS)
+    if wanted is not None:
+        frame = frame[frame['product_id'].isin(wanted)]
+    return expand_intervals(frame, start_date, end_date)
+
+
+def product_price_page(product_id, before=None, limit=50):
+    """
+    Newest-first page of the daily price history of one product, as PriceRecord
+    instances (not saved) so templates can treat both storage modes alike.
+    before is a (date, store_id) cursor: only older rows are returned. Intervals
+    are read newest first and expanded until the page can no longer change.
+    """
+    intervals = PriceInterval.objects.filter(product_id=product_id).select_related('store').order_by('-valid_to')
+    if before:
+        intervals = intervals.filter(valid_from__lte=before[0])
+
+    rows = []
+    for interval in intervals.iterator(chunk_size=limit):
+        if len(rows) >= limit and interval.valid_to < rows[limit - 1][0]:
+            break
+        day = min(interval.valid_to, before[0]) if before else interval.valid_to
+        taken = 0
+        while day >= interval.valid_from and taken < limit:
+            if not before or (day, interval.store_id) < before:
+                rows.append((day, interval.store_id, interval))
+                taken += 1
+            day -= ONE_DAY
+        rows.sort(key=lambda row: (row[0], row[1]), reverse=True)
+        del rows[limit:]
+
+    return [
+        PriceRecord(product_id=product_id, store=interval.store, price=interval.price, date_recorded=day)
+        for day, _, interval in rows
+    ]
+
+
+def iter_export_rows(intervals, start_date=None, end_date=None, chunk_size=BATCH_SIZE):
+    """
+    Yields (product, category, store, price, date) export tuples, one per day of each
+    interval. Names are looked up per chunk, for the products and stores of the chunk only.
+    """
+    chunk = []
+    for row in intervals.values_list(*INTERVAL_COLUMNS).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from _export_chunk(chunk, start_date, end_date)
+            chunk = []
+    if chunk:
+        yield from _export_chunk(chunk, start_date, end_date)
+
+
+def _names(queryset, ids, *fields):
+    names = {}
+    ids = sorted(ids)
+    size = _in_lookup_size()
+    for i in range(0, len(ids), size):
+        for pk, *values in queryset.filter(pk__in=ids[i:i + size]).values_list('pk', *fields):
+            names[pk] = values
+    return names
+
+
+def _export_chunk(rows, start_date, end_date):
+    daily = expand_intervals(pd.DataFrame.from_records(rows, columns=INTERVAL_COLUMNS), start_date, end_date)
+    products = _names(Product.objects, {row[0] for row in rows}, 'name', 'category__name')
+    stores = _names(Store.objects, {row[1] for row in rows}, 'name')
+    for product_id, store_id, day, price in zip(
+        daily['product_id'].tolist(), daily['store_id'].tolist(),
+        daily['date_recorded'].dt.date.tolist(), daily['price'].tolist(),
+    ):
+        product_name, category_name = products[product_id]
+        (store_name,) = stores[store_id]
+        yield product_name, category_name, store_name, _to_price(price), day
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from analytics.models import PriceRecord, Product, Store
+from analytics.importer import upsert_price_records
+from analytics.utils import get_price_trend
+
+PROFILES = ['basic', 'production']
+
+class Command(BaseCommand):
+    help = 'Measures read throughput while an import writes, for each SQLite profile (on a copy of the database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10.0,
+            help='Seconds per profile (default: 10)',
+        )
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=4,
+            help='Reader processes, like web workers (default: 4)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Price records per import transaction (default: 5000)',
+        )
+        parser.add_argument(
+            '--profiles',
+            nargs='+',
+            choices=PROFILES,
+            default=PROFILES,
+            help='Profiles to compare (default: basic production)',
+        )
+        # Internal: the benchmark runs itself as reader and writer processes
+        parser.add_argument('--role', choices=['reader', 'writer'], help=argparse.SUPPRESS)
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark is SQLite specific')
+        if kwargs['role'] == 'reader':
+            return self.emit(self.run_reader(kwargs['duration']))
+        if kwargs['role'] == 'writer':
+            return self.emit(self.run_writer(kwargs['duration'], kwargs['batch_size']))
+
+        self.stdout.write(f"{kwargs['readers']} readers, 1 import writer, {kwargs['duration']:.0f}s per profile\n")
+        self.stdout.write(f"{'profile':<12}{'reads/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'read errors':>13}{'rows written':>14}{'write errors':>14}")
+        for profile in kwargs['profiles']:
+            result = self.run_profile(profile, kwargs)
+            self.stdout.write(
+                f"{profile:<12}{result['reads_per_sec']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                f"{result['max_ms']:>10.1f}{result['read_errors']:>13}{result['rows_written']:>14}{result['write_errors']:>14}"
+            )
+
+    def emit(self, result):
+        self.stdout.write(json.dumps(result))
+
+    def run_profile(self, profile, options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite3')
+            # Online backup also copies pages still in the source WAL; the copy starts in rollback mode
+            with sqlite3.connect(settings.DATABASES['default']['NAME']) as source, sqlite3.connect(path) as target:
+                source.backup(target)
+                target.execute('PRAGMA journal_mode=DELETE')
+
+            # Own cache directory too, so the writer does not invalidate the real cache.
+            # Readers query the database: the price cube would answer from memory
+            env = dict(
+                os.environ,
+                DJANGO_DB_PROFILE=profile,
+                DJANGO_SQLITE_PATH=path,
+                DJANGO_CACHE_DIR=os.path.join(directory, 'cache'),
+                PRICE_CUBE='off',
+            )
+            command = [
+                sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_sqlite_concurrency',
+                '--duration', str(options['duration']), '--batch-size', str(options['batch_size']),
+            ]
+            processes = [subprocess.Popen(command + ['--role', 'writer'], env=env, stdout=subprocess.PIPE, text=True)]
+            processes += [
+                subprocess.Popen(command + ['--role', 'reader'], env=env, stdout=subprocess.PIPE, text=True)
+                for _ in range(options['readers'])
+            ]
+            outputs = [process.communicate()[0] for process in processes]
+            if any(process.returncode for process in processes):
+                raise CommandError(f'Benchmark process failed for profile {profile}')
+
+        results = [json.loads(output.strip().splitlines()[-1]) for output in outputs]
+        writer, readers = results[0], results[1:]
+        latencies = sorted(latency for reader in readers for latency in reader['latencies'])
+        reads = len(latencies)
+        return {
+            'reads_per_sec': reads / options['duration'],
+            'p50_ms': latencies[reads // 2] * 1000 if reads else 0,
+            'p95_ms': latencies[int(reads * 0.95)] * 1000 if reads else 0,
+            'max_ms': latencies[-1] * 1000 if reads else 0,
+            'read_errors': sum(reader['errors'] for reader in readers),
+            'rows_written': writer['rows_written'],
+            'write_errors': writer['errors'],
+        }
+
+    def run_reader(self, duration):
+        # Typical page reads: the home trend from the rollup and a product history
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        end_date = date.today()
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                get_price_trend(end_date - timedelta(days=90), end_date)
+                list(PriceRecord.objects.filter(product_id=random.choice(product_ids))
+                     .order_by('date_recorded').values_list('date_recorded', 'price'))
+            except OperationalError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+        return {'latencies': latencies, 'errors': errors}
+
+    def run_writer(self, duration, batch_size):
+        # Re-imports recent prices in import-sized transactions, which also refreshes the rollup
+        pairs = list(PriceRecord.objects.filter(date_recorded__gte=date.today() - timedelta(days=30))
+                     .values_list('product_id', 'store_id', 'date_recorded'))
+        if not pairs:
+            pairs = [(product_id, store_id, date.today())
+                     for product_id in Product.objects.values_list('id', flat=True)[:100]
+                     for store_id in Store.objects.values_list('id', flat=True)]
+        rows_written = 0
+        errors = 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            batch = random.sample(pairs, min(batch_size, len(pairs)))
+            records = [
+                PriceRecord(product_id=product_id, store_id=store_id, date_recorded=day,
+                            price=Decimal(random.randint(1000, 99999)) / 100)
+                for product_id, store_id, day in batch
+            ]
+            try:
+                rows_written += upsert_price_records(records, batch_size=batch_size)
+            except OperationalError:
+                errors += 1
+        return {'rows_written': rows_written, 'errors': errors}
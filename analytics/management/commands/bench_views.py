@@ -0,0 +1,311 @@
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from analytics import views
+from analytics.cache import DATA_VERSION_KEY, get_data_version
+from analytics.cube import build_arrays, price_cube_enabled, get_price_cube
+from analytics.importer import REQUIRED_COLUMNS, run_import_job
+from analytics.intervals import interval_storage
+from analytics.models import Category, ImportJob, PriceInterval, PriceRecord, Product, Store
+
+# seed_db options of each dataset size
+TIERS = {
+    'small': {'products': 28, 'stores': 6, 'days': 90},
+    'medium': {'products': 300, 'stores': 20, 'days': 365},
+    'large': {'products': 1000, 'stores': 40, 'days': 365},
+}
+VIEWS = ['home', 'dashboard', 'product_detail', 'category_detail', 'export_data', 'import_data']
+
+class Command(BaseCommand):
+    help = 'Measures the main views on seeded datasets of growing size (in throwaway databases) and writes a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tiers',
+            nargs='+',
+            choices=list(TIERS),
+            default=['small', 'medium'],
+            help='Dataset sizes to measure (default: small medium)',
+        )
+        parser.add_argument(
+            '--views',
+            nargs='+',
+            choices=VIEWS,
+            default=VIEWS,
+            help='Views to measure (default: all)',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=20,
+            help='Timed requests per view (default: 20)',
+        )
+        parser.add_argument(
+            '--import-rows',
+            type=int,
+            default=1000,
+            help='Price rows in each file posted to import_data (default: 1000)',
+        )
+        parser.add_argument(
+            '--output',
+            default='bench_views.json',
+            help='Path of the JSON report (default: bench_views.json)',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='JSON report of an earlier run to compare the p50 latencies with',
+        )
+        # Internal: every tier runs in its own process against its own database
+        parser.add_argument('--role', choices=['tier', 'measure'], help=argparse.SUPPRESS)
+        parser.add_argument('--tier', choices=list(TIERS), help=argparse.SUPPRESS)
+
+    def handle(self, *args, **kwargs):
+        if kwargs['requests'] < 1:
+            raise CommandError('--requests must be positive')
+        if kwargs['role'] == 'tier':
+            return self.emit(self.run_tier(kwargs['tier'], kwargs))
+        if kwargs['role'] == 'measure':
+            return self.emit(self.measure_views(kwargs['views'], kwargs['requests'], kwargs['import_rows']))
+
+        report = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': self.git_commit(),
+            'price_storage': 'intervals' if interval_storage() else 'daily',
+            'price_cube': price_cube_enabled(),
+            'requests': kwargs['requests'],
+            'tiers': {},
+        }
+        for tier in kwargs['tiers']:
+            self.stdout.write(f'Seeding and measuring the {tier} tier ({self.describe(TIERS[tier])})...')
+            report['tiers'][tier] = self.spawn_tier(tier, kwargs)
+            self.print_tier(tier, report['tiers'][tier])
+
+        with open(kwargs['output'], 'w') as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {kwargs['output']}"))
+        if kwargs['baseline']:
+            self.compare(report, kwargs['baseline'])
+
+    def emit(self, result):
+        self.stdout.write(json.dumps(result))
+
+    def describe(self, options):
+        return ', '.join(f'{value} {name}' for name, value in options.items())
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def spawn_tier(self, tier, options):
+        with tempfile.TemporaryDirectory() as directory:
+            # Own database and cache: the real ones are never touched.
+            # DEBUG would log every query and time the debug templates
+            env = dict(
+                os.environ,
+                DJANGO_DEBUG='False',
+                DJANGO_SQLITE_PATH=os.path.join(directory, 'bench.sqlite3'),
+                DJANGO_CACHE_DIR=os.path.join(directory, 'cache'),
+            )
+            command = [
+                sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_views',
+                '--role', 'tier', '--tier', tier,
+                '--requests', str(options['requests']), '--import-rows', str(options['import_rows']),
+                '--views', *options['views'],
+            ]
+            process = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True)
+            if process.returncode:
+                raise CommandError(f'Benchmark process failed for tier {tier}')
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def run_tier(self, tier, options):
+        # migrate seeds the default dataset through post_migrate; seed_db --clean replaces it
+        call_command('migrate', verbosity=0)
+        started = time.perf_counter()
+        call_command('seed_db', clean=True, stdout=io.StringIO(), **TIERS[tier])
+        seed_seconds = time.perf_counter() - started
+
+        price_model = PriceInterval if interval_storage() else PriceRecord
+        result = {
+            'dataset': dict(TIERS[tier], price_rows=price_model.objects.count()),
+            'seed_s': round(seed_seconds, 2),
+        }
+        result.update(self.measure_views(options['views'], options['requests'], options['import_rows']))
+        return result
+
+    def measure_views(self, names, requests, import_rows):
+        """Latency, queries and peak memory of the given views on the current database."""
+        targets = self.get_targets()
+        if not targets:
+            raise CommandError('No data to measure, run seed_db first')
+
+        # Payloads are recomputed on every request (the cache is emptied before each one),
+        # but the data version is kept so the price cube is built only once
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(ALLOWED_HOSTS=['*'], CACHES=locmem, MEDIA_ROOT=media_root):
+            warmup = self.measure_warmup()
+            client = Client()
+            results = {}
+            # import_data writes prices, so it runs after the read-only views
+            for name in sorted(names, key=lambda name: name == 'import_data'):
+                if name == 'import_data':
+                    request = self.import_request(client, import_rows)
+                else:
+                    url = targets[name]
+                    request = lambda url=url: self.read(client.get(url))
+                results[name] = self.measure(request, requests)
+        return dict(warmup, views=results)
+
+    def measure_warmup(self):
+        """Time, queries and peak memory of the price cube build, paid once per data version and worker."""
+        if not price_cube_enabled():
+            return {'warmup_s': 0.0, 'warmup_queries': 0, 'warmup_peak_memory_kb': 0}
+        started = time.perf_counter()
+        get_price_cube()
+        warmup_seconds = time.perf_counter() - started
+
+        # A second, traced build for the queries and memory; the timed one ran untraced
+        reset_queries()
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as captured:
+                build_arrays()
+            queries = len(captured)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {'warmup_s': round(warmup_seconds, 2), 'warmup_queries': queries, 'warmup_peak_memory_kb': round(peak / 1024)}
+
+    def get_targets(self):
+        product = Product.objects.order_by('pk').first()
+        category = Category.objects.filter(product__isnull=False).order_by('pk').first()
+        store = Store.objects.order_by('pk').first()
+        if product is None or category is None or store is None:
+            return {}
+        month_ago = (date.today() - timedelta(days=30)).isoformat()
+        return {
+            'home': reverse(views.home),
+            'dashboard': reverse(views.dashboard),
+            'product_detail': reverse(views.product_detail, args=[product.pk]),
+            'category_detail': reverse(views.category_detail, args=[category.slug]),
+            'export_data': reverse(views.export_data) + f'?date_from={month_ago}&store={store.pk}',
+        }
+
+    def read(self, response):
+        if response.status_code != 200:
+            raise CommandError(f'{response.request["PATH_INFO"]} returned {response.status_code}')
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+
+    def import_request(self, client, rows):
+        """Posts a price file for today and runs the queued job, like the import worker does."""
+        products = list(Product.objects.select_related('category').order_by('pk'))
+        stores = list(Store.objects.order_by('pk'))
+        pairs = [(product, store) for product in products for store in stores][:rows]
+        rng = random.Random(0)
+        url = reverse(views.import_data)
+
+        def request():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(REQUIRED_COLUMNS)
+            for product, store in pairs:
+                writer.writerow([product.name, product.category.name, store.name,
+                                 f'{rng.uniform(10, 1000):.2f}', date.today().isoformat()])
+            upload = SimpleUploadedFile('bench.csv', buffer.getvalue().encode(), content_type='text/csv')
+            response = client.post(url, {'file': upload})
+            if response.status_code != 302:
+                raise CommandError(f'import_data returned {response.status_code}')
+            run_import_job(ImportJob.objects.latest('pk'))
+
+        return request
+
+    def measure(self, request, requests):
+        version = get_data_version()
+
+        def fresh_request():
+            cache.clear()
+            cache.set(DATA_VERSION_KEY, version, timeout=None)
+            request()
+
+        # One profiled request for the query count and peak memory: tracing slows the
+        # request down, so the timed requests run without it
+        fresh_request()
+        # The query log is capped: with DEBUG it may already be full after seeding
+        reset_queries()
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as captured:
+                fresh_request()
+            # Read now: the next requests reset the query log the capture slices
+            queries = len(captured)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        latencies = []
+        for _ in range(requests):
+            # Writes (import_data) replace the data version, keep the current one
+            version = get_data_version()
+            started = time.perf_counter()
+            fresh_request()
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        return {
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+            'max_ms': round(latencies[-1] * 1000, 2),
+            'queries': queries,
+            'peak_memory_kb': round(peak / 1024),
+        }
+
+    def print_tier(self, tier, result):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{tier}: {result['dataset']['price_rows']} price rows, seeded in {result['seed_s']:.1f}s, "
+            f"price cube build {result['warmup_s']:.1f}s, {result['warmup_queries']} queries, "
+            f"{result['warmup_peak_memory_kb']} KB"
+        ))
+        self.stdout.write(f"{'view':<18}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'queries':>10}{'peak KB':>10}")
+        for name, view in result['views'].items():
+            self.stdout.write(
+                f"{name:<18}{view['p50_ms']:>10.1f}{view['p95_ms']:>10.1f}{view['max_ms']:>10.1f}"
+                f"{view['queries']:>10}{view['peak_memory_kb']:>10}"
+            )
+        self.stdout.write('')
+
+    def compare(self, report, path):
+        with open(path) as fh:
+            baseline = json.load(fh)
+        self.stdout.write(f"p50 change against {path} ({baseline.get('commit') or 'unknown commit'}):")
+        for tier, result in report['tiers'].items():
+            before = baseline.get('tiers', {}).get(tier, {}).get('views', {})
+            for name, view in result['views'].items():
+                if name not in before or not before[name]['p50_ms']:
+                    continue
+                change = view['p50_ms'] / before[name]['p50_ms'] - 1
+                line = f"  {tier:<8}{name:<18}{before[name]['p50_ms']:>10.1f} -> {view['p50_ms']:>10.1f} ms ({change:+.0%})"
+                self.stdout.write(self.style.WARNING(line) if change > 0.1 else line)
@@ -0,0 +1,92 @@
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from analytics.models import PriceRecord, PriceInterval
+from analytics.intervals import ONE_DAY, INTERVAL_COLUMNS, delete_all_rows, expand_intervals
+from analytics.rollups import rebuild_current_prices, rebuild_daily_stats
+
+BATCH_SIZE = 5000
+
+class Command(BaseCommand):
+    help = 'Copies price history between daily rows (PriceRecord) and intervals (PriceInterval)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--to',
+            choices=['intervals', 'daily'],
+            required=True,
+            help='Target storage',
+        )
+        parser.add_argument(
+            '--delete-source',
+            action='store_true',
+            help='Delete the source rows after copying',
+        )
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            if kwargs['to'] == 'intervals':
+                source, target = PriceRecord, PriceInterval
+                written = self.to_intervals()
+            else:
+                source, target = PriceInterval, PriceRecord
+                written = self.to_daily()
+            source_rows = source.objects.count()
+            if kwargs['delete_source']:
+                # Without delete signals: they would refresh the derived tables from the emptied source
+                delete_all_rows(source)
+            # The derived tables now follow the target storage
+            self.stdout.write('Rebuilding daily stats and current prices...')
+            rebuild_daily_stats(intervals=kwargs['to'] == 'intervals')
+            rebuild_current_prices(intervals=kwargs['to'] == 'intervals')
+
+        ratio = source_rows / written if written else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{source_rows} {source.__name__} rows -> {written} {target.__name__} rows ({ratio:.1f}x).'
+        ))
+        self.stdout.write(f"Set PRICE_STORAGE={kwargs['to']} to read and write the new storage.")
+
+    def to_intervals(self):
+        delete_all_rows(PriceInterval)
+        rows = PriceRecord.objects.order_by('product_id', 'store_id', 'date_recorded')\
+            .values_list('product_id', 'store_id', 'date_recorded', 'price').iterator(chunk_size=BATCH_SIZE)
+
+        batch = []
+        written = 0
+        current = None
+        for product_id, store_id, day, price in rows:
+            if (current is not None and current.product_id == product_id and current.store_id == store_id
+                    and current.valid_to + ONE_DAY == day and current.price == price):
+                current.valid_to = day
+                continue
+            if current is not None:
+                batch.append(current)
+            current = PriceInterval(product_id=product_id, store_id=store_id, price=price, valid_from=day, valid_to=day)
+            if len(batch) >= BATCH_SIZE:
+                PriceInterval.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if current is not None:
+            batch.append(current)
+        PriceInterval.objects.bulk_create(batch)
+        return written + len(batch)
+
+    def to_daily(self):
+        delete_all_rows(PriceRecord)
+        intervals = PriceInterval.objects.order_by('id').values_list(*INTERVAL_COLUMNS).iterator(chunk_size=BATCH_SIZE)
+        written = 0
+        while True:
+            chunk = [row for _, row in zip(range(BATCH_SIZE), intervals)]
+            if not chunk:
+                break
+            daily = expand_intervals(pd.DataFrame.from_records(chunk, columns=INTERVAL_COLUMNS))
+            records = [
+                PriceRecord(product_id=product_id, store_id=store_id, date_recorded=day, price=round(price, 2))
+                for product_id, store_id, day, price in zip(
+                    daily['product_id'].tolist(), daily['store_id'].tolist(),
+                    daily['date_recorded'].dt.date.tolist(), daily['price'].tolist(),
+                )
+            ]
+            PriceRecord.objects.bulk_create(records, batch_size=BATCH_SIZE)
+            written += len(records)
+        return written
@@ -0,0 +1,142 @@
+import re
+import uuid
+from collections import Counter
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from analytics import views
+from analytics.cube import price_cube_enabled, get_price_cube
+from analytics.models import Category, Product, Store, PriceRecord, PriceInterval, DailyPriceStat, CurrentPrice
+
+# Full scans of these tables grow with the price history (CurrentPrice with the catalog)
+WATCHED_TABLES = tuple(model._meta.db_table for model in (PriceRecord, PriceInterval, DailyPriceStat, CurrentPrice))
+# Scans that read the whole table on purpose, by table and start of the statement
+INTENDED_SCANS = (
+    # get_total_records: the record total of the whole rollup, which is small by design
+    (DailyPriceStat._meta.db_table, 'SELECT SUM("analytics_dailypricestat"."record_count") AS "total" FROM'),
+    # get_store_baskets: recent current prices of every store, usually most of the table
+    (CurrentPrice._meta.db_table, 'SELECT "analytics_currentprice"."store_id" AS "store_id", (CAST(SUM('),
+)
+# Tables of subqueries are named by their alias in the plan: "analytics_currentprice" U0
+TABLE_ALIAS_RE = re.compile(r'"(\w+)" (U\d+)\b')
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN QUERY PLAN for the queries of the main views and reports full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sql',
+            action='store_true',
+            help='Print the full SQL of every query',
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Refresh the planner statistics (ANALYZE) first, e.g. after a large import',
+        )
+        parser.add_argument(
+            '--fail-on-scan',
+            action='store_true',
+            help='Exit with an error if any query fully scans a price table',
+        )
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN is only available on SQLite')
+
+        targets = self.get_targets()
+        if not targets:
+            raise CommandError('No data to explain, run seed_db first')
+
+        if kwargs['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(f'{PriceRecord.objects.count()} price records, {DailyPriceStat.objects.count()} daily stat cells\n')
+
+        scans = []
+        # Cached payloads would hide the queries, so every request computes from scratch
+        # Local memory caches of the same location are shared, e.g. by calls in one process
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': uuid.uuid4().hex}}
+        with override_settings(ALLOWED_HOSTS=['*'], CACHES=locmem):
+            # The price cube is built once per data version, not per request, but its
+            # queries are explained like those of a view
+            if price_cube_enabled():
+                with CaptureQueriesContext(connection) as captured:
+                    get_price_cube()
+                # The build reads the rollup and the current prices whole by design
+                scans.extend(self.explain('price cube build', 'price cube build', captured, kwargs['sql'], intended=True))
+            client = Client()
+            for label, url in targets:
+                scans.extend(self.explain_view(client, label, url, kwargs['sql']))
+
+        if scans:
+            self.stdout.write(self.style.WARNING(f'{len(scans)} full scan(s) of price tables:'))
+            for label, detail in scans:
+                self.stdout.write(f'  {label}: {detail}')
+            if kwargs['fail_on_scan']:
+                raise CommandError('Full table scans found')
+        else:
+            self.stdout.write(self.style.SUCCESS('No full scans of price tables.'))
+
+    def get_targets(self):
+        product = Product.objects.annotate(records=Count('pricerecord')).order_by('-records').first()
+        store = Store.objects.first()
+        category = Category.objects.first()
+        if product is None or store is None or category is None:
+            return []
+
+        month_ago = (date.today() - timedelta(days=30)).isoformat()
+        return [
+            ('home', reverse(views.home)),
+            ('home (1 year)', reverse(views.home) + '?days=365'),
+            ('dashboard', reverse(views.dashboard)),
+            ('dashboard (store)', reverse(views.dashboard) + f'?store={store.pk}'),
+            ('dashboard (category, 90 days)', reverse(views.dashboard) + f'?category={category.pk}&days=90'),
+            ('products_list', reverse(views.products_list)),
+            ('product_detail', reverse(views.product_detail, args=[product.pk])),
+            ('category_detail', reverse(views.category_detail, args=[category.slug])),
+            ('export_data', reverse(views.export_data) + f'?date_from={month_ago}&store={store.pk}'),
+        ]
+
+    def explain_view(self, client, label, url, show_sql):
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get(url)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        return self.explain(label, f'{label} {url}', captured, show_sql)
+
+    def explain(self, label, heading, captured, show_sql, intended=False):
+        statements = Counter(
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].lstrip().upper().startswith(('SELECT', 'WITH'))
+        )
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{heading}: {len(captured)} queries, {len(statements)} distinct'
+        ))
+
+        scans = []
+        with connection.cursor() as cursor:
+            for sql, repeats in statements.items():
+                shown = sql if show_sql or len(sql) <= 120 else sql[:117] + '...'
+                self.stdout.write(f'  {shown}' + (f'  (x{repeats})' if repeats > 1 else ''))
+                aliases = {alias: table for table, alias in TABLE_ALIAS_RE.findall(sql)}
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for row in cursor.fetchall():
+                    detail = row[-1]
+                    # "SCAN t USING INDEX i" still reads the whole table, only in index order
+                    table = aliases.get(detail.split()[1], detail.split()[1]) if detail.startswith('SCAN ') else None
+                    if table not in WATCHED_TABLES:
+                        self.stdout.write(f'    {detail}')
+                    elif intended or any(table == t and sql.startswith(start) for t, start in INTENDED_SCANS):
+                        self.stdout.write(self.style.WARNING(f'    {detail} (intended)'))
+                    else:
+                        scans.append((label, detail))
+                        self.stdout.write(self.style.ERROR(f'    {detail}'))
+        self.stdout.write('')
+        return scans
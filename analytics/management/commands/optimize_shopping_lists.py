@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from analytics.models import ShoppingList, Store
+from analytics.optimizer import MAX_SPLIT_STORES, optimize_lists
+
+class Command(BaseCommand):
+    help = 'Finds the cheapest store and the cheapest split over at most k stores for every shopping list'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=2,
+            help=f'Maximum number of stores of a split, up to {MAX_SPLIT_STORES} (default: 2)',
+        )
+        parser.add_argument(
+            '--user',
+            help='Only the lists of this username',
+        )
+
+    def handle(self, *args, **kwargs):
+        if not 1 <= kwargs['k'] <= MAX_SPLIT_STORES:
+            raise CommandError(f'--k must be between 1 and {MAX_SPLIT_STORES}')
+        lists = ShoppingList.objects.select_related('user').order_by('id')
+        if kwargs['user']:
+            lists = lists.filter(user__username=kwargs['user'])
+        store_names = dict(Store.objects.values_list('id', 'name'))
+
+        started = time.perf_counter()
+        count = 0
+        for shopping_list, result in optimize_lists(lists, k=kwargs['k']):
+            count += 1
+            split = result['split']
+            line = f"#{shopping_list.pk} {shopping_list.user.username}: {result['products']} products"
+            if result['stores']:
+                cheapest = result['stores'][0]
+                line += f", one store: {store_names[cheapest['store_id']]} {cheapest['total']}"
+                if cheapest['missing']:
+                    line += f" ({cheapest['missing']} missing)"
+            if split['stores']:
+                names = ' + '.join(store_names[store['store_id']] for store in split['stores'])
+                line += f", split: {names} {split['total']}"
+                if split['missing']:
+                    line += f" ({len(split['missing'])} missing)"
+            self.stdout.write(line)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{count} shopping lists optimized in {elapsed:.1f}s.'))
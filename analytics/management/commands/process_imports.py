@@ -0,0 +1,73 @@
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from analytics.importer import run_import_job, claim_import_job, CHUNK_SIZE, BATCH_SIZE, LEASE_SECONDS
+
+class Command(BaseCommand):
+    help = 'Processes queued price import jobs (run as a long-lived worker or with --once)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process queued jobs and exit instead of polling for new ones',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Polling interval in seconds (default: 5)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help=f'CSV rows parsed and committed per chunk (default: {CHUNK_SIZE})',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Rows per bulk insert (default: {BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=LEASE_SECONDS,
+            help=f'Seconds without a committed chunk after which a running job is '
+                 f'considered abandoned and claimed again (default: {LEASE_SECONDS})',
+        )
+        parser.add_argument(
+            '--no-warm',
+            action='store_true',
+            help='Do not precompute the dashboard cache after an import',
+        )
+
+    def handle(self, *args, **kwargs):
+        while True:
+            job = claim_import_job(kwargs['lease'])
+            if job is None:
+                if kwargs['once']:
+                    break
+                time.sleep(kwargs['interval'])
+                continue
+
+            resumed = f', resuming after row {job.rows_processed}' if job.rows_processed else ''
+            self.stdout.write(f'Processing import job #{job.pk} ({job.file.name}{resumed})...')
+            try:
+                stats = run_import_job(
+                    job, chunk_size=kwargs['chunk_size'], batch_size=kwargs['batch_size'], lease_seconds=kwargs['lease'],
+                )
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Import job #{job.pk} failed: {e}'))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(
+                f'Import job #{job.pk} done: {stats.records_written} price records written, '
+                f'{stats.rows_skipped} duplicates skipped, {stats.rows_rejected} rows rejected '
+                f'({stats.rows_per_sec:.0f} rows/sec)'
+            ))
+            # The import bumped the price data version, so the first dashboard visitor
+            # would otherwise recompute everything
+            if not kwargs['no_warm']:
+                call_command('warm_dashboard_cache', stdout=self.stdout)
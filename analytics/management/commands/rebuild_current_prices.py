@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from analytics.rollups import rebuild_current_prices
+
+class Command(BaseCommand):
+    help = 'Rebuilds the latest price per product and store (CurrentPrice) from the price history'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Rebuilding current prices...')
+        rows = rebuild_current_prices()
+        self.stdout.write(self.style.SUCCESS(f'Current prices rebuilt: {rows} product/store prices.'))
@@ -0,0 +1,25 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from analytics.rollups import rebuild_daily_stats
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily price rollup (DailyPriceStat) from PriceRecord'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Only rebuild the last N days (default: full history)',
+        )
+
+    def handle(self, *args, **kwargs):
+        start_date = None
+        if kwargs['days'] is not None:
+            start_date = date.today() - timedelta(days=kwargs['days'])
+            self.stdout.write(f'Rebuilding daily price stats since {start_date}...')
+        else:
+            self.stdout.write('Rebuilding daily price stats...')
+
+        cells = rebuild_daily_stats(start_date=start_date)
+        self.stdout.write(self.style.SUCCESS(f'Daily price stats rebuilt: {cells} day/store/category cells.'))
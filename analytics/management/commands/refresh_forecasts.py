@@ -0,0 +1,29 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from analytics.forecasting import refresh_forecasts
+
+class Command(BaseCommand):
+    help = 'Recomputes stored price forecasts (ProductForecast), meant to run nightly'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute every product, not only products with new price records',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Worker processes (default: number of CPUs)',
+        )
+
+    def handle(self, *args, **kwargs):
+        started = time.perf_counter()
+        count = refresh_forecasts(full=kwargs['all'], workers=kwargs['workers'])
+        elapsed = time.perf_counter() - started
+        if not count:
+            self.stdout.write('No products with new price records, forecasts are up to date.')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Forecasts refreshed for {count} products in {elapsed:.1f}s.'))
@@ -1,12 +1,78 @@
-import random
-import math
+import time
 from datetime import timedelta, date
-from django.core.management.base import BaseCommand
+from itertools import repeat
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
 from django.utils.text import slugify
-from analytics.models import Category, Product, Store, PriceRecord
+from analytics.models import Category, Product, Store, PriceRecord, PriceInterval, DailyPriceStat, CurrentPrice
+from analytics.intervals import interval_storage, delete_all_rows
+from analytics.importer import upsert_price_records
+from analytics.rollups import batched_refresh, mark_dirty
+from analytics.alerts import match_price_alerts
+from analytics.cache import bump_data_version
+from analytics.forecasting import refresh_forecasts
+
+CATEGORIES = [
+    'Молочные продукты', 'Овощи и фрукты', 'Мясо и птица', 'Бакалея',
+    'Напитки', 'Хлеб и выпечка', 'Рыба и морепродукты'
+]
+
+# Name, url and price level of each chain; larger seeds open more stores of the chains
+STORES = [
+    ('Пятерочка', 'https://5ka.ru', 0.95),
+    ('Магнит', 'https://magnit.ru', 0.95),
+    ('Перекресток', 'https://perekrestok.ru', 1.15),
+    ('ВкусВилл', 'https://vkusvill.ru', 1.15),
+    ('Ашан', 'https://auchan.ru', 1.0),
+    ('Лента', 'https://lenta.com', 1.0),
+]
+
+# Products (Name, Category Name, Approx Base Price); larger seeds add variants of them
+PRODUCTS = [
+    ('Молоко Домик в деревне 3.2%', 'Молочные продукты', 90),
+    ('Творог Простоквашино 5%', 'Молочные продукты', 120),
+    ('Сыр Российский 200г', 'Молочные продукты', 250),
+    ('Йогурт Чудо питьевой', 'Молочные продукты', 60),
+    ('Сметана Брест-Литовск 15%', 'Молочные продукты', 85),
+
+    ('Бананы Эквадор 1кг', 'Овощи и фрукты', 140),
+    ('Картофель мытый 1кг', 'Овощи и фрукты', 45),
+    ('Огурцы гладкие 1кг', 'Овощи и фрукты', 180),
+    ('Томаты сливовидные 1кг', 'Овощи и фрукты', 220),
+    ('Яблоки Гала 1кг', 'Овощи и фрукты', 110),
+    ('Апельсины 1кг', 'Овощи и фрукты', 160),
+
+    ('Куриное филе Петелинка 1кг', 'Мясо и птица', 380),
+    ('Говядина тушеная банка', 'Мясо и птица', 250),
+    ('Свинина лопатка 1кг', 'Мясо и птица', 420),
+    ('Фарш Домашний 400г', 'Мясо и птица', 190),
+
+    ('Макароны Макфа 450г', 'Бакалея', 65),
+    ('Гречка Мистраль 900г', 'Бакалея', 85),
+    ('Рис Краснодарский 900г', 'Бакалея', 95),
+    ('Масло подсолнечное 1л', 'Бакалея', 130),
+    ('Сахар 1кг', 'Бакалея', 70),
+
+    ('Сок Добрый Яблоко 1л', 'Напитки', 120),
+    ('Coca-Cola 0.9л', 'Напитки', 110),
+    ('Вода Святой Источник 1.5л', 'Напитки', 40),
+
+    ('Хлеб Бородинский', 'Хлеб и выпечка', 45),
+    ('Батон Нарезной', 'Хлеб и выпечка', 35),
+    ('Круассан 7days', 'Хлеб и выпечка', 100),
+
+    ('Семга слабосоленая 200г', 'Рыба и морепродукты', 600),
+    ('Креветки Королевские 1кг', 'Рыба и морепродукты', 800),
+]
+
+MIN_PRICE = 10
+# Prices grow by about 10% a year
+INFLATION_PER_DAY = 0.0003
 
 class Command(BaseCommand):
-    help = 'Seeds the database with mock data'
+    help = 'Seeds the database with mock data, deterministic for a given --seed'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -14,148 +80,374 @@ class Command(BaseCommand):
             action='store_true',
             help='Wipe existing data before seeding',
         )
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=len(PRODUCTS),
+            help=f'Number of products (default: {len(PRODUCTS)})',
+        )
+        parser.add_argument(
+            '--stores',
+            type=int,
+            default=len(STORES),
+            help=f'Number of stores (default: {len(STORES)})',
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=90,
+            help='Days of price history up to today (default: 90)',
+        )
+        parser.add_argument(
+            '--availability',
+            type=float,
+            default=0.8,
+            help='Share of (product, store) pairs a store sells (default: 0.8)',
+        )
+        parser.add_argument(
+            '--price-change-days',
+            type=float,
+            default=1,
+            help='Average days a store keeps a price; 1 reprices daily (default: 1)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed (default: 42)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100000,
+            help='Rows per transaction (default: 100000)',
+        )
 
     def handle(self, *args, **kwargs):
+        if kwargs['products'] < 1 or kwargs['stores'] < 1 or kwargs['days'] < 1:
+            raise CommandError('--products, --stores and --days must be positive')
+        if not 0 < kwargs['availability'] <= 1 or kwargs['price_change_days'] < 1:
+            raise CommandError('--availability must be in (0, 1] and --price-change-days at least 1')
+
         if kwargs['clean']:
             self.stdout.write('Cleaning existing data...')
-            PriceRecord.objects.all().delete()
+            # Plain DELETEs: the collector would load every price row to send delete signals,
+            # and the derived tables are refreshed after seeding anyway
+            for model in (PriceRecord, PriceInterval, DailyPriceStat, CurrentPrice):
+                delete_all_rows(model)
             Product.objects.all().delete()
             Store.objects.all().delete()
             Category.objects.all().delete()
             self.stdout.write(self.style.SUCCESS('Data cleaned.'))
-        
+
         if Product.objects.exists() and not kwargs['clean']:
             self.stdout.write(self.style.WARNING('Database contains data. Appending/Merging new data...'))
 
         self.stdout.write('Seeding database...')
+        started = time.perf_counter()
+        rng = np.random.default_rng(kwargs['seed'])
+        categories = self.seed_categories()
+        store_ids, store_levels = self.seed_stores(kwargs['stores'], rng)
+        product_ids, category_ids, base_prices = self.seed_products(kwargs['products'], categories, rng)
+
+        self.stdout.write(
+            f'Generating {kwargs["days"]} days of prices for {len(product_ids)} products in {len(store_ids)} stores...'
+        )
+        days = PriceGenerator(
+            product_ids, category_ids, base_prices, store_ids, store_levels, rng,
+            kwargs['days'], kwargs['availability'], kwargs['price_change_days'],
+        )
+        price_model = PriceInterval if interval_storage() else PriceRecord
+        if price_model.objects.exists():
+            # Derived tables are refreshed once for all new prices, committed together with them
+            with transaction.atomic(), batched_refresh():
+                if interval_storage():
+                    # New intervals have to be merged into the existing ones
+                    written = self.merge_prices(days)
+                else:
+                    written = self.write_prices(days, kwargs['batch_size'])
+                first_day = date.today() - timedelta(days=kwargs['days'] - 1)
+                mark_dirty(
+                    {(first_day + timedelta(days=offset), store_id) for offset in range(kwargs['days']) for store_id in store_ids},
+                    product_ids,
+                )
+        else:
+            written = self.write_prices(days, kwargs['batch_size'])
+            # No other prices exist, so the derived tables follow from the generated ones alone.
+            # Recomputing the rollup from interval storage scans the intervals once per day
+            self.write_derived(days, kwargs['batch_size'])
+            match_price_alerts(product_ids)
+            bump_data_version()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully seeded database. Created/Verified {written} price records in {elapsed:.1f}s.'
+        ))
 
-        # Categories
-        categories_data = [
-            'Молочные продукты', 'Овощи и фрукты', 'Мясо и птица', 'Бакалея', 
-            'Напитки', 'Хлеб и выпечка', 'Рыба и морепродукты'
-        ]
+        # Product pages read stored forecasts, see refresh_forecasts
+        forecasts = refresh_forecasts(workers=1)
+        self.stdout.write(f'Forecasts refreshed for {forecasts} products.')
+
+    def seed_categories(self):
         categories = {}
-        for name in categories_data:
+        for name in CATEGORIES:
             cat, _ = Category.objects.get_or_create(
-                name=name, 
+                name=name,
                 defaults={'slug': slugify(name, allow_unicode=True)}
             )
             categories[name] = cat
+        return categories
 
-        # Stores
-        stores_data = [
-            {'name': 'Пятерочка', 'url': 'https://5ka.ru'},
-            {'name': 'Магнит', 'url': 'https://magnit.ru'},
-            {'name': 'Перекресток', 'url': 'https://perekrestok.ru'},
-            {'name': 'ВкусВилл', 'url': 'https://vkusvill.ru'},
-            {'name': 'Ашан', 'url': 'https://auchan.ru'},
-            {'name': 'Лента', 'url': 'https://lenta.com'},
-        ]
+    def seed_stores(self, count, rng):
+        """Ids and price levels of the stores; the chains repeat as numbered stores."""
         stores = []
-        for store_data in stores_data:
-            store, _ = Store.objects.get_or_create(**store_data)
-            stores.append(store)
-
-        # Products (Name, Category Name, Approx Base Price)
-        products_data = [
-            ('Молоко Домик в деревне 3.2%', 'Молочные продукты', 90),
-            ('Творог Простоквашино 5%', 'Молочные продукты', 120),
-            ('Сыр Российский 200г', 'Молочные продукты', 250),
-            ('Йогурт Чудо питьевой', 'Молочные продукты', 60),
-            ('Сметана Брест-Литовск 15%', 'Молочные продукты', 85),
-            
-            ('Бананы Эквадор 1кг', 'Овощи и фрукты', 140),
-            ('Картофель мытый 1кг', 'Овощи и фрукты', 45),
-            ('Огурцы гладкие 1кг', 'Овощи и фрукты', 180),
-            ('Томаты сливовидные 1кг', 'Овощи и фрукты', 220),
-            ('Яблоки Гала 1кг', 'Овощи и фрукты', 110),
-            ('Апельсины 1кг', 'Овощи и фрукты', 160),
-
-            ('Куриное филе Петелинка 1кг', 'Мясо и птица', 380),
-            ('Говядина тушеная банка', 'Мясо и птица', 250),
-            ('Свинина лопатка 1кг', 'Мясо и птица', 420),
-            ('Фарш Домашний 400г', 'Мясо и птица', 190),
-
-            ('Макароны Макфа 450г', 'Бакалея', 65),
-            ('Гречка Мистраль 900г', 'Бакалея', 85),
-            ('Рис Краснодарский 900г', 'Бакалея', 95),
-            ('Масло подсолнечное 1л', 'Бакалея', 130),
-            ('Сахар 1кг', 'Бакалея', 70),
-
-            ('Сок Добрый Яблоко 1л', 'Напитки', 120),
-            ('Coca-Cola 0.9л', 'Напитки', 110),
-            ('Вода Святой Источник 1.5л', 'Напитки', 40),
-
-            ('Хлеб Бородинский', 'Хлеб и выпечка', 45),
-            ('Батон Нарезной', 'Хлеб и выпечка', 35),
-            ('Круассан 7days', 'Хлеб и выпечка', 100),
-            
-            ('Семга слабосоленая 200г', 'Рыба и морепродукты', 600),
-            ('Креветки Королевские 1кг', 'Рыба и морепродукты', 800),
-        ]
-        
+        for i in range(count):
+            name, url, level = STORES[i % len(STORES)]
+            if i >= len(STORES):
+                name = f'{name} №{i // len(STORES) + 1}'
+                level *= rng.normal(1, 0.03)
+            stores.append((name, url, level))
+
+        existing = dict(Store.objects.filter(name__in=[name for name, _, _ in stores]).values_list('name', 'id'))
+        Store.objects.bulk_create([Store(name=name, url=url) for name, url, _ in stores if name not in existing])
+        ids = dict(Store.objects.filter(name__in=[name for name, _, _ in stores]).values_list('name', 'id'))
+        return [ids[name] for name, _, _ in stores], np.array([level for _, _, level in stores])
+
+    def seed_products(self, count, categories, rng):
+        """Ids, category ids and base prices of the products; the known products repeat as numbered variants."""
         products = []
-        for name, cat_name, base_price in products_data:
-            product, _ = Product.objects.get_or_create(
-                name=name,
-                category=categories[cat_name],
-                defaults={'description': f'Вкусный и полезный продукт {name}'}
+        for i in range(count):
+            name, cat_name, base_price = PRODUCTS[i % len(PRODUCTS)]
+            if i >= len(PRODUCTS):
+                name = f'{name} ({i // len(PRODUCTS) + 1})'
+                base_price *= rng.uniform(0.7, 1.3)
+            products.append((name, categories[cat_name].pk, base_price))
+
+        existing = self.product_ids()
+        Product.objects.bulk_create([
+            Product(name=name, category_id=category_id, description=f'Вкусный и полезный продукт {name}')
+            for name, category_id, _ in products
+            if (name, category_id) not in existing
+        ], batch_size=1000)
+        ids = self.product_ids()
+        return (
+            [ids[(name, category_id)] for name, category_id, _ in products],
+            [category_id for _, category_id, _ in products],
+            np.array([price for _, _, price in products]),
+        )
+
+    def product_ids(self):
+        return {
+            (name, category_id): pk
+            for pk, name, category_id in Product.objects.values_list('id', 'name', 'category_id').iterator()
+        }
+
+    def write_prices(self, days, batch_size):
+        """
+        Fast path: the generated arrays go to executemany INSERTs without building model
+        instances. Existing prices for the same product, store and day are kept, like
+        bulk_create(ignore_conflicts=True).
+        """
+        ops = connection.ops
+        now = ops.adapt_datetimefield_value(timezone.now())
+        if interval_storage():
+            return self.write_rows(
+                PriceInterval, ['product', 'store', 'price', 'valid_from', 'valid_to', 'updated_at'],
+                (
+                    zip(products, stores, prices, map(ops.adapt_datefield_value, starts),
+                        repeat(ops.adapt_datefield_value(end)), repeat(now))
+                    for products, stores, prices, starts, end in days.interval_columns()
+                ),
+                batch_size,
             )
-            # Store base price in temporary storage on object for generation loop
-            product.base_price_seed = base_price 
-            products.append(product)
+        return self.write_rows(
+            PriceRecord, ['product', 'store', 'date_recorded', 'price', 'updated_at'],
+            (
+                zip(products, stores, repeat(ops.adapt_datefield_value(day)), prices, repeat(now))
+                for products, stores, day, prices in days.record_columns()
+            ),
+            batch_size,
+        )
+
+    def write_derived(self, days, batch_size):
+        """DailyPriceStat and CurrentPrice of the generated prices, replacing any stale rows."""
+        for model in (DailyPriceStat, CurrentPrice):
+            delete_all_rows(model)
+        adapt = connection.ops.adapt_datefield_value
+        self.write_rows(
+            DailyPriceStat, ['day', 'store', 'category', 'record_count', 'price_sum', 'price_min', 'price_max'],
+            (
+                zip(repeat(adapt(day)), *columns)
+                for day, *columns in days.stat_columns()
+            ),
+            batch_size,
+        )
+        products, stores, prices, day = days.current_columns()
+        self.write_rows(
+            CurrentPrice, ['product', 'store', 'price', 'date_recorded'],
+            [zip(products, stores, prices, repeat(adapt(day)))],
+            batch_size,
+        )
+
+    def write_rows(self, model, fields, chunks, batch_size):
+        """Inserts the row tuples of the given chunks, batch_size rows per transaction."""
+        insert = self.insert_sql(model, fields)
+        written = 0
+        pending = []
+        with connection.cursor() as cursor:
+            for chunk in chunks:
+                pending.extend(chunk)
+                if len(pending) >= batch_size:
+                    with transaction.atomic():
+                        cursor.executemany(insert, pending)
+                    written += len(pending)
+                    pending = []
+            if pending:
+                with transaction.atomic():
+                    cursor.executemany(insert, pending)
+                written += len(pending)
+        return written
+
+    def insert_sql(self, model, field_names):
+        """
+        INSERT of one row of the given fields that skips rows conflicting with a unique
+        constraint, in SQLite syntax (the project database).
+        """
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(name).column) for name in field_names)
+        placeholders = ', '.join(['%s'] * len(field_names))
+        return f'INSERT OR IGNORE INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
 
-        # Price Records
+    def merge_prices(self, days):
+        # Existing prices for the same product, store and day are kept as is
+        written = 0
+        for day_records in days.records_by_day():
+            written += upsert_price_records(day_records, update_existing=False)
+        return written
+
+
+class PriceGenerator:
+    """
+    Daily prices of every sold (product, store) pair, one NumPy vector per day.
+    A price is base price x market trend x store level x pair noise; each pair is
+    repriced on a day with probability 1 / price_change_days and keeps its price otherwise.
+    The rollup cells of every day are collected while the prices are generated.
+    """
+
+    def __init__(self, product_ids, category_ids, base_prices, store_ids, store_levels, rng, days, availability,
+                 price_change_days):
+        self.rng = rng
+        self.days = days
+        self.price_change_days = price_change_days
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+        self.store_ids = np.asarray(store_ids, dtype=np.int64)
+        self.base_prices = base_prices
+        self.store_levels = store_levels
+        # Pairs a store sells, as flat (product, store) indexes
+        sold = rng.random((len(product_ids), len(store_ids))) < availability
+        self.pair_products, self.pair_stores = np.nonzero(sold)
+
+        # Pairs sorted by (store, category) rollup cell, cut where a cell starts
+        category_ids = np.asarray(category_ids, dtype=np.int64)
+        cells = self.store_ids[self.pair_stores] * (category_ids.max() + 1) + category_ids[self.pair_products]
+        self.cell_order = np.argsort(cells, kind='stable')
+        cells = cells[self.cell_order]
+        self.cell_starts = np.flatnonzero(np.diff(cells, prepend=-1))
+        self.cell_stores = self.store_ids[self.pair_stores[self.cell_order][self.cell_starts]].tolist()
+        self.cell_categories = category_ids[self.pair_products[self.cell_order][self.cell_starts]].tolist()
+        self.cell_counts = np.diff(np.r_[self.cell_starts, len(cells)]).tolist()
+        self.stats = []
+        self.last = None
+
+    def _daily(self):
+        """Yields (day, prices of all pairs in cents, mask of repriced pairs), oldest day first."""
         today = date.today()
-        records_created = 0
-        
-        self.stdout.write(f'Generating price history for {len(products)} products...')
-        
-        for product in products:
-            base_price = getattr(product, 'base_price_seed', 100)
-            
-            # Generate records for the last 90 days
-            for day in range(90):
-                current_date = today - timedelta(days=day)
-                
-                # Market trend (sine wave to simulate ups and downs over time)
-                # Period of ~60 days approx
-                trend = math.sin(day / 10.0) * (base_price * 0.15) 
-                
-                # Global inflation/deflation factor (linear)
-                # Prices represent past, so 'day' represents how many days AGO.
-                # If day=90 (90 days ago), price might be lower.
-                # Let's say prices grow by 0.1% per day roughly
-                inflation = base_price * (0.001 * (90 - day))
-                
-                daily_base_price = base_price + trend - inflation
-
-                # For each store, try to create a record
-                for store in stores:
-                    # 80% chance a store has the item that day
-                    if random.random() < 0.8: 
-                        # Store specific pricing strategy:
-                        # Perekrestok/VkusVill might be more expensive, 
-                        # 5ka/Magnit cheaper.
-                        
-                        store_modifier = 1.0
-                        if store.name in ['ВкусВилл', 'Перекресток']:
-                            store_modifier = 1.15
-                        elif store.name in ['Пятерочка', 'Магнит']:
-                            store_modifier = 0.95
-                        
-                        # Random daily noise (-5% to +5%)
-                        noise = random.uniform(-0.05, 0.05)
-                        
-                        final_price = daily_base_price * store_modifier * (1 + noise)
-                        final_price = max(10, round(final_price, 2))
-
-                        PriceRecord.objects.get_or_create(
-                            product=product,
-                            store=store,
-                            date_recorded=current_date,
-                            defaults={'price': final_price}
-                        )
-                        records_created += 1
-
-        self.stdout.write(self.style.SUCCESS(f'Successfully seeded database. Created/Verified {records_created} price records.'))
+        n_pairs = len(self.pair_products)
+        cents = np.zeros(n_pairs, dtype=np.int64)
+        for days_ago in range(self.days - 1, -1, -1):
+            # Market trend (sine wave with a period of ~60 days) over inflation
+            trend = 1 + 0.15 * np.sin(days_ago / 10.0)
+            market = self.base_prices * trend * (1 - INFLATION_PER_DAY * days_ago)
+            if days_ago == self.days - 1:
+                repriced = np.ones(n_pairs, dtype=bool)
+            else:
+                repriced = self.rng.random(n_pairs) < 1 / self.price_change_days
+            # Random noise (-5% to +5%) per pair and reprice
+            noise = 1 + self.rng.uniform(-0.05, 0.05, int(repriced.sum()))
+            prices = market[self.pair_products[repriced]] * self.store_levels[self.pair_stores[repriced]] * noise
+            cents[repriced] = np.maximum(np.rint(prices * 100), MIN_PRICE * 100)
+            day = today - timedelta(days=days_ago)
+            if n_pairs:
+                by_cell = cents[self.cell_order]
+                self.stats.append((
+                    day,
+                    np.add.reduceat(by_cell, self.cell_starts),
+                    np.minimum.reduceat(by_cell, self.cell_starts),
+                    np.maximum.reduceat(by_cell, self.cell_starts),
+                ))
+            self.last = (day, cents)
+            yield day, cents, repriced
+
+    def record_columns(self):
+        """(product ids, store ids, day, prices) lists of the daily records, day by day."""
+        products = self.product_ids[self.pair_products].tolist()
+        stores = self.store_ids[self.pair_stores].tolist()
+        for day, cents, _ in self._daily():
+            yield products, stores, day, (cents / 100).tolist()
+
+    def records_by_day(self):
+        """PriceRecord instances (not saved), one list per day."""
+        for products, stores, day, prices in self.record_columns():
+            yield [
+                PriceRecord(product_id=product_id, store_id=store_id, date_recorded=day, price=price)
+                for product_id, store_id, price in zip(products, stores, prices)
+            ]
+
+    def interval_columns(self):
+        """
+        (product ids, store ids, prices, valid_from dates, valid_to) of the runs of
+        unchanged prices, as runs end.
+        """
+        starts = previous = None
+        last_day = None
+        for day, cents, repriced in self._daily():
+            if previous is None:
+                starts = np.full(len(cents), day.toordinal())
+            else:
+                # A reprice to the same price continues the run
+                ended = np.flatnonzero(repriced & (cents != previous))
+                yield self._runs(ended, starts, previous, day - timedelta(days=1))
+                starts[ended] = day.toordinal()
+            previous = cents.copy()
+            last_day = day
+        if previous is not None:
+            yield self._runs(np.arange(len(previous)), starts, previous, last_day)
+
+    def stat_columns(self):
+        """
+        (day, store ids, category ids, counts, price sums, min prices, max prices) of the
+        rollup cells, day by day, once the prices were generated.
+        """
+        for day, sums, mins, maxs in self.stats:
+            yield (
+                day, self.cell_stores, self.cell_categories, self.cell_counts,
+                (sums / 100).tolist(), (mins / 100).tolist(), (maxs / 100).tolist(),
+            )
+
+    def current_columns(self):
+        """(product ids, store ids, prices, day) of the prices of the last day, once generated."""
+        day, cents = self.last
+        return (
+            self.product_ids[self.pair_products].tolist(),
+            self.store_ids[self.pair_stores].tolist(),
+            (cents / 100).tolist(),
+            day,
+        )
+
+    def _runs(self, pairs, starts, cents, valid_to):
+        return (
+            self.product_ids[self.pair_products[pairs]].tolist(),
+            self.store_ids[self.pair_stores[pairs]].tolist(),
+            (cents[pairs] / 100).tolist(),
+            [date.fromordinal(start) for start in starts[pairs].tolist()],
+            valid_to,
+        )
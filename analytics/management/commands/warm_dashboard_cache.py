@@ -0,0 +1,53 @@
+import itertools
+import time
+from django.core.management.base import BaseCommand
+from analytics.models import Store, Category
+from analytics.cache import get_cached_payload
+from analytics.cube import price_cube_enabled, get_price_cube
+from analytics.utils import get_dashboard_data
+
+DASHBOARD_DAYS = [7, 30, 90]
+
+class Command(BaseCommand):
+    help = 'Precomputes cached dashboard payloads for the common filter combinations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            nargs='+',
+            default=DASHBOARD_DAYS,
+            help='Periods to warm, in days (default: 7 30 90)',
+        )
+        parser.add_argument(
+            '--all-combinations',
+            action='store_true',
+            help='Warm every store x category pair instead of single filters only',
+        )
+
+    def handle(self, *args, **kwargs):
+        # Filter values are passed as strings, exactly as the dashboard view receives them
+        store_ids = [str(pk) for pk in Store.objects.values_list('id', flat=True)]
+        category_ids = [str(pk) for pk in Category.objects.values_list('id', flat=True)]
+
+        if kwargs['all_combinations']:
+            filters = list(itertools.product([''] + store_ids, [''] + category_ids))
+        else:
+            filters = [('', '')] + [(store_id, '') for store_id in store_ids] + [('', category_id) for category_id in category_ids]
+
+        started = time.perf_counter()
+        # Requests never build the price cube: they read the rollup until it is ready
+        if price_cube_enabled():
+            get_price_cube()
+            self.stdout.write(f'Price cube built in {time.perf_counter() - started:.1f}s.')
+        for days in kwargs['days']:
+            for store_id, category_id in filters:
+                get_cached_payload(
+                    'dashboard',
+                    (days, store_id, category_id),
+                    lambda: get_dashboard_data(days, store_id, category_id),
+                )
+
+        warmed = len(kwargs['days']) * len(filters)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Dashboard cache warmed: {warmed} filter combinations in {elapsed:.1f}s.'))
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_prices(apps, schema_editor):
+    # Keep the most recently written price for every (product, store, day)
+    PriceRecord = apps.get_model("analytics", "PriceRecord")
+    duplicates = (
+        PriceRecord.objects.values("product_id", "store_id", "date_recorded")
+        .annotate(latest_id=Max("id"), records=Count("id"))
+        .filter(records__gt=1)
+    )
+    for group in duplicates.iterator():
+        PriceRecord.objects.filter(
+            product_id=group["product_id"],
+            store_id=group["store_id"],
+            date_recorded=group["date_recorded"],
+        ).exclude(id=group["latest_id"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0004_importjob"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_prices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="pricerecord",
+            constraint=models.UniqueConstraint(
+                fields=("product", "store", "date_recorded"),
+                name="unique_price_per_product_store_day",
+            ),
+        ),
+    ]
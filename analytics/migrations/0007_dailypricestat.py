@@ -0,0 +1,111 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def populate_daily_stats(apps, schema_editor):
+    PriceRecord = apps.get_model("analytics", "PriceRecord")
+    DailyPriceStat = apps.get_model("analytics", "DailyPriceStat")
+    rows = (
+        PriceRecord.objects.values("date_recorded", "store_id", "product__category_id")
+        .annotate(
+            record_count=Count("id"),
+            price_sum=Sum("price"),
+            price_min=Min("price"),
+            price_max=Max("price"),
+        )
+        .order_by()
+    )
+    DailyPriceStat.objects.bulk_create(
+        (
+            DailyPriceStat(
+                day=row["date_recorded"],
+                store_id=row["store_id"],
+                category_id=row["product__category_id"],
+                record_count=row["record_count"],
+                price_sum=row["price_sum"],
+                price_min=row["price_min"],
+                price_max=row["price_max"],
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0006_pricerecord_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyPriceStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="День")),
+                (
+                    "record_count",
+                    models.PositiveIntegerField(verbose_name="Количество записей"),
+                ),
+                (
+                    "price_sum",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=16, verbose_name="Сумма цен"
+                    ),
+                ),
+                (
+                    "price_min",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=10, verbose_name="Минимальная цена"
+                    ),
+                ),
+                (
+                    "price_max",
+                    models.DecimalField(
+                        decimal_places=2,
+                        max_digits=10,
+                        verbose_name="Максимальная цена",
+                    ),
+                ),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.category",
+                        verbose_name="Категория",
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.store",
+                        verbose_name="Магазин",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Дневная статистика цен",
+                "verbose_name_plural": "Дневная статистика цен",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("day", "store", "category"),
+                        name="unique_daily_stat_per_store_category",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0007_dailypricestat"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductForecast",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "model_status",
+                    models.CharField(
+                        choices=[
+                            ("success", "Рассчитан"),
+                            ("insufficient_data", "Недостаточно данных"),
+                        ],
+                        max_length=32,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "r2_score",
+                    models.FloatField(blank=True, null=True, verbose_name="R²"),
+                ),
+                (
+                    "predicted_price",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Прогноз цены",
+                    ),
+                ),
+                (
+                    "trend",
+                    models.FloatField(
+                        blank=True, null=True, verbose_name="Тренд, ₽/день"
+                    ),
+                ),
+                (
+                    "days_ahead",
+                    models.PositiveIntegerField(
+                        default=30, verbose_name="Горизонт, дней"
+                    ),
+                ),
+                (
+                    "computed_at",
+                    models.DateTimeField(db_index=True, verbose_name="Дата расчета"),
+                ),
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="forecast",
+                        to="analytics.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Прогноз цены",
+                "verbose_name_plural": "Прогнозы цен",
+            },
+        ),
+    ]
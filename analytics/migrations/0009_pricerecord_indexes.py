@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:32
+
+from django.db import migrations, models
+
+
+def analyze_tables(apps, schema_editor):
+    # Without statistics the SQLite planner often prefers a full index scan
+    # that avoids a sort over a range search on the new indexes
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("ANALYZE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0008_productforecast"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pricerecord",
+            index=models.Index(
+                fields=["product", "date_recorded", "price"],
+                name="pricerecord_product_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pricerecord",
+            index=models.Index(
+                fields=["store", "date_recorded"], name="pricerecord_store_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pricerecord",
+            index=models.Index(fields=["date_recorded"], name="pricerecord_date_idx"),
+        ),
+        migrations.RunPython(analyze_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0009_pricerecord_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PriceInterval",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "price",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=10, verbose_name="Цена"
+                    ),
+                ),
+                ("valid_from", models.DateField(verbose_name="Действует с")),
+                ("valid_to", models.DateField(verbose_name="Действует по")),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True, db_index=True, verbose_name="Дата изменения"
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.store",
+                        verbose_name="Магазин",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Интервал цены",
+                "verbose_name_plural": "Интервалы цен",
+                "indexes": [
+                    models.Index(
+                        fields=["store", "valid_to", "valid_from"],
+                        name="priceinterval_store_days_idx",
+                    ),
+                    models.Index(
+                        fields=["valid_to", "valid_from"], name="priceinterval_days_idx"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "store", "valid_from"),
+                        name="unique_price_interval_start",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,111 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def populate_current_prices(apps, schema_editor):
+    CurrentPrice = apps.get_model("analytics", "CurrentPrice")
+    if getattr(settings, "PRICE_STORAGE", "daily") == "intervals":
+        PriceInterval = apps.get_model("analytics", "PriceInterval")
+        latest_start = (
+            PriceInterval.objects.filter(
+                product=OuterRef("product"), store=OuterRef("store")
+            )
+            .order_by("-valid_from")
+            .values("valid_from")[:1]
+        )
+        rows = PriceInterval.objects.filter(
+            valid_from=Subquery(latest_start)
+        ).values_list("product_id", "store_id", "price", "valid_to")
+    else:
+        PriceRecord = apps.get_model("analytics", "PriceRecord")
+        latest_date = (
+            PriceRecord.objects.filter(
+                product=OuterRef("product"), store=OuterRef("store")
+            )
+            .order_by("-date_recorded")
+            .values("date_recorded")[:1]
+        )
+        rows = PriceRecord.objects.filter(
+            date_recorded=Subquery(latest_date)
+        ).values_list("product_id", "store_id", "price", "date_recorded")
+    CurrentPrice.objects.bulk_create(
+        (
+            CurrentPrice(
+                product_id=product_id,
+                store_id=store_id,
+                price=price,
+                date_recorded=day,
+            )
+            for product_id, store_id, price, day in rows.iterator()
+        ),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0010_priceinterval"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CurrentPrice",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "price",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=10, verbose_name="Цена"
+                    ),
+                ),
+                ("date_recorded", models.DateField(verbose_name="Дата записи")),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="current_prices",
+                        to="analytics.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.store",
+                        verbose_name="Магазин",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Текущая цена",
+                "verbose_name_plural": "Текущие цены",
+                "indexes": [
+                    models.Index(
+                        fields=["date_recorded", "store", "price"],
+                        name="currentprice_date_store_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "store"),
+                        name="unique_current_price_per_store",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_current_prices, migrations.RunPython.noop),
+    ]
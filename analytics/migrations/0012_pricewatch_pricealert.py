@@ -0,0 +1,155 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0011_currentprice"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PriceWatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "threshold",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=10, verbose_name="Порог цены"
+                    ),
+                ),
+                (
+                    "is_active",
+                    models.BooleanField(default=True, verbose_name="Активно"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="watches",
+                        to="analytics.product",
+                        verbose_name="Товар",
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        blank=True,
+                        help_text="Пусто — любой магазин",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.store",
+                        verbose_name="Магазин",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="price_watches",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Отслеживание цены",
+                "verbose_name_plural": "Отслеживания цен",
+            },
+        ),
+        migrations.CreateModel(
+            name="PriceAlert",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "price",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=10, verbose_name="Цена"
+                    ),
+                ),
+                ("date_recorded", models.DateField(verbose_name="Дата записи")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Дата создания"
+                    ),
+                ),
+                (
+                    "sent_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Дата отправки"
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="analytics.store",
+                        verbose_name="Магазин",
+                    ),
+                ),
+                (
+                    "watch",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="alerts",
+                        to="analytics.pricewatch",
+                        verbose_name="Отслеживание",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Уведомление о цене",
+                "verbose_name_plural": "Уведомления о ценах",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="pricewatch",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["product", "threshold"],
+                name="pricewatch_active_product_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pricealert",
+            index=models.Index(
+                fields=["watch", "store", "price"], name="pricealert_watch_store_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pricealert",
+            index=models.Index(
+                condition=models.Q(("sent_at__isnull", True)),
+                fields=["created_at"],
+                name="pricealert_unsent_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0012_pricewatch_pricealert"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Аренда до"),
+        ),
+    ]
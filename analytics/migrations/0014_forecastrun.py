@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0013_importjob_lease_expires_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ForecastRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField(verbose_name="Начало")),
+                ("cutoff", models.DateTimeField(verbose_name="Учтены изменения до")),
+                ("finished_at", models.DateTimeField(verbose_name="Окончание")),
+                (
+                    "products",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Пересчитано товаров"
+                    ),
+                ),
+                (
+                    "full",
+                    models.BooleanField(default=False, verbose_name="Полный пересчет"),
+                ),
+            ],
+            options={
+                "verbose_name": "Пересчет прогнозов",
+                "verbose_name_plural": "Пересчеты прогнозов",
+                "ordering": ["-started_at"],
+            },
+        ),
+        migrations.AddField(
+            model_name="productforecast",
+            name="prices_changed_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, null=True, verbose_name="Цены изменены"
+            ),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -29,6 +29,11 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # A category change refreshes the rollup in post_save, which must commit with the change
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 class Store(models.Model):
     name = models.CharField(max_length=100, verbose_name="Название")
     url = models.URLField(verbose_name="Ссылка")
@@ -46,14 +51,107 @@ class PriceRecord(models.Model):
     store = models.ForeignKey(Store, on_delete=models.CASCADE, verbose_name="Магазин")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
     date_recorded = models.DateField(default=timezone.now, verbose_name="Дата записи")
+    # Change watermark for incremental exports, also bumped by import upserts
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Дата изменения")
 
     class Meta:
         verbose_name = "Запись о цене"
         verbose_name_plural = "Записи о ценах"
+        constraints = [
+            # One price per product, store and day; imports upsert on this key
+            models.UniqueConstraint(fields=['product', 'store', 'date_recorded'], name='unique_price_per_product_store_day'),
+        ]
+        indexes = [
+            # Product history in date order; price makes it covering for forecasts
+            models.Index(fields=['product', 'date_recorded', 'price'], name='pricerecord_product_date_idx'),
+            # Store charts, exports and rollup refreshes filtered by store and date
+            models.Index(fields=['store', 'date_recorded'], name='pricerecord_store_date_idx'),
+            # Date windows over the whole catalog
+            models.Index(fields=['date_recorded'], name='pricerecord_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.price} at {self.store.name}"
 
+    def save(self, *args, **kwargs):
+        # The derived tables are refreshed in post_save, in the same transaction as the row
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+class PriceInterval(models.Model):
+    """
+    One price of a product in a store over consecutive days, valid_from to valid_to
+    inclusive. Replaces PriceRecord rows when PRICE_STORAGE = 'intervals'.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Товар")
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, verbose_name="Магазин")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
+    valid_from = models.DateField(verbose_name="Действует с")
+    valid_to = models.DateField(verbose_name="Действует по")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Дата изменения")
+
+    class Meta:
+        verbose_name = "Интервал цены"
+        verbose_name_plural = "Интервалы цен"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store', 'valid_from'], name='unique_price_interval_start'),
+        ]
+        indexes = [
+            # Intervals covering a day, per store (rollup refreshes)
+            models.Index(fields=['store', 'valid_to', 'valid_from'], name='priceinterval_store_days_idx'),
+            models.Index(fields=['valid_to', 'valid_from'], name='priceinterval_days_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}@{self.store_id}: {self.price} ({self.valid_from} - {self.valid_to})"
+
+class DailyPriceStat(models.Model):
+    """
+    Daily rollup of PriceRecord per store and category, maintained by analytics.rollups.
+    Averages over any combination of cells are sum(price_sum) / sum(record_count).
+    """
+    day = models.DateField(verbose_name="День")
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, verbose_name="Магазин")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
+    record_count = models.PositiveIntegerField(verbose_name="Количество записей")
+    price_sum = models.DecimalField(max_digits=16, decimal_places=2, verbose_name="Сумма цен")
+    price_min = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Минимальная цена")
+    price_max = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Максимальная цена")
+
+    class Meta:
+        verbose_name = "Дневная статистика цен"
+        verbose_name_plural = "Дневная статистика цен"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'store', 'category'], name='unique_daily_stat_per_store_category'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.store_id}/{self.category_id}: {self.record_count}"
+
+class CurrentPrice(models.Model):
+    """
+    Latest price of a product in a store, maintained by analytics.rollups from
+    PriceRecord (or PriceInterval in interval storage).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='current_prices', verbose_name="Товар")
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, verbose_name="Магазин")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
+    date_recorded = models.DateField(verbose_name="Дата записи")
+
+    class Meta:
+        verbose_name = "Текущая цена"
+        verbose_name_plural = "Текущие цены"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'store'], name='unique_current_price_per_store'),
+        ]
+        indexes = [
+            # Store baskets of products priced since a date; price makes it covering
+            models.Index(fields=['date_recorded', 'store', 'price'], name='currentprice_date_store_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}@{self.store_id}: {self.price} ({self.date_recorded})"
+
 class ShoppingList(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
     products = models.ManyToManyField(Product, verbose_name="Товары")
@@ -65,3 +163,145 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f"Shopping List for {self.user.username}"
+
+class PriceWatch(models.Model):
+    """A user's price threshold for a product, in one store or in any store."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='price_watches', verbose_name="Пользователь")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='watches', verbose_name="Товар")
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Магазин",
+                              help_text="Пусто — любой магазин")
+    threshold = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Порог цены")
+    is_active = models.BooleanField(default=True, verbose_name="Активно")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        verbose_name = "Отслеживание цены"
+        verbose_name_plural = "Отслеживания цен"
+        indexes = [
+            # The alert matcher joins the active watches of the imported products
+            models.Index(fields=['product', 'threshold'], condition=models.Q(is_active=True), name='pricewatch_active_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: product #{self.product_id} below {self.threshold}"
+
+class PriceAlert(models.Model):
+    """
+    Outbox of price-drop notifications, written by analytics.alerts. Senders pick
+    the rows with an empty sent_at and fill it in once delivered.
+    """
+    watch = models.ForeignKey(PriceWatch, on_delete=models.CASCADE, related_name='alerts', verbose_name="Отслеживание")
+    store = models.ForeignKey(Store, on_delete=models.CASCADE, verbose_name="Магазин")
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
+    date_recorded = models.DateField(verbose_name="Дата записи")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата отправки")
+
+    class Meta:
+        verbose_name = "Уведомление о цене"
+        verbose_name_plural = "Уведомления о ценах"
+        indexes = [
+            # Lowest price already notified per watch and store
+            models.Index(fields=['watch', 'store', 'price'], name='pricealert_watch_store_idx'),
+            models.Index(fields=['created_at'], condition=models.Q(sent_at__isnull=True), name='pricealert_unsent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Watch #{self.watch_id}: {self.price} at store #{self.store_id} ({self.date_recorded})"
+
+class ImportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Завершено'
+        FAILED = 'failed', 'Ошибка'
+
+    file = models.FileField(upload_to='imports/', verbose_name="Файл")
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING, db_index=True, verbose_name="Статус")
+    total_rows = models.PositiveIntegerField(null=True, blank=True, verbose_name="Всего строк")
+    rows_processed = models.PositiveIntegerField(default=0, verbose_name="Обработано строк")
+    records_written = models.PositiveIntegerField(default=0, verbose_name="Записано цен")
+    rows_skipped = models.PositiveIntegerField(default=0, verbose_name="Пропущено дубликатов")
+    rows_rejected = models.PositiveIntegerField(default=0, verbose_name="Отклонено строк")
+    rejected_sample = models.JSONField(default=list, blank=True, verbose_name="Примеры отклоненных строк")
+    elapsed = models.FloatField(default=0, verbose_name="Время обработки, с")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начало")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Окончание")
+    # Set when a worker claims the job and renewed with every committed chunk;
+    # a running job whose lease expired lost its worker and is claimed again
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name="Аренда до")
+
+    class Meta:
+        verbose_name = "Задача импорта"
+        verbose_name_plural = "Задачи импорта"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Import #{self.pk} ({self.status})"
+
+    @property
+    def progress(self):
+        if self.status == self.Status.DONE:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, round(self.rows_processed * 100 / self.total_rows))
+
+class ProductForecast(models.Model):
+    """Latest price forecast of a product, precomputed by the refresh_forecasts command."""
+    class Status(models.TextChoices):
+        SUCCESS = 'success', 'Рассчитан'
+        INSUFFICIENT_DATA = 'insufficient_data', 'Недостаточно данных'
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='forecast', verbose_name="Товар")
+    model_status = models.CharField(max_length=32, choices=Status.choices, verbose_name="Статус")
+    r2_score = models.FloatField(null=True, blank=True, verbose_name="R²")
+    predicted_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Прогноз цены")
+    trend = models.FloatField(null=True, blank=True, verbose_name="Тренд, ₽/день")
+    days_ahead = models.PositiveIntegerField(default=30, verbose_name="Горизонт, дней")
+    # Start of the refresh run
+    computed_at = models.DateTimeField(db_index=True, verbose_name="Дата расчета")
+    # Set when prices of the product are deleted or moved to another day, store or product,
+    # which the updated_at of the remaining price rows does not show
+    prices_changed_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name="Цены изменены")
+
+    class Meta:
+        verbose_name = "Прогноз цены"
+        verbose_name_plural = "Прогнозы цен"
+
+    def __str__(self):
+        return f"Forecast for product #{self.product_id} ({self.model_status})"
+
+    def as_dict(self):
+        """The forecast in the get_price_forecast format."""
+        if self.model_status != self.Status.SUCCESS:
+            return {'model_status': self.model_status}
+        return {
+            'model_status': self.model_status,
+            'r2_score': self.r2_score,
+            'predicted_price': float(self.predicted_price),
+            'trend': self.trend,
+            'dates': [],
+            'prices': [],
+        }
+
+class ForecastRun(models.Model):
+    """
+    A finished refresh_forecasts run. Prices changed at or after the cutoff of the last
+    run may be missing from its forecasts and are recomputed by the next one.
+    """
+    started_at = models.DateTimeField(verbose_name="Начало")
+    cutoff = models.DateTimeField(verbose_name="Учтены изменения до")
+    finished_at = models.DateTimeField(verbose_name="Окончание")
+    products = models.PositiveIntegerField(default=0, verbose_name="Пересчитано товаров")
+    full = models.BooleanField(default=False, verbose_name="Полный пересчет")
+
+    class Meta:
+        verbose_name = "Пересчет прогнозов"
+        verbose_name_plural = "Пересчеты прогнозов"
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Forecast run {self.started_at:%Y-%m-%d %H:%M} ({self.products} products)"
@@ -0,0 +1,192 @@
+"""
+Shopping list optimizer.
+
+A list is priced from CurrentPrice as a products x stores matrix (missing prices
+are a large penalty instead of infinity, so totals stay finite and a set of
+stores that covers more products is always cheaper). Two questions are answered
+from the matrix with NumPy:
+
+* rank_stores: the total of the whole list in every single store,
+* best_split: the cheapest way to buy the list in at most k stores, each product
+  in the cheapest store of the set.
+
+best_split is a depth-first branch and bound over store sets. The children of a
+set are all priced at once as one matrix operation, and a branch is cut when
+even its best possible extension cannot beat the cheapest set found so far:
+adding a store to a bigger set never saves more than adding it to a smaller one,
+so the savings of each store over the current set bound every deeper level, and
+no set can buy a product below the cheapest price among the stores it may still add.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from .importer import _in_lookup_size
+from .models import CurrentPrice, Store
+
+PRICE_MAX_AGE_DAYS = 30
+MAX_SPLIT_STORES = 3
+# Price of a product a store does not sell: more than any real basket
+MISSING = 1e9
+
+
+class PriceMatrix:
+    """prices[p, s] of product_ids[p] in store_ids[s], MISSING where the store has no current price."""
+
+    def __init__(self, product_ids, store_ids, prices):
+        self.product_ids = product_ids
+        self.store_ids = store_ids
+        self.prices = prices
+        self._rows = {product_id: i for i, product_id in enumerate(product_ids.tolist())}
+
+    def rows(self, product_ids):
+        """Sub-matrix of the given products; products without any price get a MISSING row."""
+        product_ids = np.array(sorted(set(product_ids)), dtype=np.int64)
+        prices = np.full((len(product_ids), len(self.store_ids)), MISSING)
+        for i, product_id in enumerate(product_ids.tolist()):
+            row = self._rows.get(product_id)
+            if row is not None:
+                prices[i] = self.prices[row]
+        return PriceMatrix(product_ids, self.store_ids, prices)
+
+
+def load_price_matrix(product_ids=None, max_age_days=PRICE_MAX_AGE_DAYS):
+    """Current prices recorded in the last max_age_days days, for the given products (all if None)."""
+    current = CurrentPrice.objects.filter(date_recorded__gte=date.today() - timedelta(days=max_age_days))
+    if product_ids is None:
+        rows = list(current.values_list('product_id', 'store_id', 'price'))
+    else:
+        product_ids = sorted(product_ids)
+        size = _in_lookup_size()
+        rows = [
+            row
+            for i in range(0, len(product_ids), size)
+            for row in current.filter(product_id__in=product_ids[i:i + size]).values_list('product_id', 'store_id', 'price')
+        ]
+
+    store_ids = np.array(sorted(Store.objects.values_list('id', flat=True)), dtype=np.int64)
+    if not rows:
+        return PriceMatrix(np.empty(0, dtype=np.int64), store_ids, np.full((0, len(store_ids)), MISSING))
+    products, stores, prices = zip(*rows)
+    product_ids, product_rows = np.unique(np.array(products, dtype=np.int64), return_inverse=True)
+    matrix = np.full((len(product_ids), len(store_ids)), MISSING)
+    matrix[product_rows, np.searchsorted(store_ids, stores)] = np.array(prices, dtype=np.float64)
+    return PriceMatrix(product_ids, store_ids, matrix)
+
+
+def _money(value):
+    return Decimal(str(round(float(value), 2))).quantize(Decimal('0.01'))
+
+
+def _basket(matrix, stores):
+    """Total, missing products and per-store assignment of buying the list in the given store columns."""
+    stores = list(stores)
+    if not len(matrix.product_ids):
+        return {'total': Decimal('0.00'), 'missing': [], 'stores': []}
+    prices = matrix.prices[:, stores]
+    cheapest = prices.argmin(axis=1)
+    best = prices[np.arange(len(prices)), cheapest]
+    available = best < MISSING
+    assignment = []
+    for column, store in enumerate(stores):
+        bought = available & (cheapest == column)
+        if bought.any():
+            assignment.append({
+                'store_id': int(matrix.store_ids[store]),
+                'product_ids': matrix.product_ids[bought].tolist(),
+                'total': _money(best[bought].sum()),
+            })
+    return {
+        'total': _money(best[available].sum()),
+        'missing': matrix.product_ids[~available].tolist(),
+        'stores': assignment,
+    }
+
+
+def rank_stores(matrix):
+    """Every store with the total of the list in it, most complete and then cheapest first."""
+    totals = np.where(matrix.prices < MISSING, matrix.prices, 0).sum(axis=0)
+    missing = (matrix.prices >= MISSING).sum(axis=0)
+    order = np.lexsort((matrix.store_ids, totals, missing))
+    return [
+        {'store_id': int(matrix.store_ids[s]), 'total': _money(totals[s]), 'missing': int(missing[s])}
+        for s in order.tolist()
+    ]
+
+
+def best_split(matrix, k=2):
+    """
+    Cheapest set of at most k stores to buy the list in, each product in the
+    cheapest store of the set. Returns the _basket of that set and the number of
+    store sets whose price was computed.
+    """
+    prices = matrix.prices
+    n_stores = prices.shape[1]
+    if not n_stores or not len(prices):
+        return dict(_basket(matrix, []), evaluated=0)
+
+    # Stores that are never cheaper than another store for any product cannot improve a set
+    candidates = np.arange(n_stores)
+    totals = prices.sum(axis=0)
+    for s in np.argsort(totals, kind='stable'):
+        others = candidates[candidates != s]
+        if len(others) and (prices[:, others] <= prices[:, [s]]).all(axis=0).any():
+            candidates = others
+
+    best = {'cost': np.inf, 'stores': ()}
+    evaluated = 0
+
+    def search(chosen, base, cost, pool, rows):
+        # base is the price of every product in the chosen set and cost its sum;
+        # rows[i] are the prices of store pool[i], one contiguous row per store
+        nonlocal evaluated
+        costs = np.minimum(base, rows).sum(axis=1)
+        evaluated += len(pool)
+        order = np.argsort(costs, kind='stable')
+        if costs[order[0]] < best['cost']:
+            best['cost'], best['stores'] = costs[order[0]], chosen + (int(pool[order[0]]),)
+        slots = k - len(chosen) - 1
+        if not slots or len(pool) < 2:
+            return
+        # Sorted once, so the pool of every child is a view of the stores after it
+        pool, costs, rows = pool[order], costs[order], rows[order]
+        savings = cost - costs
+        # Deeper sets under pool[i] buy every product at least at the cheapest price of
+        # the set, pool[i] and all the stores after it
+        after = np.minimum.accumulate(rows[::-1], axis=0)[::-1]
+        floors = np.minimum(np.minimum(base, rows[:-1]), after[1:]).sum(axis=1)
+        for i in range(len(pool) - 1):
+            # Stores after pool[i] save at most savings[i + 1] each over the deeper sets
+            if costs[i] - slots * max(savings[i + 1], 0) >= best['cost']:
+                break
+            if floors[i] >= best['cost']:
+                continue
+            search(chosen + (int(pool[i]),), np.minimum(base, rows[i]), costs[i], pool[i + 1:], rows[i + 1:])
+
+    start = np.full(len(prices), MISSING * 10)
+    search((), start, start.sum(), candidates, np.ascontiguousarray(prices[:, candidates].T))
+    return dict(_basket(matrix, best['stores']), evaluated=evaluated)
+
+
+def optimize_list(shopping_list, k=2, matrix=None):
+    """Store ranking and best k-store split of a ShoppingList. matrix may be shared across lists."""
+    product_ids = [product.pk for product in shopping_list.products.all()]
+    if matrix is None:
+        matrix = load_price_matrix(product_ids)
+    matrix = matrix.rows(product_ids)
+    return {
+        'shopping_list': shopping_list.pk,
+        'products': len(product_ids),
+        'stores': rank_stores(matrix),
+        'split': best_split(matrix, k),
+    }
+
+
+def optimize_lists(shopping_lists, k=2):
+    """optimize_list of many lists with one price matrix for all their products."""
+    shopping_lists = list(shopping_lists.prefetch_related('products'))
+    product_ids = {product.pk for shopping_list in shopping_lists for product in shopping_list.products.all()}
+    matrix = load_price_matrix(product_ids)
+    for shopping_list in shopping_lists:
+        yield shopping_list, optimize_list(shopping_list, k, matrix)
@@ -0,0 +1,375 @@
+"""
+Maintenance of the tables derived from the price history: the DailyPriceStat
+rollup (day x store x category) and CurrentPrice (latest price per product and store),
+followed by the price-drop alerts of the refreshed current prices (analytics.alerts).
+
+Writes mark the (day, store) cells and the products they touched, and the marked
+cells and products are recomputed from PriceRecord (or PriceInterval in interval
+storage) in the same transaction as the write: a failed refresh rolls the write
+back, and readers never see new prices next to an old rollup. Inside a
+batched_refresh() block, e.g. one chunk of an import job, every touched cell is
+refreshed once when the block ends: one DELETE and one INSERT ... SELECT ... GROUP BY
+per chunk of cells, or per day in interval storage, where an interval covers many days.
+
+Inserted and updated prices do not need the history to update CurrentPrice: they
+are upserted from the written rows, and replace a current price only when they
+are at least as recent. Deletes and rows moved to another day, store or product
+recompute the current prices of their products from the history instead.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum, Min, Max, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import PriceRecord, PriceInterval, DailyPriceStat, CurrentPrice, ProductForecast
+from .alerts import match_price_alerts
+from .cache import bump_data_version
+from .intervals import interval_storage, _in_lookup_size, _to_price
+
+BATCH_SIZE = 5000
+# OR-ed terms per cell filter, well within SQLite's expression depth limit
+MAX_CELL_TERMS = 100
+STATS_COLUMNS = ['day', 'store_id', 'category_id', 'record_count', 'price_sum', 'price_min', 'price_max']
+CURRENT_PRICE_COLUMNS = ['product_id', 'store_id', 'price', 'date_recorded']
+
+# Refresh collected by the current batched_refresh() block, per thread
+_batch = threading.local()
+
+
+def _stats_query(records):
+    return records.values('date_recorded', 'store_id', 'product__category_id').annotate(
+        record_count=Count('id'),
+        price_sum=Sum('price'),
+        price_min=Min('price'),
+        price_max=Max('price'),
+    ).order_by()
+
+
+def _insert_stats(records):
+    """Writes the rollup cells of a PriceRecord queryset with one INSERT ... SELECT ... GROUP BY."""
+    rows = _stats_query(records).values_list(
+        'date_recorded', 'store_id', 'product__category_id', 'record_count', 'price_sum', 'price_min', 'price_max',
+    )
+    sql, params = rows.query.sql_with_params()
+    target = ', '.join(connection.ops.quote_name(column) for column in STATS_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(DailyPriceStat._meta.db_table)} ({target}) {sql}', params)
+        return cursor.rowcount
+
+
+def _cell_blocks(keys):
+    """
+    Yields lists of (days, store_ids) blocks covering exactly the given (day, store_id)
+    cells, each list small enough to filter one statement. Days touched in the same
+    stores share a block, so an import spanning many days and stores stays a few terms.
+    """
+    stores_by_day = {}
+    for day, store_id in keys:
+        stores_by_day.setdefault(day, set()).add(store_id)
+    days_by_stores = {}
+    for day, store_ids in stores_by_day.items():
+        days_by_stores.setdefault(tuple(sorted(store_ids)), []).append(day)
+
+    size = _in_lookup_size()
+    step = size // 2
+    blocks, params = [], 0
+    for store_ids, days in days_by_stores.items():
+        days.sort()
+        for i in range(0, len(days), step):
+            for j in range(0, len(store_ids), step):
+                block = (days[i:i + step], store_ids[j:j + step])
+                if blocks and (params + len(block[0]) + len(block[1]) > size or len(blocks) >= MAX_CELL_TERMS):
+                    yield blocks
+                    blocks, params = [], 0
+                blocks.append(block)
+                params += len(block[0]) + len(block[1])
+    if blocks:
+        yield blocks
+
+
+def _cells_filter(blocks, day_field):
+    cells = Q()
+    for days, store_ids in blocks:
+        cells |= Q(**{f'{day_field}__in': days, 'store_id__in': store_ids})
+    return cells
+
+
+def _interval_stats_rows(day, store_ids=None):
+    # In interval storage a day's prices are the intervals covering it
+    intervals = PriceInterval.objects.filter(valid_from__lte=day, valid_to__gte=day)
+    if store_ids is not None:
+        intervals = intervals.filter(store_id__in=store_ids)
+    rows = intervals.values('store_id', 'product__category_id').annotate(
+        record_count=Count('id'),
+        price_sum=Sum('price'),
+        price_min=Min('price'),
+        price_max=Max('price'),
+    ).order_by()
+    return ({**row, 'date_recorded': day} for row in rows)
+
+
+def _interval_days(start_date=None):
+    bounds = PriceInterval.objects.aggregate(first=Min('valid_from'), last=Max('valid_to'))
+    if bounds['first'] is None:
+        return
+    day = max(bounds['first'], start_date) if start_date else bounds['first']
+    while day <= bounds['last']:
+        yield day
+        day += timedelta(days=1)
+
+
+def _build_stats(rows):
+    return (
+        DailyPriceStat(
+            day=row['date_recorded'],
+            store_id=row['store_id'],
+            category_id=row['product__category_id'],
+            record_count=row['record_count'],
+            price_sum=row['price_sum'],
+            price_min=row['price_min'],
+            price_max=row['price_max'],
+        )
+        for row in rows
+    )
+
+
+def _bulk_create(stats):
+    batch = []
+    created = 0
+    for stat in stats:
+        batch.append(stat)
+        if len(batch) >= BATCH_SIZE:
+            DailyPriceStat.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    DailyPriceStat.objects.bulk_create(batch)
+    return created + len(batch)
+
+
+def refresh_daily_stats(keys):
+    """
+    Recomputes the rollup for the given (day, store_id) cells from PriceRecord, with one
+    DELETE and one INSERT ... SELECT per chunk of cells. In interval storage every day
+    is aggregated on its own from the intervals covering it.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+
+    with transaction.atomic():
+        if interval_storage():
+            stores_by_day = {}
+            for day, store_id in keys:
+                stores_by_day.setdefault(day, set()).add(store_id)
+            for day, store_ids in stores_by_day.items():
+                DailyPriceStat.objects.filter(day=day, store_id__in=store_ids).delete()
+                _bulk_create(_build_stats(_interval_stats_rows(day, store_ids)))
+        else:
+            for blocks in _cell_blocks(keys):
+                DailyPriceStat.objects.filter(_cells_filter(blocks, 'day')).delete()
+                _insert_stats(PriceRecord.objects.filter(_cells_filter(blocks, 'date_recorded')))
+    # Cached analytics payloads are stale from here on
+    transaction.on_commit(bump_data_version)
+
+
+def rebuild_daily_stats(start_date=None, intervals=None):
+    """
+    Rebuilds the rollup from scratch, or from start_date onwards. Returns the number of cells.
+    intervals picks the storage read, PriceInterval or PriceRecord, by default the configured one.
+    """
+    if intervals is None:
+        intervals = interval_storage()
+    records = PriceRecord.objects.all()
+    stats = DailyPriceStat.objects.all()
+    if start_date:
+        records = records.filter(date_recorded__gte=start_date)
+        stats = stats.filter(day__gte=start_date)
+
+    with transaction.atomic():
+        stats.delete()
+        if intervals:
+            rows = (row for day in _interval_days(start_date) for row in _interval_stats_rows(day))
+            created = _bulk_create(_build_stats(rows))
+        else:
+            created = _insert_stats(records)
+        transaction.on_commit(bump_data_version)
+    return created
+
+
+def _latest_prices(product_ids=None, intervals=None):
+    """(product_id, store_id, price, date) of the latest price of every store, for the given products or all."""
+    if intervals is None:
+        intervals = interval_storage()
+    if intervals:
+        latest_start = PriceInterval.objects.filter(
+            product=OuterRef('product'),
+            store=OuterRef('store'),
+        ).order_by('-valid_from').values('valid_from')[:1]
+        rows = PriceInterval.objects.filter(valid_from=Subquery(latest_start))
+        columns = ('product_id', 'store_id', 'price', 'valid_to')
+    else:
+        # Found through the unique (product, store, date) index
+        latest_date = PriceRecord.objects.filter(
+            product=OuterRef('product'),
+            store=OuterRef('store'),
+        ).order_by('-date_recorded').values('date_recorded')[:1]
+        rows = PriceRecord.objects.filter(date_recorded=Subquery(latest_date))
+        columns = ('product_id', 'store_id', 'price', 'date_recorded')
+    if product_ids is not None:
+        rows = rows.filter(product_id__in=product_ids)
+    return rows.values_list(*columns).iterator(chunk_size=BATCH_SIZE)
+
+
+def _save_current_prices(rows):
+    batch = []
+    created = 0
+    for product_id, store_id, price, day in rows:
+        batch.append(CurrentPrice(product_id=product_id, store_id=store_id, price=price, date_recorded=day))
+        if len(batch) >= BATCH_SIZE:
+            CurrentPrice.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    CurrentPrice.objects.bulk_create(batch)
+    return created + len(batch)
+
+
+def refresh_current_prices(product_ids):
+    """Recomputes CurrentPrice of the given products, for all their stores."""
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    size = _in_lookup_size()
+    with transaction.atomic():
+        for i in range(0, len(product_ids), size):
+            chunk = product_ids[i:i + size]
+            CurrentPrice.objects.filter(product_id__in=chunk).delete()
+            _save_current_prices(_latest_prices(chunk))
+
+
+def upsert_current_prices(prices):
+    """
+    Writes {(product_id, store_id): (day, price)} into CurrentPrice with INSERT ... ON CONFLICT
+    DO UPDATE, keeping the current price where it is more recent than the given one.
+    """
+    rows = [
+        (product_id, store_id, connection.ops.adapt_decimalfield_value(_to_price(price)),
+         connection.ops.adapt_datefield_value(day))
+        for (product_id, store_id), (day, price) in prices.items()
+    ]
+    if not rows:
+        return
+    table = connection.ops.quote_name(CurrentPrice._meta.db_table)
+    quote = connection.ops.quote_name
+    target = ', '.join(quote(column) for column in CURRENT_PRICE_COLUMNS)
+    size = _in_lookup_size() // len(CURRENT_PRICE_COLUMNS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(rows), size):
+            chunk = rows[i:i + size]
+            values = ', '.join(['(%s, %s, %s, %s)'] * len(chunk))
+            cursor.execute(
+                f'INSERT INTO {table} ({target}) VALUES {values} '
+                f'ON CONFLICT ({quote("product_id")}, {quote("store_id")}) DO UPDATE '
+                f'SET {quote("price")} = excluded.{quote("price")}, '
+                f'{quote("date_recorded")} = excluded.{quote("date_recorded")} '
+                f'WHERE excluded.{quote("date_recorded")} >= {table}.{quote("date_recorded")}',
+                [value for row in chunk for value in row],
+            )
+
+
+def mark_forecasts_changed(product_ids):
+    """
+    Flags the stored forecasts of products whose prices were deleted or moved, for the
+    next incremental refresh_forecasts run (see forecasting.stale_product_ids).
+    """
+    product_ids = sorted(product_ids)
+    now = timezone.now()
+    size = _in_lookup_size()
+    for i in range(0, len(product_ids), size):
+        ProductForecast.objects.filter(product_id__in=product_ids[i:i + size]).update(prices_changed_at=now)
+
+
+def rebuild_current_prices(intervals=None):
+    """Rebuilds CurrentPrice from scratch, from the storage picked like in rebuild_daily_stats. Returns the number of rows."""
+    with transaction.atomic():
+        CurrentPrice.objects.all().delete()
+        return _save_current_prices(_latest_prices(intervals=intervals))
+
+
+def _add_prices(latest, prices):
+    """Adds (product_id, store_id, day, price) rows to {(product_id, store_id): (day, price)}, the latest day winning."""
+    for product_id, store_id, day, price in prices:
+        if hasattr(day, 'date'):
+            day = day.date()
+        known = latest.get((product_id, store_id))
+        if known is None or day >= known[0]:
+            latest[product_id, store_id] = (day, price)
+
+
+class _PendingRefresh:
+    def __init__(self):
+        self.keys = set()
+        self.product_ids = set()
+        self.prices = {}
+
+    def add(self, keys, product_ids, prices):
+        self.keys.update(keys)
+        self.product_ids.update(product_ids)
+        _add_prices(self.prices, ((product_id, store_id, day, price) for (product_id, store_id), (day, price) in prices.items()))
+
+    def __call__(self):
+        _refresh(self.keys, self.product_ids, self.prices)
+
+
+def _refresh(keys, product_ids, prices):
+    # One savepoint: a failing step leaves none of the derived tables half refreshed
+    with transaction.atomic():
+        refresh_daily_stats(keys)
+        # Recomputed products already include the written prices
+        refresh_current_prices(product_ids)
+        mark_forecasts_changed(product_ids)
+        upsert_current_prices({key: price for key, price in prices.items() if key[0] not in product_ids})
+        # Alerts compare the refreshed current prices, once per batch
+        match_price_alerts(product_ids | {product_id for product_id, _ in prices})
+
+
+@contextmanager
+def batched_refresh():
+    """
+    Collects the mark_dirty() calls of the block and refreshes them together when it
+    ends. Use it inside the transaction of the writes, so that they commit together
+    with the refresh; nothing is refreshed if the block raises. Nested blocks join
+    the outermost one.
+    """
+    if getattr(_batch, 'pending', None) is not None:
+        yield
+        return
+    pending = _batch.pending = _PendingRefresh()
+    try:
+        yield
+    finally:
+        _batch.pending = None
+    pending()
+
+
+def mark_dirty(keys, product_ids=(), prices=()):
+    """
+    Refreshes the given (day, store_id) cells and the current prices in the current
+    transaction, or at the end of the enclosing batched_refresh() block.
+    Current prices are recomputed from the history for product_ids (deletes, moved
+    rows), and upserted from prices, the (product_id, store_id, day, price) rows
+    inserted or updated.
+    """
+    keys = set(keys)
+    product_ids = set(product_ids)
+    latest = {}
+    _add_prices(latest, prices)
+    if not keys and not product_ids and not latest:
+        return
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        pending.add(keys, product_ids, latest)
+        return
+    _refresh(keys, product_ids, latest)
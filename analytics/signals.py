@@ -0,0 +1,74 @@
+"""
+Keeps derived price tables in sync with single-object writes (admin, CRUD, forms).
+Bulk writes go through importer.upsert_price_records, which does the same explicitly.
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from .cache import bump_data_version
+from .models import PriceRecord, Product, Store, Category
+from .rollups import mark_dirty
+
+
+def _record_key(record):
+    # date_recorded may still hold the datetime default until it is reloaded
+    day = PriceRecord._meta.get_field('date_recorded').to_python(record.date_recorded)
+    return (day, record.store_id)
+
+
+@receiver(pre_save, sender=PriceRecord)
+def remember_previous_price_cell(sender, instance, raw=False, **kwargs):
+    instance._previous_key = None
+    instance._previous_product_id = None
+    if instance.pk and not raw:
+        previous = sender.objects.filter(pk=instance.pk).values_list('date_recorded', 'store_id', 'product_id').first()
+        if previous:
+            instance._previous_key = previous[:2]
+            instance._previous_product_id = previous[2]
+
+
+@receiver(post_save, sender=PriceRecord)
+def price_record_saved(sender, instance, **kwargs):
+    key = _record_key(instance)
+    previous_key = getattr(instance, '_previous_key', None)
+    if previous_key is None or (previous_key == key and instance._previous_product_id == instance.product_id):
+        # New or repriced in place: the current price is upserted from the row
+        mark_dirty({key}, prices=[(instance.product_id, instance.store_id, key[0], instance.price)])
+    else:
+        # Moved to another day, store or product: the previous current price may be gone
+        mark_dirty({key, previous_key}, {instance.product_id, instance._previous_product_id})
+
+
+@receiver(post_delete, sender=PriceRecord)
+def price_record_deleted(sender, instance, **kwargs):
+    mark_dirty({_record_key(instance)}, {instance.product_id})
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_category(sender, instance, raw=False, **kwargs):
+    instance._previous_category_id = None
+    if instance.pk and not raw:
+        instance._previous_category_id = sender.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created=False, **kwargs):
+    previous = getattr(instance, '_previous_category_id', None)
+    if created or previous is None or previous == instance.category_id:
+        return
+    # Moving a product to another category moves its prices between rollup cells,
+    # and its forecast is recomputed like after moved prices
+    mark_dirty(
+        PriceRecord.objects.filter(product=instance).values_list('date_recorded', 'store_id').distinct(),
+        {instance.pk},
+    )
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def reference_data_changed(sender, **kwargs):
+    # Cached payloads carry store and category names
+    transaction.on_commit(bump_data_version)
@@ -1,3 +1,1175 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import pickle
+import tempfile
+from itertools import combinations
+from unittest import mock
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from sklearn.linear_model import LinearRegression
+
+from analytics import urls as analytics_urls, views
+from analytics.budgets import get_query_budget
+from analytics.cache import DATA_VERSION_KEY, get_data_version
+from analytics import cube as price_cube
+from analytics.cube import build_arrays, current_price_cube, price_cube_enabled, get_price_cube
+from analytics.exporter import iter_parquet
+from analytics.forecasting import FORECAST_WINDOW_DAYS, fit_trends, forecast_prices, refresh_forecasts, stale_product_ids
+from analytics.optimizer import MISSING, PriceMatrix, best_split, rank_stores
+from analytics.importer import (
+    LeaseLost, claim_import_job, count_rows, import_prices, run_import_job, upsert_price_records,
+)
+from analytics.management.commands.bench_views import Command as BenchViewsCommand, VIEWS
+from analytics.intervals import delete_all_rows, iter_export_rows, write_price_intervals
+from analytics.utils import (
+    CATALOG_PAGE_SIZE, get_catalog_page, get_dashboard_data, get_price_history_page, get_price_history_series, get_price_trend, get_store_baskets,
+    get_total_records, parse_history_cursor,
+)
+from analytics.rollups import _cell_blocks, rebuild_current_prices, rebuild_daily_stats, upsert_current_prices
+from analytics.models import (
+    Category, CurrentPrice, DailyPriceStat, ForecastRun, ImportJob, PriceAlert, PriceInterval, PriceRecord, PriceWatch,
+    Product, ProductForecast, ShoppingList, Store,
+)
+
+
+class BenchViewsTests(TestCase):
+    def test_measures_every_view_on_the_current_database(self):
+        call_command('seed_db', products=4, stores=2, days=10, stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('bench_views', role='measure', requests=2, import_rows=5, stdout=out)
+
+        result = json.loads(out.getvalue().strip().splitlines()[-1])
+        self.assertEqual(set(result['views']), set(VIEWS))
+        for name, view in result['views'].items():
+            self.assertLessEqual(view['p50_ms'], view['p95_ms'], name)
+            self.assertLessEqual(view['p95_ms'], view['max_ms'], name)
+            self.assertGreater(view['peak_memory_kb'], 0, name)
+        self.assertGreater(result['views']['product_detail']['queries'], 0)
+        self.assertGreater(result['views']['import_data']['queries'], 0)
+
+    def test_compare_flags_slower_views(self):
+        def report(p50):
+            return {'commit': 'abc1234', 'tiers': {'small': {'views': {'home': {'p50_ms': p50}}}}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            with open(path, 'w') as fh:
+                json.dump(report(10.0), fh)
+            out = io.StringIO()
+            command = BenchViewsCommand(stdout=out)
+            command.compare(report(15.0), path)
+
+        self.assertIn('abc1234', out.getvalue())
+        self.assertIn('+50%', out.getvalue())
+
+
+class QueryBudgetTests(TestCase):
+    """Every view stays within its @query_budget, whatever the amount of data."""
+
+    # Two datasets with more stores, products and days in the second one
+    SIZES = [
+        {'products': 3, 'stores': 2, 'days': 5},
+        {'products': 12, 'stores': 5, 'days': 40},
+    ]
+    CONFIGS = [
+        {'PRICE_STORAGE': 'daily', 'PRICE_CUBE': False},
+        {'PRICE_STORAGE': 'daily', 'PRICE_CUBE': True},
+        {'PRICE_STORAGE': 'intervals', 'PRICE_CUBE': False},
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user('budget', password='budget')
+
+    def get_urls(self):
+        """URLs to request per view, for the current dataset."""
+        product = Product.objects.order_by('pk').first()
+        category = Category.objects.filter(product__isnull=False).order_by('pk').first()
+        store = Store.objects.order_by('pk').first()
+        shopping_list = ShoppingList.objects.create(user=self.user)
+        shopping_list.products.set(Product.objects.all())
+        job = ImportJob.objects.create(file='imports/budget.csv')
+        month_ago = (date.today() - timedelta(days=30)).isoformat()
+        return {
+            views.home: [reverse('home'), reverse('home') + '?days=365'],
+            views.products_list: [reverse(views.products_list)],
+            views.product_detail: [reverse(views.product_detail, args=[product.pk])],
+            views.product_create: [reverse(views.product_create)],
+            views.product_update: [reverse(views.product_update, args=[product.pk])],
+            views.stores_list: [reverse(views.stores_list)],
+            views.dashboard: [
+                reverse(views.dashboard),
+                reverse(views.dashboard) + f'?store={store.pk}&category={category.pk}&days=90',
+            ],
+            views.category_list: [reverse(views.category_list)],
+            views.category_detail: [reverse(views.category_detail, args=[category.slug])],
+            views.import_data: [reverse(views.import_data)],
+            views.import_job_status: [reverse(views.import_job_status, args=[job.pk])],
+            views.export_data: [
+                reverse(views.export_data),
+                reverse(views.export_data) + f'?date_from={month_ago}&store={store.pk}&format=parquet',
+            ],
+            views.shopping_list_optimize: [reverse(views.shopping_list_optimize, args=[shopping_list.pk]) + '?k=3'],
+        }
+
+    def count_queries(self, client, url):
+        # Cached payloads would hide the queries: every request computes from scratch,
+        # under the same data version so the price cube is not rebuilt
+        version = get_data_version()
+        cache.clear()
+        cache.set(DATA_VERSION_KEY, version, timeout=None)
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get(url)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        self.assertEqual(response.status_code, 200, url)
+        return len(captured)
+
+    def test_every_view_declares_a_budget(self):
+        urlpatterns = [pattern.callback for pattern in get_resolver().url_patterns if pattern.callback is views.home]
+        urlpatterns += [pattern.callback for pattern in analytics_urls.urlpatterns]
+        for view in urlpatterns:
+            self.assertIsNotNone(get_query_budget(view), f'{view.__name__} has no @query_budget')
+
+    def test_main_views_do_not_scan_price_tables(self):
+        for config in self.CONFIGS:
+            with self.subTest(**config), override_settings(**config):
+                out = io.StringIO()
+                call_command('explain_queries', fail_on_scan=True, stdout=out)
+                self.assertIn('No full scans of price tables.', out.getvalue())
+                self.assertIn('(intended)', out.getvalue())
+
+    def test_views_stay_within_budget_as_data_grows(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        for config in self.CONFIGS:
+            with self.subTest(**config), override_settings(ALLOWED_HOSTS=['*'], CACHES=locmem, **config):
+                counts = []
+                for size in self.SIZES:
+                    call_command('seed_db', clean=True, stdout=io.StringIO(), **size)
+                    if price_cube_enabled():
+                        get_price_cube()
+                    client = Client()
+                    client.force_login(self.user)
+                    counts.append({
+                        (view, url_index): self.count_queries(client, url)
+                        for view, urls in self.get_urls().items()
+                        for url_index, url in enumerate(urls)
+                    })
+
+                small, large = counts
+                for view, url_index in small:
+                    name = f'{view.__name__} #{url_index}'
+                    self.assertLessEqual(large[view, url_index], small[view, url_index], f'{name}: queries grow with the data')
+                    self.assertLessEqual(large[view, url_index], get_query_budget(view), f'{name}: over its query budget')
+
+
+def empty_price_data():
+    """Removes the demo data seeded after migrate, for tests that count rows."""
+    for model in (PriceRecord, PriceInterval, DailyPriceStat, CurrentPrice):
+        delete_all_rows(model)
+    Product.objects.all().delete()
+    Store.objects.all().delete()
+    Category.objects.all().delete()
+
+
+def derived_tables():
+    """Sorted rows of DailyPriceStat and CurrentPrice, for comparisons."""
+    return (
+        sorted(DailyPriceStat.objects.values_list(
+            'day', 'store_id', 'category_id', 'record_count', 'price_sum', 'price_min', 'price_max',
+        )),
+        sorted(CurrentPrice.objects.values_list('product_id', 'store_id', 'price', 'date_recorded')),
+    )
+
+
+def price_feed(*rows):
+    """Feed DataFrame of (product, category, store, price, date) rows."""
+    return pd.DataFrame(list(rows), columns=['Product', 'Category', 'Store', 'Price', 'Date'])
+
+
+class BulkImporterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        empty_price_data()
+
+    def test_rejects_invalid_rows_with_their_line_numbers(self):
+        stats = import_prices(price_feed(
+            ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10'],
+            ['', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10'],
+            ['Хлеб', 'Хлеб и выпечка', 'Магнит', 'бесплатно', '2026-01-10'],
+            ['Хлеб', 'Хлеб и выпечка', 'Магнит', '-1', '2026-01-10'],
+            ['Хлеб', 'Хлеб и выпечка', 'Магнит', '45', '10.01.2026'],
+        ))
+
+        self.assertEqual(stats.rows_total, 5)
+        self.assertEqual(stats.rows_rejected, 4)
+        self.assertEqual(stats.records_written, 1)
+        self.assertEqual(sorted(stats.rejected_sample), [
+            (3, 'empty product, category or store'),
+            (4, 'invalid price'),
+            (5, 'invalid price'),
+            (6, 'invalid date'),
+        ])
+        self.assertEqual(PriceRecord.objects.count(), 1)
+
+    def test_later_duplicate_rows_win(self):
+        stats = import_prices(price_feed(
+            ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10'],
+            ['Молоко', 'Молочные продукты', 'Магнит', '92.50', '2026-01-10'],
+            ['Молоко', 'Молочные продукты', 'Магнит', '91.00', '2026-01-11'],
+        ))
+
+        self.assertEqual(stats.rows_skipped, 1)
+        self.assertEqual(stats.records_written, 2)
+        prices = dict(PriceRecord.objects.values_list('date_recorded', 'price'))
+        self.assertEqual(str(prices[date(2026, 1, 10)]), '92.50')
+
+    def test_reimporting_a_feed_upserts_in_place(self):
+        feed = price_feed(
+            ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10'],
+            ['Молоко', 'Молочные продукты', 'Пятерочка', '87.50', '2026-01-10'],
+        )
+        import_prices(feed)
+        before = sorted(PriceRecord.objects.values_list('id', 'product_id', 'store_id', 'date_recorded', 'price'))
+        import_prices(feed)
+        self.assertEqual(sorted(PriceRecord.objects.values_list('id', 'product_id', 'store_id', 'date_recorded', 'price')), before)
+        self.assertEqual(Product.objects.count(), 1)
+
+        feed.loc[0, 'Price'] = '95.00'
+        import_prices(feed)
+        self.assertEqual(PriceRecord.objects.count(), 2)
+        self.assertEqual(str(PriceRecord.objects.get(store__name='Магнит').price), '95.00')
+
+    def test_upsert_can_keep_existing_prices(self):
+        import_prices(price_feed(['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10']))
+        record = PriceRecord.objects.get()
+        upsert_price_records([
+            PriceRecord(product_id=record.product_id, store_id=record.store_id, date_recorded=record.date_recorded, price=1),
+            PriceRecord(product_id=record.product_id, store_id=record.store_id, date_recorded=date(2026, 1, 11), price=2),
+        ], update_existing=False)
+
+        prices = dict(PriceRecord.objects.values_list('date_recorded', 'price'))
+        self.assertEqual(str(prices[date(2026, 1, 10)]), '89.90')
+        self.assertEqual(prices[date(2026, 1, 11)], 2)
+
+    def test_category_name_variants_share_one_category(self):
+        import_prices(price_feed(
+            ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10'],
+            ['Кефир', ' молочные  ПРОДУКТЫ ', 'Магнит', '79.90', '2026-01-10'],
+        ))
+        import_prices(price_feed(['Сыр', 'МОЛОЧНЫЕ ПРОДУКТЫ', 'Магнит', '499', '2026-01-10']))
+
+        category = Category.objects.get()
+        self.assertEqual(category.name, 'Молочные продукты')
+        self.assertEqual(Product.objects.filter(category=category).count(), 3)
+
+
+class ImportJobTests(TestCase):
+    CSV = (
+        'Product,Category,Store,Price,Date\n'
+        'Молоко,Молочные продукты,Магнит,89.90,2026-01-10\n'
+        '"Хлеб\nнарезной",Хлеб и выпечка,Магнит,45.00,2026-01-10\n'
+        'Кефир,Молочные продукты,Магнит,79.90,2026-01-10\n'
+        'Сыр,Молочные продукты,Магнит,499.00,2026-01-10\n'
+        'Масло,Молочные продукты,Магнит,199.00,2026-01-10\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        empty_price_data()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def create_job(self, **fields):
+        job = ImportJob(**fields)
+        job.file.save('feed.csv', ContentFile(self.CSV.encode()), save=False)
+        job.save()
+        return job
+
+    def test_count_rows_counts_parsed_rows(self):
+        # The quoted product name spans two lines but is one row
+        self.assertEqual(count_rows(io.BytesIO(self.CSV.encode())), 5)
+        self.assertEqual(count_rows(io.BytesIO(b'')), 0)
+
+    def test_job_imports_in_chunks(self):
+        self.create_job()
+        job = claim_import_job()
+        stats = run_import_job(job, chunk_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual((job.total_rows, job.rows_processed, job.records_written), (5, 5, 5))
+        self.assertEqual(stats.records_written, 5)
+        self.assertTrue(Product.objects.filter(name='Хлеб\nнарезной').exists())
+
+    def test_abandoned_job_resumes_after_committed_rows(self):
+        expired = timezone.now() - timedelta(seconds=1)
+        job = self.create_job(
+            status=ImportJob.Status.RUNNING, lease_expires_at=expired,
+            total_rows=5, rows_processed=2, records_written=2,
+        )
+
+        claimed = claim_import_job()
+        self.assertEqual(claimed.pk, job.pk)
+        run_import_job(claimed, chunk_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual((job.rows_processed, job.records_written), (5, 5))
+        # Rows committed before the interruption are not imported again
+        self.assertEqual(PriceRecord.objects.count(), 3)
+        self.assertFalse(Product.objects.filter(name='Молоко').exists())
+
+    def test_failed_refresh_does_not_commit_the_chunk(self):
+        self.create_job()
+        job = claim_import_job()
+        with mock.patch('analytics.rollups.refresh_daily_stats', side_effect=RuntimeError('rollup failed')), \
+                self.assertRaises(RuntimeError):
+            run_import_job(job, chunk_size=2)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_processed), (ImportJob.Status.FAILED, 0))
+        self.assertFalse(PriceRecord.objects.exists())
+
+    def test_running_job_is_not_claimed_until_its_lease_expires(self):
+        self.create_job()
+        job = claim_import_job()
+        self.assertIsNone(claim_import_job())
+
+        ImportJob.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim_import_job()
+        self.assertEqual(reclaimed.pk, job.pk)
+
+        # The first worker finds out at its next chunk and leaves the job alone
+        with self.assertRaises(LeaseLost):
+            run_import_job(job, chunk_size=2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.RUNNING)
+        self.assertEqual(job.rows_processed, 0)
+
+
+class ExportTests(TestCase):
+    FEED = [
+        ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10'],
+        ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-11'],
+        ['Молоко', 'Молочные продукты', 'Пятерочка', '87.50', '2026-01-11'],
+        ['Хлеб', 'Хлеб и выпечка', 'Магнит', '45.00', '2026-01-12'],
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        empty_price_data()
+
+    def export(self, query=''):
+        response = self.client.get(reverse(views.export_data) + query)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def export_rows(self, query=''):
+        _, content = self.export(query)
+        return list(csv.reader(io.StringIO(content.decode())))[1:]
+
+    def test_filters(self):
+        for storage in ('daily', 'intervals'):
+            with self.subTest(storage=storage), override_settings(PRICE_STORAGE=storage):
+                import_prices(price_feed(*self.FEED))
+                magnit = Store.objects.get(name='Магнит').pk
+                bread = Category.objects.get(name='Хлеб и выпечка').pk
+
+                self.assertEqual(sorted(self.export_rows()), sorted(self.FEED))
+                self.assertEqual(sorted(self.export_rows('?date_from=2026-01-11&date_to=2026-01-11')), sorted(self.FEED[1:3]))
+                self.assertEqual(sorted(self.export_rows(f'?store={magnit}&category={bread}')), [self.FEED[3]])
+                self.assertEqual(self.export_rows('?date_from=2026-02-01'), [])
+                empty_price_data()
+
+    @override_settings(PRICE_STORAGE='intervals')
+    def test_interval_rows_are_named_per_chunk(self):
+        import_prices(price_feed(*self.FEED))
+        for chunk_size in (1, 2, 100):
+            with self.subTest(chunk_size=chunk_size):
+                rows = iter_export_rows(PriceInterval.objects.order_by('pk'), chunk_size=chunk_size)
+                self.assertEqual(
+                    sorted([product, category, store, str(price), day.isoformat()] for product, category, store, price, day in rows),
+                    sorted(self.FEED),
+                )
+
+    def test_invalid_filters_are_rejected(self):
+        for query in ('?date_from=11.01.2026', '?store=abc', '?since=yesterday', '?format=parquet&compress=gzip'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(reverse(views.export_data) + query).status_code, 400)
+
+    def test_gzip_holds_the_csv_export(self):
+        import_prices(price_feed(*self.FEED))
+        _, plain = self.export()
+        response, compressed = self.export('?compress=gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+    def test_parquet_holds_the_csv_rows(self):
+        for storage in ('daily', 'intervals'):
+            with self.subTest(storage=storage), override_settings(PRICE_STORAGE=storage):
+                import_prices(price_feed(*self.FEED))
+                response, content = self.export('?format=parquet&date_from=2026-01-11')
+                self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+
+                table = pq.read_table(io.BytesIO(content))
+                self.assertEqual(table.schema.field('Price').type, pa.decimal128(10, 2))
+                rows = [
+                    [product, category, store, str(price), day.isoformat()]
+                    for product, category, store, price, day in table.to_pandas().itertuples(index=False, name=None)
+                ]
+                self.assertEqual(sorted(rows), sorted(self.FEED[1:]))
+                self.assertEqual(sorted(rows), sorted(self.export_rows('?date_from=2026-01-11')))
+                empty_price_data()
+
+    def test_parquet_prices_are_exact_in_every_row_group(self):
+        # One row per group: whole prices come back from SQLite as integers
+        import_prices(price_feed(*self.FEED, ['Кефир', 'Молочные продукты', 'Магнит', '114.35', '2026-01-12']))
+        content = b''.join(iter_parquet(PriceRecord.objects.order_by('pk'), row_group_size=1))
+        prices = pq.read_table(io.BytesIO(content)).column('Price').to_pylist()
+        self.assertEqual(prices, list(PriceRecord.objects.order_by('pk').values_list('price', flat=True)))
+
+    def test_parquet_feed_imports(self):
+        import_prices(price_feed(*self.FEED))
+        _, content = self.export('?format=parquet')
+        empty_price_data()
+
+        stats = import_prices(pq.read_table(io.BytesIO(content)).to_pandas())
+        self.assertEqual(stats.records_written, len(self.FEED))
+        self.assertEqual(sorted(self.export_rows()), sorted(self.FEED))
+
+    def test_next_pull_overlaps_the_watermark_lag(self):
+        import_prices(price_feed(*self.FEED))
+        response, _ = self.export()
+        watermark = parse_datetime(response['X-Export-Watermark'])
+        lag = timedelta(seconds=settings.EXPORT_WATERMARK_LAG_SECONDS)
+        self.assertLessEqual(watermark, timezone.now() - lag)
+
+        # A write that started before the pull but committed after it
+        PriceRecord.objects.filter(date_recorded=date(2026, 1, 12)).update(updated_at=watermark + lag / 2)
+        PriceRecord.objects.exclude(date_recorded=date(2026, 1, 12)).update(updated_at=watermark - lag)
+        rows = self.export_rows('?since=' + response['X-Export-Watermark'])
+        self.assertEqual(rows, [self.FEED[3]])
+
+
+class DerivedTablesTests(TestCase):
+    """DailyPriceStat and CurrentPrice maintained by writes match a rebuild from the history."""
+
+    FEED = [
+        ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-10'],
+        ['Молоко', 'Молочные продукты', 'Магнит', '89.90', '2026-01-11'],
+        ['Молоко', 'Молочные продукты', 'Пятерочка', '87.50', '2026-01-10'],
+        ['Кефир', 'Молочные продукты', 'Магнит', '79.90', '2026-01-11'],
+        ['Хлеб', 'Хлеб и выпечка', 'Пятерочка', '45.00', '2026-01-12'],
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        empty_price_data()
+
+    def assertMatchesRebuild(self):
+        maintained = derived_tables()
+        rebuild_daily_stats()
+        rebuild_current_prices()
+        self.assertEqual(maintained, derived_tables())
+        return maintained
+
+    def write(self, operation, *args, **kwargs):
+        # Derived tables are refreshed when the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            operation(*args, **kwargs)
+
+    def test_imports(self):
+        for storage in ('daily', 'intervals'):
+            with self.subTest(storage=storage), override_settings(PRICE_STORAGE=storage):
+                self.write(import_prices, price_feed(*self.FEED))
+                stats, current = self.assertMatchesRebuild()
+                self.assertEqual(len(current), 4)
+
+                self.write(import_prices, price_feed(
+                    # Newer price, back-dated correction, repriced current day
+                    ['Молоко', 'Молочные продукты', 'Магнит', '92.00', '2026-01-12'],
+                    ['Молоко', 'Молочные продукты', 'Пятерочка', '70.00', '2026-01-05'],
+                    ['Кефир', 'Молочные продукты', 'Магнит', '81.00', '2026-01-11'],
+                ))
+                stats, current = self.assertMatchesRebuild()
+                prices = {(product_id, store_id): (str(price), day) for product_id, store_id, price, day in current}
+                milk = Product.objects.get(name='Молоко').pk
+                kefir = Product.objects.get(name='Кефир').pk
+                magnit, pyaterochka = (Store.objects.get(name=name).pk for name in ('Магнит', 'Пятерочка'))
+                self.assertEqual(prices[milk, magnit], ('92.00', date(2026, 1, 12)))
+                self.assertEqual(prices[milk, pyaterochka], ('87.50', date(2026, 1, 10)))
+                self.assertEqual(prices[kefir, magnit], ('81.00', date(2026, 1, 11)))
+                empty_price_data()
+
+    def test_single_record_writes(self):
+        self.write(import_prices, price_feed(*self.FEED))
+        milk = PriceRecord.objects.get(product__name='Молоко', store__name='Магнит', date_recorded=date(2026, 1, 11))
+
+        milk.price = 95
+        self.write(milk.save)
+        self.assertMatchesRebuild()
+
+        # Moved to another day and store
+        milk.date_recorded = date(2026, 1, 9)
+        milk.store = Store.objects.get(name='Пятерочка')
+        self.write(milk.save)
+        _, current = self.assertMatchesRebuild()
+        self.assertIn((milk.product_id, milk.store_id, 87.5, date(2026, 1, 10)), current)
+
+        self.write(PriceRecord.objects.get(product__name='Хлеб').delete)
+        _, current = self.assertMatchesRebuild()
+        self.assertNotIn(Product.objects.get(name='Хлеб').pk, {product_id for product_id, *_ in current})
+
+        self.write(PriceRecord.objects.create, product=milk.product, store=milk.store, price=88, date_recorded=date(2026, 1, 20))
+        _, current = self.assertMatchesRebuild()
+        self.assertIn((milk.product_id, milk.store_id, 88, date(2026, 1, 20)), current)
+
+    def test_failed_refresh_rolls_the_write_back(self):
+        self.write(import_prices, price_feed(*self.FEED))
+        before = PriceRecord.objects.count(), derived_tables()
+        record = PriceRecord.objects.get(product__name='Хлеб')
+
+        with mock.patch('analytics.rollups.match_price_alerts', side_effect=RuntimeError('alerts failed')):
+            with self.assertRaises(RuntimeError):
+                import_prices(price_feed(['Молоко', 'Молочные продукты', 'Магнит', '92.00', '2026-01-12']))
+            record.price = 1
+            with self.assertRaises(RuntimeError):
+                record.save()
+            # Deletes share the caller's transaction, here one of its own like in autocommit
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                PriceRecord.objects.get(pk=record.pk).delete()
+
+        self.assertEqual((PriceRecord.objects.count(), derived_tables()), before)
+        self.assertEqual(PriceRecord.objects.get(pk=record.pk).price, Decimal('45.00'))
+
+    def test_upsert_keeps_more_recent_current_prices(self):
+        self.write(import_prices, price_feed(*self.FEED))
+        milk, kefir, bread = (Product.objects.get(name=name).pk for name in ('Молоко', 'Кефир', 'Хлеб'))
+        magnit, pyaterochka = (Store.objects.get(name=name).pk for name in ('Магнит', 'Пятерочка'))
+
+        upsert_current_prices({
+            (milk, magnit): (date(2026, 1, 10), 1),
+            (kefir, magnit): (date(2026, 1, 11), 2),
+            (bread, magnit): (date(2026, 1, 1), 3),
+        })
+        current = {
+            (product_id, store_id): (price, day)
+            for product_id, store_id, price, day in CurrentPrice.objects.values_list('product_id', 'store_id', 'price', 'date_recorded')
+        }
+        self.assertEqual(current[milk, magnit], (Decimal('89.90'), date(2026, 1, 11)))
+        self.assertEqual(current[kefir, magnit], (Decimal('2.00'), date(2026, 1, 11)))
+        self.assertEqual(current[bread, magnit], (Decimal('3.00'), date(2026, 1, 1)))
+        self.assertEqual(current[bread, pyaterochka], (Decimal('45.00'), date(2026, 1, 12)))
+
+    def test_updates_do_not_rescan_the_history(self):
+        self.write(import_prices, price_feed(*self.FEED))
+        with CaptureQueriesContext(connection) as captured:
+            self.write(import_prices, price_feed(['Молоко', 'Молочные продукты', 'Магнит', '92.00', '2026-01-12']))
+        self.assertFalse([query for query in captured if 'DELETE FROM "analytics_currentprice"' in query['sql']])
+        self.assertMatchesRebuild()
+
+    def test_cell_blocks_cover_exactly_the_touched_cells(self):
+        # More days and stores than fit one statement, in different store sets
+        keys = {(date(2026, 1, 1) + timedelta(days=day), store) for day in range(700) for store in range(day % 7 + 1)}
+        keys |= {(date(2026, 1, 1), store) for store in range(100, 1200)}
+        cells = []
+        for blocks in _cell_blocks(keys):
+            self.assertLessEqual(sum(len(days) + len(stores) for days, stores in blocks), connection.features.max_query_params)
+            cells.extend((day, store) for days, stores in blocks for day in days for store in stores)
+        self.assertEqual(len(cells), len(keys))
+        self.assertEqual(set(cells), keys)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DashboardTests(TestCase):
+    def test_invalid_filters_fall_back_to_defaults(self):
+        cases = [
+            ('?days=abc', 30),
+            ('?days=', 30),
+            ('?days=-5', 1),
+            ('?days=0', 1),
+            (f'?days={10 ** 9}', settings.HOME_TREND_MAX_DAYS),
+            ('?days=90&store=1;1&category=%202', 90),
+            ('?days=7&store=-1&category=x', 7),
+        ]
+        for query, days in cases:
+            with self.subTest(query=query):
+                response = self.client.get(reverse(views.dashboard) + query)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['selected_days'], days)
+                self.assertIsNone(response.context['selected_store'])
+                self.assertIsNone(response.context['selected_category'])
+
+    def test_window_follows_the_days_filter(self):
+        store = Store.objects.order_by('pk').first()
+        response = self.client.get(reverse(views.dashboard) + f'?days=7&store={store.pk}')
+        self.assertEqual(response.context['selected_store'], store.pk)
+        # From days ago through today
+        self.assertEqual(len(json.loads(response.context['chart_labels'])), 8)
+
+
+class PriceHistoryTests(TestCase):
+    """The product page reads a bounded chart series and keyset pages of the history."""
+
+    @classmethod
+    def setUpTestData(cls):
+        empty_price_data()
+        category = Category.objects.create(name='Молочные продукты', slug='dairy')
+        cls.product = Product.objects.create(name='Молоко', category=category)
+        cls.stores = [
+            Store.objects.create(name='Магнит', url='https://magnit.ru'),
+            Store.objects.create(name='Пятерочка', url='https://5ka.ru'),
+        ]
+
+    def write_history(self, days, storage):
+        """Two stores with prices on every day of the last `days` days, in the given storage."""
+        start = date.today() - timedelta(days=days - 1)
+        records = [
+            PriceRecord(
+                product=self.product, store=store, date_recorded=start + timedelta(days=offset),
+                price=Decimal(100 + offset % 7) if i == 0 else Decimal(90 + offset % 11 * 2),
+            )
+            for offset in range(days) for i, store in enumerate(self.stores)
+        ]
+        if storage == 'intervals':
+            write_price_intervals(records)
+        else:
+            PriceRecord.objects.bulk_create(records)
+        return records
+
+    def clear_history(self):
+        delete_all_rows(PriceRecord)
+        delete_all_rows(PriceInterval)
+
+    def test_series_is_downsampled_to_the_min_max_band(self):
+        for storage in ('daily', 'intervals'):
+            with self.subTest(storage=storage), override_settings(PRICE_STORAGE=storage):
+                records = self.write_history(500, storage)
+                series = get_price_history_series(self.product.pk)
+
+                # 500 days in buckets of 3 days
+                first = records[0].date_recorded
+                buckets = {}
+                for record in records:
+                    buckets.setdefault((record.date_recorded - first).days // 3, []).append(float(record.price))
+                self.assertEqual(len(series['dates']), len(buckets))
+                self.assertLessEqual(len(series['dates']), 200)
+                self.assertEqual(series['dates'][:2], [first.isoformat(), (first + timedelta(days=3)).isoformat()])
+                self.assertEqual(series['min'], [min(prices) for _, prices in sorted(buckets.items())])
+                self.assertEqual(series['max'], [max(prices) for _, prices in sorted(buckets.items())])
+                self.assertEqual(series['avg'], [round(sum(prices) / len(prices), 2) for _, prices in sorted(buckets.items())])
+                self.clear_history()
+
+    def test_series_of_a_product_without_prices_is_empty(self):
+        self.assertEqual(get_price_history_series(self.product.pk), {'dates': [], 'min': [], 'avg': [], 'max': []})
+
+    def test_malformed_cursors_are_ignored(self):
+        self.assertEqual(parse_history_cursor('2026-01-10.42'), (date(2026, 1, 10), 42))
+        for value in (None, '', 'garbage', '2026-01-10', '2026-13-01.5', '2026-01-10.x', '2026-01-10.5.6'):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_history_cursor(value))
+
+    def test_pages_return_every_row_once(self):
+        for storage in ('daily', 'intervals'):
+            with self.subTest(storage=storage), override_settings(PRICE_STORAGE=storage):
+                records = self.write_history(60, storage)
+                rows, cursor, pages = [], None, 0
+                while True:
+                    page, next_cursor = get_price_history_page(self.product.pk, cursor, page_size=25)
+                    rows += [(record.date_recorded, record.store_id, record.price) for record in page]
+                    pages += 1
+                    if next_cursor is None:
+                        break
+                    # Pages are followed as the product page does, through the query string
+                    cursor = parse_history_cursor(next_cursor)
+
+                self.assertEqual(pages, 5)
+                # Same-day rows of both stores are split across a page boundary
+                self.assertEqual(rows[24][0], rows[25][0])
+                self.assertEqual(rows, sorted(rows, key=lambda row: row[0], reverse=True))
+                self.assertEqual(
+                    sorted(rows),
+                    sorted((record.date_recorded, record.store_id, record.price) for record in records),
+                )
+                self.clear_history()
+
+    def test_garbage_cursor_shows_the_first_page(self):
+        self.write_history(60, 'daily')
+        url = reverse('analytics-product-detail', args=[self.product.pk])
+        first = self.client.get(url)
+        response = self.client.get(url + '?cursor=garbage')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_first_page'])
+        self.assertEqual(
+            [record.pk for record in response.context['price_history']],
+            [record.pk for record in first.context['price_history']],
+        )
+        self.assertEqual(response.context['next_cursor'], first.context['next_cursor'])
+
+
+class CatalogTests(TestCase):
+    """The catalog is read in keyset pages annotated from CurrentPrice."""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Products without prices on top of the seeded ones, for a third page
+        category = Category.objects.first()
+        Product.objects.bulk_create(Product(name=f'Товар {i}', category=category) for i in range(30))
+
+    def expected(self, product):
+        prices = list(CurrentPrice.objects.filter(product=product).order_by('price', 'store_id').select_related('store'))
+        return {
+            'min_price': prices[0].price if prices else None,
+            'max_price': max(current.price for current in prices) if prices else None,
+            'store_count': len(prices),
+            'cheapest_store': prices[0].store.name if prices else None,
+        }
+
+    def test_pages_list_every_product_once(self):
+        products, cursor = [], None
+        while True:
+            page, cursor = get_catalog_page(cursor)
+            self.assertLessEqual(len(page), CATALOG_PAGE_SIZE)
+            products += page
+            if cursor is None:
+                break
+        self.assertEqual([product.pk for product in products], sorted(Product.objects.values_list('pk', flat=True)))
+        self.assertTrue(any(product.store_count for product in products))
+        self.assertTrue(any(not product.store_count for product in products))
+        for product in products:
+            with self.subTest(product=product.name):
+                actual = {key: getattr(product, key) for key in ('min_price', 'max_price', 'store_count', 'cheapest_store')}
+                self.assertEqual(actual, self.expected(product))
+
+    def test_view_follows_next_cursor_links_in_bounded_queries(self):
+        url = reverse(views.products_list)
+        seen, query, queries = [], '', []
+        while True:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url + query)
+            self.assertEqual(response.status_code, 200)
+            queries.append(len(captured))
+            seen += [product.pk for product in response.context['products']]
+            self.assertEqual(response.context['is_first_page'], not query)
+            if response.context['next_cursor'] is None:
+                self.assertNotContains(response, '?after=')
+                break
+            query = f'?after={response.context["next_cursor"]}'
+            self.assertContains(response, query)
+
+        self.assertEqual(seen, sorted(Product.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(queries), 3)
+        # The same queries on every page, however many products and prices it shows
+        self.assertLessEqual(max(queries), get_query_budget(views.products_list))
+        self.assertEqual(len(set(queries)), 1)
+
+
+class ForecastTests(TestCase):
+    """The batch fit gives the per-product LinearRegression fit it replaced."""
+
+    def reference_forecast(self, product_id, days_ahead, end_date):
+        records = PriceRecord.objects.filter(
+            product_id=product_id, date_recorded__gte=end_date - timedelta(days=FORECAST_WINDOW_DAYS),
+        )
+        rows = list(records.values_list('date_recorded', 'price'))
+        if len(rows) < 5:
+            return {'model_status': 'insufficient_data'}
+        x = np.array([[day.toordinal()] for day, _ in rows], dtype=np.float64)
+        y = np.array([float(price) for _, price in rows])
+        model = LinearRegression().fit(x, y)
+        today, future = model.predict([[end_date.toordinal()], [(end_date + timedelta(days=days_ahead)).toordinal()]])
+        return {
+            'model_status': 'success',
+            # Constant prices are a perfect fit, LinearRegression scores them 0 or noise
+            'r2_score': round(model.score(x, y), 2) if y.std() else 1.0,
+            'predicted_price': round(float(future), 2),
+            'trend': round(float(future - today) / days_ahead, 2),
+        }
+
+    def test_matches_the_reference_fit_on_seeded_prices(self):
+        end_date = date.today()
+        forecasts = forecast_prices(days_ahead=14, end_date=end_date)
+        self.assertTrue(forecasts)
+        for product_id, forecast in forecasts.items():
+            expected = self.reference_forecast(product_id, 14, end_date)
+            with self.subTest(product_id=product_id):
+                self.assertEqual(forecast['model_status'], expected['model_status'])
+                if expected['model_status'] == 'success':
+                    # Both sides are rounded to cents
+                    for key in ('r2_score', 'predicted_price', 'trend'):
+                        self.assertAlmostEqual(forecast[key], expected[key], delta=0.0101, msg=key)
+
+    def test_fit_trends_matches_least_squares(self):
+        rng = np.random.default_rng(7)
+        # Several products with repeated days (several stores), large prices and one single-day product
+        products = np.repeat([3, 5, 9, 11], [200, 50, 120, 4])
+        days = np.concatenate([rng.integers(0, 91, 370), np.full(4, 30)])
+        prices = np.concatenate([
+            1e6 + 0.5 * days[:200] + rng.normal(0, 3, 200),
+            80 - 0.1 * days[200:250] + rng.normal(0, 1, 50),
+            np.full(120, 49.9),
+            [10.0, 12.0, 11.0, 13.0],
+        ])
+
+        product_ids, observations, slope, intercept, r2 = fit_trends(products, days, prices, 91)
+        self.assertEqual(product_ids.tolist(), [3, 5, 9, 11])
+        self.assertEqual(observations.tolist(), [200, 50, 120, 4])
+        for i, product_id in enumerate(product_ids[:2]):
+            mask = products == product_id
+            model = LinearRegression().fit(days[mask, None], prices[mask])
+            self.assertAlmostEqual(slope[i], model.coef_[0], places=6)
+            self.assertAlmostEqual(intercept[i], model.intercept_, delta=1e-6 * abs(model.intercept_))
+            self.assertAlmostEqual(r2[i], model.score(days[mask, None], prices[mask]), places=6)
+        # Constant prices and prices of a single day: flat trend at the mean
+        self.assertEqual((slope[2], intercept[2], r2[2]), (0.0, 49.9, 1.0))
+        self.assertEqual((slope[3], intercept[3]), (0.0, 11.5))
+
+
+class _InProcessPool:
+    """Stands in for the forecast process pool: shards and results still go through pickle."""
+
+    shards = []
+
+    def __init__(self, max_workers, mp_context):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, fn, iterable):
+        for args in iterable:
+            type(self).shards.append(args)
+            yield pickle.loads(pickle.dumps(fn(pickle.loads(pickle.dumps(args)))))
+
+
+class RefreshForecastsTests(TestCase):
+    """Incremental runs recompute every product whose prices changed since the last run."""
+
+    def setUp(self):
+        # The seeded prices predate the first run and its cutoff
+        PriceRecord.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        refresh_forecasts(full=True, workers=1)
+
+    def product_with_prices(self, offset=0):
+        return Product.objects.filter(pricerecord__isnull=False).distinct().order_by('pk')[offset]
+
+    def test_full_run_is_recorded_and_leaves_nothing_stale(self):
+        run = ForecastRun.objects.first()
+        self.assertTrue(run.full)
+        self.assertEqual(run.products, Product.objects.count())
+        self.assertLess(run.cutoff, run.started_at)
+        self.assertEqual(stale_product_ids(), [])
+
+    def test_written_deleted_and_moved_prices_make_products_stale(self):
+        written, deleted, moved = (self.product_with_prices(offset) for offset in range(3))
+        with self.captureOnCommitCallbacks(execute=True):
+            record = PriceRecord.objects.filter(product=written).earliest('date_recorded')
+            record.price += 1
+            record.save()
+            PriceRecord.objects.filter(product=deleted).earliest('date_recorded').delete()
+            moved.category = Category.objects.exclude(pk=moved.category_id).first()
+            moved.save()
+        self.assertEqual(stale_product_ids(), sorted([written.pk, deleted.pk, moved.pk]))
+
+    def test_new_products_are_stale(self):
+        product = Product.objects.create(name='Кефир', category=Category.objects.first())
+        self.assertEqual(stale_product_ids(), [product.pk])
+
+    def test_incremental_run_recomputes_stale_products_only(self):
+        product = self.product_with_prices()
+        PriceRecord.objects.filter(product=product).update(price=1, updated_at=timezone.now())
+        before = dict(ProductForecast.objects.values_list('product_id', 'computed_at'))
+
+        self.assertEqual(refresh_forecasts(workers=1), 1)
+        run = ForecastRun.objects.first()
+        self.assertFalse(run.full)
+        self.assertEqual(run.products, 1)
+        after = dict(ProductForecast.objects.values_list('product_id', 'computed_at'))
+        self.assertEqual({pk for pk in after if after[pk] != before[pk]}, {product.pk})
+        self.assertEqual(ProductForecast.objects.get(product=product).predicted_price, Decimal('1.00'))
+        # Writes within the lag of the cutoff are picked up again by the next run
+        self.assertEqual(stale_product_ids(), [product.pk])
+        PriceRecord.objects.update(updated_at=run.cutoff - timedelta(seconds=1))
+        self.assertEqual(stale_product_ids(), [])
+        self.assertEqual(refresh_forecasts(workers=1), 0)
+        self.assertEqual(ForecastRun.objects.first().products, 0)
+
+    def test_process_pool_gives_the_in_process_forecasts(self):
+        fields = ('product_id', 'model_status', 'r2_score', 'predicted_price', 'trend')
+        expected = sorted(ProductForecast.objects.values_list(*fields))
+
+        _InProcessPool.shards = []
+        with mock.patch('analytics.forecasting.ProcessPoolExecutor', _InProcessPool), \
+                mock.patch('analytics.forecasting._fork_context', return_value=object()):
+            self.assertEqual(refresh_forecasts(full=True, workers=2), Product.objects.count())
+        self.assertGreater(len(_InProcessPool.shards), 1)
+        self.assertEqual(sorted(ProductForecast.objects.values_list(*fields)), expected)
+
+
+class IntervalStorageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        empty_price_data()
+        category = Category.objects.create(name='Молочные продукты', slug='dairy')
+        cls.product = Product.objects.create(name='Молоко', category=category)
+        cls.store = Store.objects.create(name='Магнит', url='https://magnit.ru')
+
+    def write(self, prices, **kwargs):
+        """Writes {day of January 2026: price} observations of the test product and store."""
+        write_price_intervals([
+            PriceRecord(product=self.product, store=self.store, date_recorded=date(2026, 1, day), price=price)
+            for day, price in prices.items()
+        ], **kwargs)
+
+    def intervals(self):
+        return [
+            (start.day, end.day, str(price))
+            for start, end, price in PriceInterval.objects.order_by('valid_from').values_list('valid_from', 'valid_to', 'price')
+        ]
+
+    def test_unchanged_prices_extend_the_last_interval(self):
+        self.write({1: 10, 2: 10})
+        self.write({3: 10, 4: 12})
+        self.write({5: 12, 8: 12})
+        self.assertEqual(self.intervals(), [(1, 3, '10.00'), (4, 5, '12.00'), (8, 8, '12.00')])
+
+    def test_corrections_split_and_merge_intervals(self):
+        self.write({day: 10 for day in range(1, 11)})
+
+        self.write({5: 11})
+        self.assertEqual(self.intervals(), [(1, 4, '10.00'), (5, 5, '11.00'), (6, 10, '10.00')])
+        # Filling a gap and reverting the correction join the runs again
+        self.write({12: 10})
+        self.write({11: 10, 5: 10})
+        self.assertEqual(self.intervals(), [(1, 12, '10.00')])
+
+    def test_corrections_can_keep_existing_prices(self):
+        self.write({day: 10 for day in range(1, 6)})
+        self.write({3: 99, 7: 99}, update_existing=False)
+        self.assertEqual(self.intervals(), [(1, 5, '10.00'), (7, 7, '99.00')])
+
+    def test_touched_cells_are_returned(self):
+        self.write({1: 10})
+        cells = write_price_intervals([
+            PriceRecord(product=self.product, store=self.store, date_recorded=date(2026, 1, day), price=10)
+            for day in (2, 3)
+        ])
+        self.assertEqual(cells, {(date(2026, 1, 2), self.store.pk), (date(2026, 1, 3), self.store.pk)})
+
+
+class ConvertPriceStorageTests(TestCase):
+    def test_round_trip_with_delete_source_keeps_prices_and_derived_tables(self):
+        records = sorted(PriceRecord.objects.values_list('product_id', 'store_id', 'date_recorded', 'price'))
+        derived = derived_tables()
+        self.assertTrue(records and derived[0] and derived[1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('convert_price_storage', to='intervals', delete_source=True, stdout=io.StringIO())
+        self.assertFalse(PriceRecord.objects.exists())
+        self.assertLess(PriceInterval.objects.count(), len(records))
+        self.assertEqual(derived_tables(), derived)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('convert_price_storage', to='daily', delete_source=True, stdout=io.StringIO())
+        self.assertFalse(PriceInterval.objects.exists())
+        self.assertEqual(sorted(PriceRecord.objects.values_list('product_id', 'store_id', 'date_recorded', 'price')), records)
+        self.assertEqual(derived_tables(), derived)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PriceCubeTests(TestCase):
+    """Reads served from the price cube equal the same reads from the rollup."""
+
+    def setUp(self):
+        cache.clear()
+        # Back-dated and same-day prices on top of the seeded history
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.order_by('pk').first()
+            store = Store.objects.order_by('pk').first()
+            PriceRecord.objects.update_or_create(
+                product=product, store=store, date_recorded=date.today(), defaults={'price': '123.45'},
+            )
+            PriceRecord.objects.create(
+                product=product, store=store, date_recorded=date.today() - timedelta(days=200), price='0.01',
+            )
+
+    def reads(self):
+        today = date.today()
+        store = Store.objects.order_by('pk').first().pk
+        category = Category.objects.filter(product__isnull=False).order_by('pk').first().pk
+        return {
+            'dashboard': get_dashboard_data(30),
+            'dashboard (store, category)': get_dashboard_data(90, store, category),
+            'dashboard (year)': get_dashboard_data(365),
+            'trend': get_price_trend(today - timedelta(days=400), today + timedelta(days=3)),
+            'baskets': sorted(get_store_baskets(today - timedelta(days=30)), key=lambda basket: basket['store_id']),
+            'category baskets': sorted(get_store_baskets(today - timedelta(days=7), category), key=lambda basket: basket['store_id']),
+            'unknown category baskets': get_store_baskets(today, 10 ** 6),
+            'total records': get_total_records(),
+        }
+
+    def test_cube_reads_equal_rollup_reads(self):
+        with override_settings(PRICE_CUBE=False):
+            self.assertIsNone(current_price_cube())
+            expected = self.reads()
+        with override_settings(PRICE_CUBE=True):
+            get_price_cube()
+            self.assertIsNotNone(current_price_cube())
+            actual = self.reads()
+        for name in expected:
+            self.assertEqual(actual[name], expected[name], name)
+        self.assertEqual(actual['total records'], PriceRecord.objects.count())
+
+    def test_build_reads_only_the_rollups(self):
+        with CaptureQueriesContext(connection) as captured:
+            arrays = build_arrays()
+        self.assertEqual(len(captured), 2)
+        self.assertFalse([query for query in captured if PriceRecord._meta.db_table in query['sql']])
+        self.assertEqual(arrays['latest_cents'].dtype, np.int64)
+        self.assertEqual(int(arrays['counts'].sum()), PriceRecord.objects.count())
+
+    @override_settings(PRICE_CUBE=True)
+    def test_requests_never_build_the_cube(self):
+        get_price_cube()
+        cache.clear()
+        with mock.patch.object(price_cube.threading, 'Thread') as thread, \
+                mock.patch.object(price_cube, '_building', None):
+            # A stale cube is not used; one background build is started and the rollup serves meanwhile
+            self.assertIsNone(current_price_cube())
+            self.assertEqual(self.client.get(reverse(views.dashboard)).status_code, 200)
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+
+class ShoppingListOptimizerTests(TestCase):
+    def random_matrix(self, rng, n_products, n_stores, missing=0.3):
+        prices = np.round(rng.uniform(20, 500, (n_products, n_stores)), 2)
+        prices[rng.random((n_products, n_stores)) < missing] = MISSING
+        return PriceMatrix(np.arange(n_products, dtype=np.int64) + 1, np.arange(n_stores, dtype=np.int64) + 100, prices)
+
+    def brute_force_cost(self, prices, k):
+        return min(
+            prices[:, list(stores)].min(axis=1).sum()
+            for size in range(1, k + 1)
+            for stores in combinations(range(prices.shape[1]), size)
+        )
+
+    def test_best_split_matches_brute_force(self):
+        rng = np.random.default_rng(19)
+        for n_products, n_stores in [(1, 1), (3, 2), (8, 5), (20, 9), (40, 14)]:
+            for k in (1, 2, 3):
+                matrix = self.random_matrix(rng, n_products, n_stores)
+                with self.subTest(products=n_products, stores=n_stores, k=k):
+                    split = best_split(matrix, k)
+                    columns = [int(np.searchsorted(matrix.store_ids, store['store_id'])) for store in split['stores']]
+                    self.assertLessEqual(len(columns), k)
+                    found = matrix.prices[:, columns].min(axis=1).sum() if columns else MISSING * n_products
+                    self.assertAlmostEqual(found, self.brute_force_cost(matrix.prices, k), places=6)
+
+                    # Every product is bought once or reported missing
+                    bought = sorted(product for store in split['stores'] for product in store['product_ids'])
+                    self.assertEqual(sorted(bought + split['missing']), matrix.product_ids.tolist())
+                    self.assertEqual(split['total'], sum((store['total'] for store in split['stores']), Decimal('0.00')))
+
+    def test_rank_stores_matches_single_store_totals(self):
+        matrix = self.random_matrix(np.random.default_rng(3), 12, 6)
+        ranking = rank_stores(matrix)
+        expected = sorted(
+            (int((column >= MISSING).sum()), round(float(column[column < MISSING].sum()), 2), int(store_id))
+            for store_id, column in zip(matrix.store_ids, matrix.prices.T)
+        )
+        self.assertEqual([(store['missing'], float(store['total']), store['store_id']) for store in ranking], expected)
+
+    def test_only_the_owner_gets_the_optimized_list(self):
+        owner = User.objects.create_user('owner')
+        shopping_list = ShoppingList.objects.create(user=owner)
+        shopping_list.products.set(Product.objects.order_by('pk')[:5])
+        url = reverse(views.shopping_list_optimize, args=[shopping_list.pk])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(settings.LOGIN_URL))
+
+        for other in (User.objects.create_user('other'), User.objects.create_user('staff', is_staff=True)):
+            self.client.force_login(other)
+            self.assertEqual(self.client.get(url).status_code, 404, other.username)
+
+        self.client.force_login(owner)
+        result = self.client.get(url + '?k=2').json()
+        self.assertEqual(result['products'], 5)
+        self.assertLessEqual(len(result['split']['stores']), 2)
+        self.assertEqual(self.client.get(url + '?k=9').status_code, 400)
+
+
+class PriceAlertTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        empty_price_data()
+        cls.user = User.objects.create_user('watcher')
+
+    def import_prices(self, *rows):
+        # Alerts are matched when the import commits
+        with self.captureOnCommitCallbacks(execute=True):
+            import_prices(price_feed(*[['Молоко', 'Молочные продукты', store, price, day] for store, price, day in rows]))
+
+    def alerts(self, watch):
+        return list(watch.alerts.order_by('id').values_list('store__name', 'price', 'date_recorded'))
+
+    def test_alerts_are_not_repeated(self):
+        self.import_prices(['Магнит', '60.00', '2026-01-10'])
+        watch = PriceWatch.objects.create(user=self.user, product=Product.objects.get(), threshold=50)
+
+        self.import_prices(['Магнит', '45.00', '2026-01-11'], ['Пятерочка', '55.00', '2026-01-11'])
+        self.assertEqual(self.alerts(watch), [('Магнит', Decimal('45.00'), date(2026, 1, 11))])
+
+        # Unchanged and higher prices under the threshold were already notified
+        self.import_prices(['Магнит', '45.00', '2026-01-11'])
+        self.import_prices(['Магнит', '48.00', '2026-01-12'])
+        self.assertEqual(len(self.alerts(watch)), 1)
+
+        self.import_prices(['Магнит', '40.00', '2026-01-13'], ['Пятерочка', '49.00', '2026-01-13'])
+        self.assertEqual(sorted(self.alerts(watch)[1:]), [
+            ('Магнит', Decimal('40.00'), date(2026, 1, 13)),
+            ('Пятерочка', Decimal('49.00'), date(2026, 1, 13)),
+        ])
+
+    def test_store_watches_only_match_their_store(self):
+        self.import_prices(['Магнит', '60.00', '2026-01-10'], ['Пятерочка', '60.00', '2026-01-10'])
+        product = Product.objects.get()
+        pyaterochka = Store.objects.get(name='Пятерочка')
+        store_watch = PriceWatch.objects.create(user=self.user, product=product, store=pyaterochka, threshold=50)
+        inactive = PriceWatch.objects.create(user=self.user, product=product, threshold=50, is_active=False)
+
+        self.import_prices(['Магнит', '30.00', '2026-01-11'])
+        self.assertEqual(self.alerts(store_watch), [])
+        self.import_prices(['Пятерочка', '45.00', '2026-01-11'])
+        self.assertEqual(self.alerts(store_watch), [('Пятерочка', Decimal('45.00'), date(2026, 1, 11))])
+        self.assertFalse(PriceAlert.objects.filter(watch=inactive).exists())
@@ -11,5 +11,7 @@ urlpatterns = [
     path('categories/', views.category_list, name='analytics-category-list'),
     path('categories/<str:slug>/', views.category_detail, name='analytics-category-detail'),
     path('data/import/', views.import_data, name='analytics-import-export'),
+    path('data/import/jobs/<int:pk>/', views.import_job_status, name='analytics-import-job-status'),
     path('data/export/', views.export_data, name='analytics-export-data'),
+    path('shopping-lists/<int:pk>/optimize/', views.shopping_list_optimize, name='analytics-shopping-list-optimize'),
 ]
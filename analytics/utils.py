@@ -1,56 +1,171 @@
 import pandas as pd
 import numpy as np
 from datetime import timedelta, date, datetime # Added datetime import
-from sklearn.linear_model import LinearRegression
-from .models import PriceRecord
+from django.db.models import Sum, Count, Min, Max, Q, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import CurrentPrice, DailyPriceStat, PriceRecord, Product, Store
+from .intervals import interval_storage, daily_price_frame, product_price_page
+from .cube import current_price_cube
+from .forecasting import forecast_prices
 
 def get_price_forecast(product_id, days_ahead=30):
     """
     Predicts price for the next 'days_ahead' days using linear regression.
     Returns a dictionary with model status, score, predicted price, and trend.
     """
-    end_date = date.today()
-    start_date = end_date - timedelta(days=90) # Use 90 days for better trend
-    
-    records = PriceRecord.objects.filter(
-        product_id=product_id,
-        date_recorded__gte=start_date
-    ).order_by('date_recorded')
-    
-    if records.count() < 5:
-        return {'model_status': 'insufficient_data'}
+    return forecast_prices([product_id], days_ahead=days_ahead)[product_id]
 
-    df = pd.DataFrame(list(records.values('date_recorded', 'price')))
-    df['date_ordinal'] = pd.to_datetime(df['date_recorded']).apply(lambda x: x.toordinal())
-    
-    X = df[['date_ordinal']]
-    y = df['price']
-    
-    model = LinearRegression()
-    model.fit(X, y)
-    
-    # Calculate R^2 score
-    r2 = model.score(X, y)
-    
-    # Predict for today + days_ahead
-    future_date = end_date + timedelta(days=days_ahead)
-    future_ordinal = np.array([[future_date.toordinal()]])
-    predicted_future_price = model.predict(future_ordinal)[0]
-    
-    # Predict for today (to calculate trend slope)
-    today_ordinal = np.array([[end_date.toordinal()]])
-    predicted_today_price = model.predict(today_ordinal)[0]
-    
-    trend_total = predicted_future_price - predicted_today_price
-    trend_daily = trend_total / days_ahead
-    
+HISTORY_CHART_POINTS = 200
+HISTORY_PAGE_SIZE = 50
+CATALOG_PAGE_SIZE = 24
+
+def _downsample_days(days, low, total, count, high, max_points):
+    """
+    Merges per-day (or per-record) price rows, sorted by day ordinal, into at most
+    max_points buckets of consecutive days: min, average and max per bucket.
+    """
+    span = int(days[-1] - days[0]) + 1
+    bucket_days = -(-span // max_points)
+    buckets = (days - days[0]) // bucket_days
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
     return {
-        'model_status': 'success',
-        'r2_score': round(r2, 2),
-        'predicted_price': round(float(predicted_future_price), 2),
-        'trend': round(float(trend_daily), 2), # Daily change in Rubles
-        'dates': [], # Can define if needed for chart
-        'prices': []
+        'dates': [date.fromordinal(int(day)).strftime('%Y-%m-%d') for day in days[starts]],
+        'min': np.round(np.minimum.reduceat(low, starts), 2).tolist(),
+        'avg': np.round(np.add.reduceat(total, starts) / np.add.reduceat(count, starts), 2).tolist(),
+        'max': np.round(np.maximum.reduceat(high, starts), 2).tolist(),
+    }
+
+def get_price_history_series(product_id, max_points=HISTORY_CHART_POINTS):
+    """
+    Chart series of a product over all stores: daily min / average / max price,
+    downsampled to at most max_points buckets of consecutive days, so the page
+    stays the same size however long the history is.
+    Bucket dates are the first day of each bucket.
+    """
+    if interval_storage():
+        daily = daily_price_frame(product_ids=[product_id]).sort_values('date_recorded', kind='stable')
+        days = daily['date_recorded'].to_numpy(dtype='datetime64[D]').astype(np.int64) + date(1970, 1, 1).toordinal()
+        prices = daily['price'].to_numpy(dtype=np.float64)
+        low = high = total = prices
+        count = np.ones(len(prices))
+    else:
+        rows = list(
+            PriceRecord.objects.filter(product_id=product_id)
+            .values_list('date_recorded')
+            .annotate(low=Min('price'), total=Sum('price'), count=Count('id'), high=Max('price'))
+            .order_by('date_recorded')
+        )
+        days = np.array([row[0].toordinal() for row in rows], dtype=np.int64)
+        low, total, count, high = (np.array([float(row[i]) for row in rows]) for i in range(1, 5))
+
+    if not len(days):
+        return {'dates': [], 'min': [], 'avg': [], 'max': []}
+    return _downsample_days(days, low, total, count, high, max_points)
+
+def parse_history_cursor(value):
+    """'YYYY-MM-DD.<key>' cursor of the price history table, None if missing or malformed."""
+    try:
+        day, key = value.split('.')
+        return date.fromisoformat(day), int(key)
+    except (AttributeError, ValueError):
+        return None
+
+def get_price_history_page(product_id, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    """
+    One page of the price history table, newest first. Rows are ordered by date and
+    then by record id (store id in interval storage), the cursor is the key of the
+    last row shown. Returns (records, next_cursor or None).
+    """
+    if interval_storage():
+        records = product_price_page(product_id, before=cursor, limit=page_size + 1)
+        key = lambda record: record.store_id
+    else:
+        records = PriceRecord.objects.filter(product_id=product_id).select_related('store')
+        if cursor:
+            day, record_id = cursor
+            records = records.filter(Q(date_recorded__lt=day) | Q(date_recorded=day, id__lt=record_id))
+        records = list(records.order_by('-date_recorded', '-id')[:page_size + 1])
+        key = lambda record: record.pk
+
+    if len(records) <= page_size:
+        return records, None
+    records = records[:page_size]
+    last = records[-1]
+    return records, f'{last.date_recorded.isoformat()}.{key(last)}'
+
+def get_catalog_page(after=None, page_size=CATALOG_PAGE_SIZE):
+    """
+    One page of the product catalog in id order, starting after the product id
+    `after`. Each product is annotated from CurrentPrice with min_price, max_price,
+    store_count and cheapest_store, all in the same query.
+    Returns (products, next_cursor or None).
+    """
+    # Correlated subqueries instead of a join with GROUP BY: the page is read in
+    # primary key order and only its own products are aggregated
+    prices = CurrentPrice.objects.filter(product=OuterRef('pk'))
+    per_product = prices.order_by().values('product')
+    products = Product.objects.select_related('category').annotate(
+        min_price=Subquery(per_product.annotate(value=Min('price')).values('value')),
+        max_price=Subquery(per_product.annotate(value=Max('price')).values('value')),
+        store_count=Coalesce(Subquery(per_product.annotate(value=Count('id')).values('value')), 0),
+        cheapest_store=Subquery(prices.order_by('price', 'store_id').values('store__name')[:1]),
+    ).order_by('id')
+    if after:
+        products = products.filter(id__gt=after)
+
+    products = list(products[:page_size + 1])
+    if len(products) <= page_size:
+        return products, None
+    products = products[:page_size]
+    return products, products[-1].pk
+
+def get_daily_average_prices(start_date, end_date=None, store_id=None, category_id=None):
+    """
+    Average price per day from the price cube (or the DailyPriceStat rollup).
+    Returns a DataFrame with 'day' and 'avg_price' columns, sorted, for days with records.
+    """
+    cube = current_price_cube()
+    if cube is not None:
+        sums, counts = cube.daily_totals(start_date, end_date or cube.end_date, store_id, category_id)
+        priced = np.flatnonzero(counts)
+        return pd.DataFrame({
+            'day': [start_date + timedelta(days=offset) for offset in priced.tolist()],
+            'avg_price': sums[priced] / counts[priced],
+        })
+
+    stats = DailyPriceStat.objects.filter(day__gte=start_date)
+    if end_date:
+        stats = stats.filter(day__lte=end_date)
+    if store_id:
+        stats = stats.filter(store_id=store_id)
+    if category_id:
+        stats = stats.filter(category_id=category_id)
+
+    daily = stats.values('day').annotate(price_sum=Sum('price_sum'), record_count=Sum('record_count')).order_by('day')
+    df = pd.DataFrame.from_records(daily, columns=['day', 'price_sum', 'record_count'])
+    df['avg_price'] = df['price_sum'].astype(float) / df['record_count']
+    return df[['day', 'avg_price']]
+
+def get_price_trend(start_date, end_date):
+    """
+    Average price per day between two dates, one point per calendar day.
+    Days without records are None (Chart.js skips them).
+    """
+    cube = current_price_cube()
+    if cube is not None:
+        sums, counts = cube.daily_totals(start_date, end_date)
+        return {
+            'dates': [(start_date + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(len(counts))],
+            'prices': [round(total / count, 2) if count else None for total, count in zip(sums.tolist(), counts.tolist())],
+        }
+
+    daily = get_daily_average_prices(start_date, end_date).set_index('day')['avg_price']
+    daily.index = pd.to_datetime(daily.index)
+    days = pd.date_range(start_date, end_date, freq='D')
+    daily = daily.reindex(days)
+    return {
+        'dates': [day.strftime('%Y-%m-%d') for day in days],
+        'prices': [None if pd.isna(price) else round(price, 2) for price in daily.tolist()],
     }
 
 def get_market_inflation(days=30):
@@ -60,23 +175,12 @@ def get_market_inflation(days=30):
     stop_date = date.today()
     start_date = stop_date - timedelta(days=days)
     
-    records = PriceRecord.objects.filter(
-        date_recorded__gte=start_date
-    ).values('date_recorded', 'price')
-    
-    df = pd.DataFrame(records)
-    if df.empty:
+    daily_avg = get_daily_average_prices(start_date)
+    if daily_avg.empty:
         return {'dates': [], 'prices': [], 'change': 0}
-        
-    # Ensure price is numeric (float) to avoid TypeError with Decimal objects
-    df['price'] = df['price'].astype(float)
-
-    # Group by date and mean
-    daily_avg = df.groupby('date_recorded')['price'].mean().reset_index()
-    daily_avg = daily_avg.sort_values('date_recorded')
     
-    dates = daily_avg['date_recorded'].apply(lambda x: x.strftime('%Y-%m-%d')).tolist()
-    prices = daily_avg['price'].round(2).tolist()
+    dates = [day.strftime('%Y-%m-%d') for day in daily_avg['day']]
+    prices = daily_avg['avg_price'].round(2).tolist()
     
     inflation_change = 0
     if len(prices) > 1:
@@ -87,3 +191,142 @@ def get_market_inflation(days=30):
         'prices': prices,
         'change': round(inflation_change, 2)
     }
+
+def get_store_daily_averages(start_date, end_date, store_id=None, category_id=None):
+    """
+    Average price per store per day from the price cube, or a single grouped query on the daily rollup.
+    Returns a DataFrame indexed by every date in the range with one column per store id
+    (NaN where a store has no records that day).
+    """
+    date_index = pd.date_range(start_date, end_date, freq='D')
+    cube = current_price_cube()
+    if cube is not None:
+        store_ids, sums, counts = cube.store_daily_totals(start_date, end_date, store_id, category_id)
+        priced = counts.sum(axis=1) > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages = np.where(counts > 0, sums / counts, np.nan)
+        return pd.DataFrame(averages[priced].T, index=date_index, columns=store_ids[priced].tolist())
+
+    stats = DailyPriceStat.objects.filter(day__gte=start_date, day__lte=end_date)
+    if store_id:
+        stats = stats.filter(store_id=store_id)
+    if category_id:
+        stats = stats.filter(category_id=category_id)
+
+    daily = stats.values('store_id', 'day').annotate(
+        price_sum=Sum('price_sum'), record_count=Sum('record_count')
+    ).order_by()
+    df = pd.DataFrame.from_records(daily, columns=['store_id', 'day', 'price_sum', 'record_count'])
+    if df.empty:
+        return pd.DataFrame(index=date_index, dtype=float)
+
+    df['avg_price'] = df['price_sum'].astype(float) / df['record_count']
+    df['day'] = pd.to_datetime(df['day'])
+    pivot = df.pivot(index='day', columns='store_id', values='avg_price')
+    return pivot.reindex(date_index)
+
+def get_total_records():
+    """Number of price records, from the price cube or summed from the daily rollup instead of counting the raw table."""
+    cube = current_price_cube()
+    if cube is not None:
+        return cube.total_records
+    return DailyPriceStat.objects.aggregate(total=Sum('record_count'))['total'] or 0
+
+def get_store_baskets(start_date, category_id=None):
+    """
+    Basket of the latest price of every product per store, computed in the database.
+    Only products with a price recorded since start_date count.
+    Returns a list of dicts with store_id, total and count.
+    """
+    cube = current_price_cube()
+    if cube is not None:
+        return cube.store_baskets(start_date, category_id)
+
+    # CurrentPrice holds the latest price per (product, store)
+    current = CurrentPrice.objects.filter(date_recorded__gte=start_date)
+    if category_id:
+        current = current.filter(product__category_id=category_id)
+
+    return list(
+        current.values('store_id')
+        .annotate(total=Sum('price'), count=Count('id'))
+        .order_by()
+    )
+
+DASHBOARD_COLORS = ['#0d9488', '#dc2626', '#2563eb', '#d97706', '#7c3aed', '#db2777']
+
+def get_dashboard_data(days=30, store_id='', category_id=''):
+    """
+    Computes the price-derived part of the dashboard for one filter combination:
+    store chart, store basket ranking, market inflation and the record total.
+    Everything returned is plain data, so it can be cached.
+    """
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
+    store_id = str(store_id or '')
+    category_id = str(category_id or '')
+
+    # 1. Market Inflation (Basket Analysis)
+    inflation_data = get_market_inflation(days=days)
+
+    # 2. Daily Store Activity (Filtered)
+    # Chart: Average Price by Store (Dynamic), one grouped (store, day) query
+    stores = list(Store.objects.all())
+    daily_averages = get_store_daily_averages(
+        start_date, end_date,
+        store_id=store_id or None,
+        category_id=category_id or None,
+    )
+    chart_datasets = []
+
+    # Generate labels for X axis
+    date_labels = [d.strftime('%Y-%m-%d') for d in daily_averages.index]
+
+    for i, store in enumerate(stores):
+        # Skip if store filter is active and doesn't match
+        if store_id and str(store.id) != store_id:
+            continue
+
+        if store.id in daily_averages.columns:
+            column = daily_averages[store.id]
+            data_points = [None if pd.isna(price) else round(price, 2) for price in column.tolist()]
+        else:
+            data_points = [None] * len(date_labels)
+
+        chart_datasets.append({
+            'label': store.name,
+            'data': data_points,
+            'borderColor': DASHBOARD_COLORS[i % len(DASHBOARD_COLORS)],
+            'backgroundColor': 'transparent',
+            'borderWidth': 2,
+            'tension': 0.3,
+            'spanGaps': True,
+            'pointRadius': 2
+        })
+
+    # 3. Store Basket Comparison (Cheapest Store)
+    # Calculated for ALL stores regardless of the store filter to get true store value,
+    # the category filter applies if user wants "Cheapest store for Dairy"
+    store_names = {store.id: store.name for store in stores}
+    store_basket = []
+    for basket in get_store_baskets(start_date, category_id=category_id or None):
+        basket_sum = basket['total']
+        product_count = basket['count']
+        avg_item_price = basket_sum / product_count
+
+        store_basket.append({
+            'name': store_names[basket['store_id']],
+            'total': round(basket_sum, 2),
+            'count': product_count,
+            'avg_item_price': round(avg_item_price, 2)
+        })
+
+    store_basket.sort(key=lambda x: x['avg_item_price'])
+
+    return {
+        'store_basket': store_basket,
+        'total_records': get_total_records(),
+        'chart_labels': date_labels,
+        'chart_datasets': chart_datasets,
+        'inflation': inflation_data,
+    }
@@ -1,198 +1,157 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.db.models import Avg, Min, Max, Count, F, Q
-from django.db.models.functions import TruncDay
-from .models import Product, Store, Category, PriceRecord
+from .models import Product, Store, Category, PriceRecord, ImportJob, ProductForecast, ShoppingList
 from .forms import ProductForm
 import json
-import csv
-import pandas as pd
-from django.http import HttpResponse
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.contrib import messages
-from datetime import timedelta, date, datetime
-from .utils import get_market_inflation, get_price_forecast
+from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from datetime import timedelta, date
+from .utils import (
+    get_daily_average_prices, get_price_trend, get_dashboard_data,
+    get_price_history_series, get_price_history_page, parse_history_cursor, get_catalog_page,
+)
+from .cache import get_cached_payload
+from .budgets import query_budget
+from .importer import SUPPORTED_EXTENSIONS
+from .optimizer import MAX_SPLIT_STORES, optimize_list
+from .exporter import filter_price_records, iter_csv, iter_gzip, iter_parquet, ExportFilterError
 
 # Create your views here.
+@query_budget(4)
 def export_data(request):
-    # Export logic
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="price_records.csv"'
+    # Streamed export, see exporter.filter_price_records for the supported filters
+    try:
+        records = filter_price_records(request.GET)
+    except ExportFilterError as e:
+        return HttpResponseBadRequest(str(e))
 
-    writer = csv.writer(response)
-    writer.writerow(['Product', 'Category', 'Store', 'Price', 'Date'])
-
-    records = PriceRecord.objects.all().select_related('product', 'product__category', 'store')
-    for record in records:
-        writer.writerow([
-            record.product.name,
-            record.product.category.name,
-            record.store.name,
-            record.price,
-            record.date_recorded
-        ])
+    # Clients pass this back as ?since= on their next incremental pull. It lags behind
+    # so that the next pull overlaps this one, see EXPORT_WATERMARK_LAG_SECONDS
+    watermark = timezone.now() - timedelta(seconds=settings.EXPORT_WATERMARK_LAG_SECONDS)
+    watermark = watermark.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    if request.GET.get('format') == 'parquet':
+        # Parquet compresses its column chunks itself (snappy by default)
+        if request.GET.get('compress'):
+            return HttpResponseBadRequest('compress: not supported with format=parquet')
+        response = StreamingHttpResponse(iter_parquet(records), content_type='application/vnd.apache.parquet')
+        response['Content-Disposition'] = 'attachment; filename="price_records.parquet"'
+        response['X-Export-Watermark'] = watermark
+        return response
 
+    chunks = iter_csv(records)
+    filename = 'price_records.csv'
+    if request.GET.get('compress') == 'gzip':
+        response = StreamingHttpResponse(iter_gzip(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Export-Watermark'] = watermark
     return response
 
+@query_budget(5)
 def import_data(request):
-    if request.method == 'POST' and request.FILES['file']:
-        csv_file = request.FILES['file']
-        if not csv_file.name.endswith('.csv'):
-            messages.error(request, 'Пожалуйста, загрузите CSV файл')
+    if request.method == 'POST' and request.FILES.get('file'):
+        feed_file = request.FILES['file']
+        if not feed_file.name.lower().endswith(SUPPORTED_EXTENSIONS):
+            messages.error(request, 'Пожалуйста, загрузите CSV или Parquet файл')
             return redirect('analytics-import-export')
-        
-        try:
-            df = pd.read_csv(csv_file)
-            # Expected columns: Product, Category, Store, Price, Date
-            
-            records_created = 0
-            for index, row in df.iterrows():
-                # Get or create category
-                category, _ = Category.objects.get_or_create(
-                    name=row['Category'],
-                    defaults={'slug': row['Category'].lower().replace(' ', '-')}
-                )
-                
-                # Get or create product
-                product, _ = Product.objects.get_or_create(
-                    name=row['Product'],
-                    category=category
-                )
-                
-                # Get or create store
-                store, _ = Store.objects.get_or_create(
-                    name=row['Store'],
-                    defaults={'url': 'http://example.com'}
-                )
-                
-                # Create price record
-                date_obj = datetime.strptime(row['Date'], '%Y-%m-%d').date() if isinstance(row['Date'], str) else row['Date']
-                
-                PriceRecord.objects.get_or_create(
-                    product=product,
-                    store=store,
-                    price=row['Price'],
-                    date_recorded=date_obj
-                )
-                records_created += 1
-                
-            messages.success(request, f'Успешно импортировано {records_created} записей')
-        except Exception as e:
-            messages.error(request, f'Ошибка при импорте: {str(e)}')
-            
-    return render(request, 'analytics/import_export.html')
 
+        # Parsing happens in the background worker (manage.py process_imports)
+        job = ImportJob.objects.create(file=feed_file)
+        messages.success(request, f'Файл поставлен в очередь на импорт (задача #{job.pk})')
+        return redirect('analytics-import-export')
+
+    return render(request, 'analytics/import_export.html', {
+        'import_jobs': ImportJob.objects.all()[:10],
+        'stores': Store.objects.all(),
+        'categories': Category.objects.all(),
+    })
+
+@query_budget(1)
+def import_job_status(request, pk):
+    job = get_object_or_404(ImportJob, pk=pk)
+    rows_per_sec = job.rows_processed / job.elapsed if job.elapsed else 0
+    return JsonResponse({
+        'id': job.pk,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.progress,
+        'total_rows': job.total_rows,
+        'rows_processed': job.rows_processed,
+        'records_written': job.records_written,
+        'rows_skipped': job.rows_skipped,
+        'rows_rejected': job.rows_rejected,
+        'rejected_sample': job.rejected_sample,
+        'rows_per_sec': round(rows_per_sec, 1),
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
+@query_budget(7)
+@login_required
+def shopping_list_optimize(request, pk):
+    # Own lists only: the lists of other users are not found
+    shopping_list = get_object_or_404(ShoppingList, pk=pk, user=request.user)
+    k = request.GET.get('k', '2')
+    if not k.isdigit() or not 1 <= int(k) <= MAX_SPLIT_STORES:
+        return HttpResponseBadRequest(f'k must be between 1 and {MAX_SPLIT_STORES}')
+
+    result = optimize_list(shopping_list, k=int(k))
+    store_names = dict(Store.objects.values_list('id', 'name'))
+    for store in result['stores'] + result['split']['stores']:
+        store['store_name'] = store_names[store['store_id']]
+    return JsonResponse(result)
+
+@query_budget(10)
 def dashboard(request):
-    # Filters
-    selected_days = int(request.GET.get('days', 30))
+    # Filters; invalid values fall back to the defaults, the window is capped like on the home page
+    try:
+        selected_days = int(request.GET.get('days', 30))
+    except ValueError:
+        selected_days = 30
+    selected_days = min(max(selected_days, 1), settings.HOME_TREND_MAX_DAYS)
     selected_store_id = request.GET.get('store', '')
     selected_category_id = request.GET.get('category', '')
-    
-    end_date = date.today()
-    start_date = end_date - timedelta(days=selected_days)
-    
-    # 1. Market Inflation (Basket Analysis)
-    inflation_data = get_market_inflation(days=selected_days)
-    
-    # 2. Daily Store Activity (Filtered)
-    records_query = PriceRecord.objects.filter(date_recorded__gte=start_date)
-    if selected_store_id:
-        records_query = records_query.filter(store_id=selected_store_id)
-    if selected_category_id:
-        records_query = records_query.filter(product__category_id=selected_category_id)
-        
-    # Chart: Average Price by Store (Dynamic)
-    stores = Store.objects.all()
-    chart_datasets = []
-    
-    # Generate labels for X axis
-    date_labels = []
-    current = start_date
-    while current <= end_date:
-        date_labels.append(current.strftime('%Y-%m-%d'))
-        current += timedelta(days=1)
-        
-    colors = ['#0d9488', '#dc2626', '#2563eb', '#d97706', '#7c3aed', '#db2777']
-    
-    for i, store in enumerate(stores):
-        # Skip if store filter is active and doesn't match
-        if selected_store_id and str(store.id) != selected_store_id:
-            continue
-            
-        daily_prices = records_query.filter(store=store)\
-            .annotate(day=TruncDay('date_recorded'))\
-            .values('day')\
-            .annotate(avg_price=Avg('price'))\
-            .order_by('day')
-            
-        price_map = {}
-        for item in daily_prices:
-            # Handle date/string variations from DB
-            d_val = item['day']
-            key = d_val[:10] if isinstance(d_val, str) else d_val.strftime('%Y-%m-%d')
-            price_map[key] = round(float(item['avg_price']), 2)
-            
-        data_points = [price_map.get(d, None) for d in date_labels]
-        
-        chart_datasets.append({
-            'label': store.name,
-            'data': data_points,
-            'borderColor': colors[i % len(colors)],
-            'backgroundColor': 'transparent',
-            'borderWidth': 2,
-            'tension': 0.3,
-            'spanGaps': True,
-            'pointRadius': 2
-        })
+    if not selected_store_id.isdecimal():
+        selected_store_id = ''
+    if not selected_category_id.isdecimal():
+        selected_category_id = ''
 
-    # 3. Store Basket Comparison (Cheapest Store)
-    store_basket = []
-    for store in stores:
-        # Calculate for ALL products regardless of filter to get true store value, 
-        # OR apply category filter if user wants "Cheapest store for Dairy"
-        basket_query = PriceRecord.objects.filter(store=store, date_recorded__gte=start_date)
-        if selected_category_id:
-             basket_query = basket_query.filter(product__category_id=selected_category_id)
-             
-        latest_prices = {}
-        # Fetch and process in python to ensure 'latest'
-        for record in basket_query.order_by('date_recorded'):
-            latest_prices[record.product_id] = record.price
-            
-        if latest_prices:
-            basket_sum = sum(latest_prices.values())
-            
-            product_count = len(latest_prices)
-            avg_item_price = basket_sum / product_count
-            
-            store_basket.append({
-                'name': store.name,
-                'total': round(basket_sum, 2),
-                'count': product_count,
-                'avg_item_price': round(avg_item_price, 2)
-            })
-    
-    store_basket.sort(key=lambda x: x['avg_item_price'])
+    # Charts, basket and inflation are cached per filter combination until prices change
+    data = get_cached_payload(
+        'dashboard',
+        (selected_days, selected_store_id, selected_category_id),
+        lambda: get_dashboard_data(selected_days, selected_store_id, selected_category_id),
+    )
 
     return render(request, 'analytics/dashboard.html', {
-        'store_basket': store_basket,
+        'store_basket': data['store_basket'],
         'total_products': Product.objects.count(),
-        'total_records': PriceRecord.objects.count(),
-        'chart_labels': json.dumps(date_labels),
-        'chart_datasets': json.dumps(chart_datasets),
-        'inflation_dates': json.dumps(inflation_data['dates']),
-        'inflation_prices': json.dumps(inflation_data['prices']),
-        'inflation_change': inflation_data['change'],
-        'stores': stores,
+        'total_records': data['total_records'],
+        'chart_labels': json.dumps(data['chart_labels']),
+        'chart_datasets': json.dumps(data['chart_datasets']),
+        'inflation_dates': json.dumps(data['inflation']['dates']),
+        'inflation_prices': json.dumps(data['inflation']['prices']),
+        'inflation_change': data['inflation']['change'],
+        'stores': Store.objects.all(),
         'categories': Category.objects.all(),
         'selected_days': selected_days,
         'selected_store': int(selected_store_id) if selected_store_id else None,
         'selected_category': int(selected_category_id) if selected_category_id else None,
     })
 
+@query_budget(3)
 def category_list(request):
     # Fix: Use 'product' as the related name based on field error feedback
     categories = Category.objects.annotate(product_count=Count('product')).all()
     return render(request, 'analytics/category_list.html', {'categories': categories})
 
+@query_budget(5)
 def category_detail(request, slug):
     category = get_object_or_404(Category, slug=slug)
     products = category.product_set.all()
@@ -200,13 +159,10 @@ def category_detail(request, slug):
     # Category Price Index (Avg price of category per day)
     # Only for last 90 days
     start_date = date.today() - timedelta(days=90)
-    daily_stats = PriceRecord.objects.filter(
-        product__category=category,
-        date_recorded__gte=start_date
-    ).annotate(day=TruncDay('date_recorded')).values('day').annotate(avg_price=Avg('price')).order_by('day')
+    daily_stats = get_daily_average_prices(start_date, category_id=category.id)
     
-    dates = [stat['day'].strftime('%Y-%m-%d') for stat in daily_stats]
-    prices = [round(float(stat['avg_price']), 2) for stat in daily_stats]
+    dates = [day.strftime('%Y-%m-%d') for day in daily_stats['day']]
+    prices = [round(avg_price, 2) for avg_price in daily_stats['avg_price']]
 
     return render(request, 'analytics/category_detail.html', {
         'category': category,
@@ -215,69 +171,76 @@ def category_detail(request, slug):
         'chart_prices': json.dumps(prices),
     })
 
+@query_budget(3)
 def home(request):
-    # Calculate average price trend for the last 30 days
+    # Average price trend, one aggregate over the daily rollup for any window length
+    try:
+        trend_days = int(request.GET.get('days', settings.HOME_TREND_DAYS))
+    except ValueError:
+        trend_days = settings.HOME_TREND_DAYS
+    trend_days = min(max(trend_days, 1), settings.HOME_TREND_MAX_DAYS)
+
     end_date = date.today()
-    start_date = end_date - timedelta(days=30)
-    
-    dates = []
-    avg_prices = []
-    
-    current_date = start_date
-    while current_date <= end_date:
-        # Get average price of all records on this specific date
-        avg_price = PriceRecord.objects.filter(date_recorded=current_date).aggregate(Avg('price'))['price__avg']
-        
-        dates.append(current_date.strftime('%Y-%m-%d'))
-        # Handle None if no records for that day (just use previous or 0)
-        if avg_price is not None:
-             avg_prices.append(round(float(avg_price), 2))
-        else:
-             avg_prices.append(None) # Chart.js handles nulls by skipping or interpolating
-             
-        current_date += timedelta(days=1)
+    start_date = end_date - timedelta(days=trend_days)
+    trend = get_cached_payload('home-trend', (start_date, end_date), lambda: get_price_trend(start_date, end_date))
 
     context = {
-        'chart_dates': json.dumps(dates),
-        'chart_prices': json.dumps(avg_prices),
+        'chart_dates': json.dumps(trend['dates']),
+        'chart_prices': json.dumps(trend['prices']),
+        'trend_days': trend_days,
     }
     return render(request, 'home.html', context)
 
+@query_budget(3)
 def products_list(request):
-    products = Product.objects.all().select_related('category')
-    return render(request, 'analytics/products_list.html', {'products': products})
+    # Keyset pages: ?after= is the id of the last product of the previous page
+    after = request.GET.get('after')
+    after = int(after) if after and after.isdigit() else None
+    products, next_cursor = get_catalog_page(after)
+    return render(request, 'analytics/products_list.html', {
+        'products': products,
+        'next_cursor': next_cursor,
+        'is_first_page': after is None,
+    })
 
+@query_budget(8)
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
-    # Fetch price history sorted by date for the graph
-    price_history = product.pricerecord_set.all().order_by('date_recorded')
-    
-    dates = []
-    prices = []
-    
-    if price_history.exists():
-        dates = [record.date_recorded.strftime('%Y-%m-%d') for record in price_history]
-        prices = [float(record.price) for record in price_history]
+    # Bounded chart series and one page of the history table, whatever the history length
+    series = get_price_history_series(product.pk)
+    cursor = parse_history_cursor(request.GET.get('cursor'))
+    price_history, next_cursor = get_price_history_page(product.pk, cursor)
 
-    # Reverse order for the table list (newest first)
-    price_history_desc = price_history.reverse()
+    # Latest price per store from CurrentPrice, cheapest first
+    current_prices = list(product.current_prices.select_related('store').order_by('price', 'store_id'))
+    latest_price = max(current_prices, key=lambda current: current.date_recorded, default=None)
 
-    # Calculate Forecast
-    forecast = get_price_forecast(product.id, days_ahead=30)
+    # Forecast precomputed by the refresh_forecasts command
+    stored_forecast = ProductForecast.objects.filter(product=product).first()
+    forecast = stored_forecast.as_dict() if stored_forecast else None
 
     return render(request, 'analytics/product_detail.html', {
         'product': product,
-        'price_history': price_history_desc,
-        'chart_dates': json.dumps(dates),
-        'chart_prices': json.dumps(prices),
+        'price_history': price_history,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+        'latest_price': latest_price,
+        'cheapest_price': current_prices[0] if current_prices else None,
+        'chart_dates': json.dumps(series['dates']),
+        'chart_prices': json.dumps(series['avg']),
+        'chart_min': json.dumps(series['min']),
+        'chart_max': json.dumps(series['max']),
         'forecast': forecast,
+        'forecast_computed_at': stored_forecast.computed_at if stored_forecast else None,
     })
 
+@query_budget(3)
 def stores_list(request):
     stores = Store.objects.all()
     return render(request, 'analytics/stores_list.html', {'stores': stores})
 
 
+@query_budget(3)
 def product_create(request):
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES)
@@ -288,6 +251,7 @@ def product_create(request):
         form = ProductForm()
     return render(request, 'analytics/product_form.html', {'form': form, 'title': 'Добавить товар'})
 
+@query_budget(4)
 def product_update(request, pk):
     product = get_object_or_404(Product, pk=pk)
     if request.method == 'POST':
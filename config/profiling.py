@@ -0,0 +1,563 @@
+"""
+Request profiling.
+
+Per-view statistics (opt-in, settings.REQUEST_PROFILING): RequestProfilingMiddleware
+records, per resolved URL name, the number of requests, their wall time, SQL time
+and query count, and the time spent in analytics.utils and in pandas. SQL is timed
+by a connection execute wrapper; the analytics.utils and pandas shares are
+estimated by a sampler thread that looks at the stack of every request in progress
+every REQUEST_PROFILING_SAMPLE_MS.
+
+Everything is aggregated in memory, per process, into fixed-bucket histograms, so
+the statistics do not grow with traffic. Requests slower than
+REQUEST_PROFILING_SLOW_MS are logged with their slowest SQL statements and the
+last ones are kept. Staff read the statistics at /__profiling__/ as JSON, or as
+Prometheus text with ?format=prometheus.
+
+Profile of a single request (ProfileRequestMiddleware): staff add ?__profile=1
+(collapsed stacks, the input of flamegraph.pl and speedscope) or ?__profile=html
+(a flame graph page) to any URL. The request then runs with the payload cache
+bypassed while a thread samples its stack every REQUEST_PROFILER_SAMPLE_MS
+(?__sample_ms= overrides), and the profile, capped at REQUEST_PROFILER_MAX_KB,
+is returned instead of the page. REQUEST_PROFILER_DIR also keeps the stacks.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import pandas
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.utils import timezone
+from django.utils.html import escape
+
+from analytics import utils as analytics_utils
+from analytics.cache import bypass_payload_cache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in seconds, plus an unbounded last bucket
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUESTS = 50
+SLOW_QUERIES = 3
+MAX_SQL_LENGTH = 2000
+UNRESOLVED = '<unresolved>'
+STATS_URL_NAME = 'profiling-stats'
+
+PROFILE_PARAM = '__profile'
+SAMPLE_MS_PARAM = '__sample_ms'
+MIN_SAMPLE_MS, MAX_SAMPLE_MS = 0.1, 100
+MAX_DEPTH = 128
+# Flame graph boxes below this share of the samples are left out
+MIN_FLAME_SHARE = 0.002
+TOP_FUNCTIONS = 20
+
+UTILS_FILE = analytics_utils.__file__
+PANDAS_DIR = os.path.dirname(pandas.__file__) + os.sep
+
+
+class RequestRecord:
+    """Measurements of one request. Also the execute wrapper that times its SQL."""
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.sql_time = 0.0
+        self.queries = 0
+        # (seconds, sql) of the slowest statements, slowest first
+        self.slowest = []
+        self.samples = 0
+        self.utils_samples = 0
+        self.pandas_samples = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.sql_time += duration
+            self.queries += 1
+            if len(self.slowest) < SLOW_QUERIES or duration > self.slowest[-1][0]:
+                self.slowest.append((duration, sql[:MAX_SQL_LENGTH]))
+                self.slowest.sort(key=lambda query: query[0], reverse=True)
+                del self.slowest[SLOW_QUERIES:]
+
+    def sample(self, frame):
+        """Counts one sample of the stack of the request thread, from the sampler thread."""
+        in_utils = in_pandas = False
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename == UTILS_FILE:
+                in_utils = True
+            elif filename.startswith(PANDAS_DIR):
+                in_pandas = True
+            frame = frame.f_back
+        self.samples += 1
+        self.utils_samples += in_utils
+        self.pandas_samples += in_pandas
+
+    def share(self, samples, wall):
+        # Share of the wall time, from the share of the samples
+        return wall * samples / self.samples if self.samples else 0.0
+
+
+class Sampler:
+    """Daemon thread sampling the stacks of the requests in progress, started on first use."""
+
+    def __init__(self):
+        self.interval = 0.005
+        self.records = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, record):
+        with self.lock:
+            self.records[record.thread_id] = record
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='request-sampler', daemon=True)
+                self.thread.start()
+
+    def remove(self, record):
+        with self.lock:
+            if self.records.get(record.thread_id) is record:
+                del self.records[record.thread_id]
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                records = list(self.records.values())
+            if not records:
+                continue
+            frames = sys._current_frames()
+            for record in records:
+                frame = frames.get(record.thread_id)
+                if frame is not None:
+                    record.sample(frame)
+
+
+class Histogram:
+    """Counts of observed seconds per bucket of BUCKETS, and their sum."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, None past the last bound."""
+        target = q * sum(self.counts)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {
+            'sum_ms': round(self.sum * 1000, 1),
+            'p50_ms': _ms(self.quantile(0.5)),
+            'p95_ms': _ms(self.quantile(0.95)),
+            'buckets': {str(bound): count for bound, count in zip(BUCKETS + ('+Inf',), self.counts)},
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.queries = 0
+        self.max_wall = 0.0
+        self.utils_time = 0.0
+        self.pandas_time = 0.0
+        self.wall = Histogram()
+        self.sql = Histogram()
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'queries': self.queries,
+            'queries_per_request': round(self.queries / self.requests, 1) if self.requests else 0,
+            'max_ms': _ms(self.max_wall),
+            'utils_ms': _ms(self.utils_time),
+            'pandas_ms': _ms(self.pandas_time),
+            'wall': self.wall.as_dict(),
+            'sql': self.sql.as_dict(),
+        }
+
+
+class ProfileStats:
+    """Statistics per URL name and the last slow requests of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.slow = deque(maxlen=SLOW_REQUESTS)
+            self.since = timezone.now()
+
+    def add(self, name, status, wall, record):
+        with self.lock:
+            view = self.views.setdefault(name, ViewStats())
+            view.requests += 1
+            view.errors += status >= 500
+            view.queries += record.queries
+            view.max_wall = max(view.max_wall, wall)
+            view.utils_time += record.share(record.utils_samples, wall)
+            view.pandas_time += record.share(record.pandas_samples, wall)
+            view.wall.observe(wall)
+            view.sql.observe(record.sql_time)
+
+    def add_slow(self, entry):
+        with self.lock:
+            self.slow.append(entry)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'enabled': settings.REQUEST_PROFILING,
+                'pid': os.getpid(),
+                'since': self.since.isoformat(),
+                'views': {name: view.as_dict() for name, view in sorted(self.views.items())},
+                'slow_requests': list(self.slow),
+            }
+
+    def as_prometheus(self):
+        lines = []
+
+        def metric(name, kind, help_text, values):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(values)
+
+        def histogram(name, help_text, histograms):
+            values = []
+            for label, hist in histograms:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), hist.counts):
+                    cumulative += count
+                    values.append(f'{name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+                values.append(f'{name}_sum{{view="{label}"}} {hist.sum}')
+                values.append(f'{name}_count{{view="{label}"}} {cumulative}')
+            metric(name, 'histogram', help_text, values)
+
+        with self.lock:
+            views = [(_label(name), view) for name, view in sorted(self.views.items())]
+            metric('django_view_requests_total', 'counter', 'Requests per view.',
+                   [f'django_view_requests_total{{view="{label}"}} {view.requests}' for label, view in views])
+            metric('django_view_errors_total', 'counter', 'Responses with a 5xx status per view.',
+                   [f'django_view_errors_total{{view="{label}"}} {view.errors}' for label, view in views])
+            metric('django_view_queries_total', 'counter', 'SQL queries per view.',
+                   [f'django_view_queries_total{{view="{label}"}} {view.queries}' for label, view in views])
+            metric('django_view_utils_seconds_total', 'counter', 'Time in analytics.utils per view (sampled).',
+                   [f'django_view_utils_seconds_total{{view="{label}"}} {view.utils_time}' for label, view in views])
+            metric('django_view_pandas_seconds_total', 'counter', 'Time in pandas per view (sampled).',
+                   [f'django_view_pandas_seconds_total{{view="{label}"}} {view.pandas_time}' for label, view in views])
+            histogram('django_view_duration_seconds', 'Wall time of the requests per view.',
+                      [(label, view.wall) for label, view in views])
+            histogram('django_view_sql_duration_seconds', 'SQL time of the requests per view.',
+                      [(label, view.sql) for label, view in views])
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+sampler = Sampler()
+stats = ProfileStats()
+
+
+class RequestProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow = settings.REQUEST_PROFILING_SLOW_MS / 1000
+        sampler.interval = settings.REQUEST_PROFILING_SAMPLE_MS / 1000
+
+    def __call__(self, request):
+        record = RequestRecord()
+        sampler.add(record)
+        with connection.execute_wrapper(record):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(response.streaming_content, request, response, record)
+        else:
+            self.finish(request, response, record)
+        return response
+
+    def stream(self, content, request, response, record):
+        # Streamed responses (exports) run most of their queries while the body is sent
+        try:
+            with connection.execute_wrapper(record):
+                yield from content
+        finally:
+            self.finish(request, response, record)
+
+    def finish(self, request, response, record):
+        sampler.remove(record)
+        wall = time.perf_counter() - record.started
+        match = request.resolver_match
+        name = match.view_name if match else UNRESOLVED
+        if name == STATS_URL_NAME:
+            return
+        stats.add(name, response.status_code, wall, record)
+        if wall < self.slow:
+            return
+
+        slowest = [{'ms': round(seconds * 1000, 1), 'sql': sql} for seconds, sql in record.slowest]
+        stats.add_slow({
+            'at': timezone.now().isoformat(),
+            'view': name,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'wall_ms': round(wall * 1000, 1),
+            'sql_ms': round(record.sql_time * 1000, 1),
+            'queries': record.queries,
+            'slowest_sql': slowest,
+        })
+        logger.warning(
+            'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms. Slowest SQL: %s',
+            request.method, request.get_full_path(), name, wall * 1000, record.queries, record.sql_time * 1000,
+            '; '.join(f"[{query['ms']} ms] {query['sql']}" for query in slowest) or '-',
+        )
+
+
+def stats_view(request):
+    """Staff only: the statistics of this process as JSON, or Prometheus text with ?format=prometheus."""
+    if not request.user.is_staff:
+        raise Http404
+    if request.GET.get('format') == 'prometheus':
+        return HttpResponse(stats.as_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    return JsonResponse(stats.as_dict())
+
+
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+class StackSampler:
+    """Counts the stacks of one thread, every interval seconds, up to the frame running stop_code."""
+
+    def __init__(self, thread_id, interval, stop_code):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stop_code = stop_code
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None and frame.f_code is not self.stop_code:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if not names:
+                continue
+            if len(names) > MAX_DEPTH:
+                # Deepest frames are kept: that is where the time goes
+                names = names[:MAX_DEPTH] + ['...']
+            self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+
+_switch_lock = threading.Lock()
+_switch_users = 0
+_switch_previous = None
+
+
+@contextmanager
+def _switch_interval(seconds):
+    # The sampler thread only runs when the request thread releases the GIL, at the
+    # latest every switch interval (5 ms by default): shorten it while profiling
+    global _switch_users, _switch_previous
+    with _switch_lock:
+        if not _switch_users:
+            _switch_previous = sys.getswitchinterval()
+        _switch_users += 1
+        sys.setswitchinterval(min(sys.getswitchinterval(), seconds))
+    try:
+        yield
+    finally:
+        with _switch_lock:
+            _switch_users -= 1
+            if not _switch_users:
+                sys.setswitchinterval(_switch_previous)
+
+
+def collapsed_stacks(stacks, max_bytes):
+    """
+    "frame;frame;frame count" lines, most frequent stacks first, up to max_bytes.
+    Returns the text and the number of stacks left out.
+    """
+    lines = []
+    size = 0
+    ordered = stacks.most_common()
+    for i, (stack, count) in enumerate(ordered):
+        line = f'{stack} {count}\n'
+        size += len(line.encode())
+        if size > max_bytes:
+            return ''.join(lines), len(ordered) - i
+        lines.append(line)
+    return ''.join(lines), 0
+
+
+def _stack_tree(stacks):
+    root = {'count': 0, 'children': {}}
+    for stack, count in stacks.items():
+        node = root
+        node['count'] += count
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name, {'count': 0, 'children': {}})
+            node['count'] += count
+    return root
+
+
+def _flame_color(name):
+    if name.startswith(('pandas.', 'numpy.')):
+        return 'p'
+    if name.startswith(('analytics.', 'config.')):
+        return 'a'
+    if name.startswith('django.'):
+        return 'd'
+    return 'o'
+
+
+def _flame_boxes(node, total, min_count):
+    boxes = []
+    for name, child in sorted(node['children'].items(), key=lambda item: item[1]['count'], reverse=True):
+        if child['count'] < min_count:
+            break
+        boxes.append(
+            f'<div class="f {_flame_color(name)}" style="width:{child["count"] / node["count"] * 100:.3f}%" '
+            f'title="{escape(name)}: {child["count"]} ({child["count"] / total:.1%})">'
+            f'<span>{escape(name)}</span><div class="c">{_flame_boxes(child, total, min_count)}</div></div>'
+        )
+    return ''.join(boxes)
+
+
+def flame_graph_html(stacks, title, max_bytes):
+    """Flame graph page (callers on top) of the stacks, with the functions most often on top of the stack."""
+    total = sum(stacks.values())
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    rows = ''.join(
+        f'<tr><td>{count}</td><td>{count / total:.1%}</td><td>{escape(name)}</td></tr>'
+        for name, count in leaves.most_common(TOP_FUNCTIONS)
+    )
+    tree = _stack_tree(stacks)
+
+    # Smaller boxes are left out until the page fits
+    min_share = MIN_FLAME_SHARE
+    while True:
+        page = (
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>{escape(title)}</title><style>'
+            'body{font:13px sans-serif;margin:16px}.c{display:flex}'
+            '.f{box-sizing:border-box;overflow:hidden;white-space:nowrap;border-left:1px solid #fff}'
+            '.f>span{display:block;padding:2px 3px;font:11px monospace;overflow:hidden;text-overflow:ellipsis}'
+            '.p>span{background:#fdba74}.a>span{background:#86efac}.d>span{background:#93c5fd}.o>span{background:#d1d5db}'
+            'td{padding:2px 8px;font-family:monospace}'
+            '</style></head><body>'
+            f'<h1>Профиль запроса {escape(title)}</h1>'
+            f'<p>{total} выборок. Зеленый — analytics, оранжевый — pandas и NumPy, синий — Django. '
+            f'Не показаны вызовы меньше {min_share:.1%} выборок.</p>'
+            f'<div class="c">{_flame_boxes(tree, total, total * min_share)}</div>'
+            f'<h2>Чаще всего на вершине стека</h2><table>{rows}</table>'
+            '</body></html>'
+        )
+        if len(page.encode()) <= max_bytes or min_share >= 1:
+            return page
+        min_share *= 2
+
+
+class ProfileRequestMiddleware:
+    """Staff only: ?__profile=1 or ?__profile=html responds with the profile of the request instead of the page."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        output = request.GET.get(PROFILE_PARAM)
+        if not output or not request.user.is_staff:
+            return self.get_response(request)
+        if output not in ('1', 'html'):
+            return HttpResponseBadRequest(f'{PROFILE_PARAM} must be 1 (collapsed stacks) or html')
+        try:
+            sample_ms = float(request.GET.get(SAMPLE_MS_PARAM, settings.REQUEST_PROFILER_SAMPLE_MS))
+        except ValueError:
+            return HttpResponseBadRequest(f'{SAMPLE_MS_PARAM} must be a number of milliseconds')
+        sample_ms = min(max(sample_ms, MIN_SAMPLE_MS), MAX_SAMPLE_MS)
+
+        started = time.perf_counter()
+        sampler, status = self.profile(request, sample_ms / 1000)
+        wall = time.perf_counter() - started
+
+        match = request.resolver_match
+        name = match.view_name if match else UNRESOLVED
+        max_bytes = settings.REQUEST_PROFILER_MAX_KB * 1024
+        stacks, left_out = collapsed_stacks(sampler.stacks, max_bytes)
+        if output == 'html':
+            title = f'{request.method} {request.get_full_path()} ({name})'
+            response = HttpResponse(flame_graph_html(sampler.stacks, title, max_bytes))
+        else:
+            response = HttpResponse(stacks, content_type='text/plain; charset=utf-8')
+
+        directory = settings.REQUEST_PROFILER_DIR
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            view = re.sub(r'[^\w.-]', '_', name)
+            filename = f'{timezone.now():%Y%m%d-%H%M%S-%f}-{view}-{os.getpid()}.collapsed'
+            with open(os.path.join(directory, filename), 'w') as fh:
+                fh.write(stacks)
+            response['X-Profile-File'] = filename
+        response['X-Profile-Samples'] = sampler.samples
+        response['X-Profile-Stacks-Left-Out'] = left_out
+        response['X-Profile-Status'] = status
+        response['X-Profile-Wall-Ms'] = f'{wall * 1000:.1f}'
+        return response
+
+    def profile(self, request, interval):
+        # Frames of the sampled stack stop below this one
+        stop_code = sys._getframe().f_code
+        with bypass_payload_cache(), _switch_interval(interval), \
+                StackSampler(threading.get_ident(), interval, stop_code) as sampler:
+            response = self.get_response(request)
+            if response.streaming:
+                # Streamed bodies are produced while they are read
+                for _ in response.streaming_content:
+                    pass
+            response.close()
+        return sampler, response.status_code
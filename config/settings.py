@@ -61,6 +61,8 @@ MIDDLEWARE = [
     "django_browser_reload.middleware.BrowserReloadMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # Staff only: ?__profile=1 or ?__profile=html, see config/profiling.py
+    "config.profiling.ProfileRequestMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -91,7 +93,47 @@ WSGI_APPLICATION = "config.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.environ.get('DJANGO_SQLITE_PATH', BASE_DIR / "db.sqlite3"),
+    }
+}
+
+# SQLite profile: "production" (default) tunes every new connection for concurrent
+# readers next to the import worker, "basic" keeps the SQLite defaults.
+DB_PROFILE = os.environ.get('DJANGO_DB_PROFILE', 'production')
+
+SQLITE_PRAGMAS = {
+    # Readers no longer block the writer and the writer no longer blocks readers
+    "journal_mode": "WAL",
+    # In WAL mode only the last commits can be lost on power failure, never consistency
+    "synchronous": "NORMAL",
+    # Negative values are KiB: 64 MB page cache per connection
+    "cache_size": -int(os.environ.get('SQLITE_CACHE_KB', 64000)),
+    "mmap_size": int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    # Wait for a lock instead of failing with "database is locked" right away
+    "busy_timeout": int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    "temp_store": "MEMORY",
+}
+
+if DB_PROFILE == 'production':
+    DATABASES["default"]["OPTIONS"] = {
+        "init_command": ";".join(f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()),
+        # Writers take the write lock when the transaction starts, so a busy writer
+        # waits for busy_timeout instead of failing on the read-to-write lock upgrade
+        "transaction_mode": "IMMEDIATE",
+    }
+    # Keep connections (and their page cache) open between requests
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.environ.get('DJANGO_CONN_MAX_AGE', 600))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# File based, so that the import worker and the web processes share the price data version
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get('DJANGO_CACHE_DIR', BASE_DIR / ".cache"),
     }
 }
 
@@ -115,6 +157,39 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Price storage: "daily" keeps one PriceRecord per product, store and day,
+# "intervals" keeps PriceInterval runs of unchanged prices (see analytics.intervals)
+PRICE_STORAGE = os.environ.get('PRICE_STORAGE', 'daily')
+
+# "on" serves analytics reads from an in-process NumPy price cube (see analytics.cube),
+# built in the background from the rollups after every price change; "off" reads the
+# DailyPriceStat rollup. With PRICE_CUBE_DIR the workers share one memory-mapped file.
+PRICE_CUBE = os.environ.get('PRICE_CUBE', 'off') == 'on'
+PRICE_CUBE_DIR = os.environ.get('PRICE_CUBE_DIR') or None
+
+# Incremental exports hand out a watermark this far in the past and ?since= includes it, so
+# rows stamped before the watermark but committed after it (import chunks, long transactions)
+# are exported again by the next pull; consumers deduplicate on product, store and date
+EXPORT_WATERMARK_LAG_SECONDS = int(os.environ.get('EXPORT_WATERMARK_LAG_SECONDS', 300))
+
+# Home page price trend window in days (?days= overrides, up to the maximum)
+HOME_TREND_DAYS = int(os.environ.get('HOME_TREND_DAYS', 30))
+HOME_TREND_MAX_DAYS = 5 * 365
+
+# Opt-in per-view request statistics (see config/profiling.py), served to staff at /__profiling__/.
+# Requests slower than REQUEST_PROFILING_SLOW_MS are logged with their slowest SQL.
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', 'off') == 'on'
+REQUEST_PROFILING_SLOW_MS = int(os.environ.get('REQUEST_PROFILING_SLOW_MS', 500))
+REQUEST_PROFILING_SAMPLE_MS = float(os.environ.get('REQUEST_PROFILING_SAMPLE_MS', 5))
+if REQUEST_PROFILING:
+    MIDDLEWARE.insert(0, 'config.profiling.RequestProfilingMiddleware')
+
+# Profiles of single requests (?__profile=, staff only): stack sampling interval, size cap
+# of the returned profile, and a directory that also keeps every profile
+REQUEST_PROFILER_SAMPLE_MS = float(os.environ.get('REQUEST_PROFILER_SAMPLE_MS', 1))
+REQUEST_PROFILER_MAX_KB = int(os.environ.get('REQUEST_PROFILER_MAX_KB', 512))
+REQUEST_PROFILER_DIR = os.environ.get('REQUEST_PROFILER_DIR') or None
+
 LOGIN_URL = '/admin/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+from django.test.utils import override_settings
+
+from config.profiling import collapsed_stacks, flame_graph_html, stats
+
+PROFILED_MIDDLEWARE = ['config.profiling.RequestProfilingMiddleware'] + settings.MIDDLEWARE
+
+
+@override_settings(MIDDLEWARE=PROFILED_MIDDLEWARE, ALLOWED_HOSTS=['*'])
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        stats.reset()
+        self.staff = User.objects.create_user('staff', password='staff', is_staff=True)
+
+    def get_stats(self):
+        client = Client()
+        client.force_login(self.staff)
+        return json.loads(client.get('/__profiling__/').content)
+
+    def test_records_requests_per_url_name(self):
+        client = Client()
+        client.get('/analytics/stores/')
+        client.get('/analytics/stores/')
+        response = client.get('/analytics/data/export/')
+        b''.join(response.streaming_content)
+
+        views = self.get_stats()['views']
+        self.assertEqual(views['analytics-stores-list']['requests'], 2)
+        self.assertEqual(views['analytics-stores-list']['queries'], 2)
+        # Streamed responses are measured until the body is sent
+        self.assertEqual(views['analytics-export-data']['queries'], 1)
+        self.assertNotIn('profiling-stats', views)
+
+    @override_settings(REQUEST_PROFILING_SLOW_MS=0)
+    def test_slow_requests_keep_their_sql(self):
+        with self.assertLogs('config.profiling', 'WARNING'):
+            Client(raise_request_exception=True).get('/analytics/stores/')
+
+        slow = self.get_stats()['slow_requests']
+        self.assertEqual(slow[0]['view'], 'analytics-stores-list')
+        self.assertIn('analytics_store', slow[0]['slowest_sql'][0]['sql'])
+
+    def test_prometheus_text(self):
+        Client().get('/analytics/stores/')
+        client = Client()
+        client.force_login(self.staff)
+        text = client.get('/__profiling__/?format=prometheus').content.decode()
+        self.assertIn('django_view_requests_total{view="analytics-stores-list"} 1', text)
+        self.assertIn('django_view_duration_seconds_bucket{view="analytics-stores-list",le="+Inf"} 1', text)
+
+    def test_staff_only(self):
+        self.assertEqual(Client().get('/__profiling__/').status_code, 404)
+
+
+@override_settings(ALLOWED_HOSTS=['*'])
+class ProfileRequestTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('staff', password='staff', is_staff=True))
+
+    def test_staff_get_collapsed_stacks(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(REQUEST_PROFILER_DIR=directory):
+            response = self.client.get('/analytics/dashboard/?days=365&__profile=1&__sample_ms=0.5')
+            self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+            self.assertEqual(response['X-Profile-Status'], '200')
+            with open(os.path.join(directory, response['X-Profile-File'])) as fh:
+                self.assertEqual(fh.read(), response.content.decode())
+        for line in response.content.decode().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+
+    def test_flame_graph_page(self):
+        response = self.client.get('/analytics/dashboard/?__profile=html')
+        self.assertContains(response, 'Профиль запроса')
+
+    def test_others_get_the_page(self):
+        self.client.logout()
+        response = self.client.get('/analytics/dashboard/?__profile=1')
+        self.assertNotIn('X-Profile-Samples', response)
+        self.assertContains(response, '<html', status_code=200)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/analytics/dashboard/?__profile=svg').status_code, 400)
+
+    def test_size_cap_keeps_the_most_frequent_stacks(self):
+        stacks = Counter({'a;b': 5, 'a;c': 3, 'a;d': 1})
+        text, left_out = collapsed_stacks(stacks, max_bytes=len('a;b 5\na;c 3\n'))
+        self.assertEqual(text, 'a;b 5\na;c 3\n')
+        self.assertEqual(left_out, 1)
+        self.assertLess(len(flame_graph_html(stacks, 'GET /', max_bytes=1)), 2000)
@@ -18,11 +18,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from analytics.views import home
+from config.profiling import stats_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('analytics/', include('analytics.urls')),
     path('crud/', include('crudbuilder.urls')),
     path("__reload__/", include("django_browser_reload.urls")),
+    path('__profiling__/', stats_view, name='profiling-stats'),
     path('', home, name='home'),
 ]